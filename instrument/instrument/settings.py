@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -21,12 +22,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'main.middleware.AnonymousShoppingMiddleware',
+    'main.middleware.AnonymousPageCacheMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -45,6 +49,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'main.context_processors.shopping',
+                'main.context_processors.navigation',
             ],
         },
     },
@@ -53,10 +59,90 @@ TEMPLATES = [
 WSGI_APPLICATION = 'instrument.wsgi.application'
 
 
-DATABASES = {
+# Профиль базы данных задаётся переменными окружения:
+# DJANGO_DB_ENGINE=sqlite (по умолчанию) или postgresql.
+DB_ENGINE = os.environ.get('DJANGO_DB_ENGINE', 'sqlite')
+# Сколько секунд соединение живёт между запросами (0 — закрывать
+# после каждого запроса); перед повторным использованием оно
+# проверяется (CONN_HEALTH_CHECKS).
+DB_CONN_MAX_AGE = int(os.environ.get('DJANGO_DB_CONN_MAX_AGE', 60))
+
+if DB_ENGINE == 'postgresql':
+    # Нужен пакет psycopg (или psycopg2), в requirements.txt его нет.
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DJANGO_DB_NAME', 'instrument'),
+            'USER': os.environ.get('DJANGO_DB_USER', 'instrument'),
+            'PASSWORD': os.environ.get('DJANGO_DB_PASSWORD', ''),
+            'HOST': os.environ.get('DJANGO_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DJANGO_DB_PORT', '5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'connect_timeout': int(
+                    os.environ.get('DJANGO_DB_CONNECT_TIMEOUT', 5)
+                ),
+                # Зависший запрос или забытая транзакция не держат
+                # соединение и блокировки дольше заданного, в мс.
+                'options': (
+                    '-c statement_timeout={} '
+                    '-c idle_in_transaction_session_timeout={}'.format(
+                        os.environ.get('DJANGO_DB_STATEMENT_TIMEOUT', 5000),
+                        os.environ.get('DJANGO_DB_IDLE_TIMEOUT', 60000),
+                    )
+                ),
+            },
+        }
+    }
+else:
+    # Ожидание блокировки задаёт только OPTIONS['timeout'] ниже.
+    SQLITE_PRAGMAS = {
+        # Отрицательное значение — размер в КиБ: 64 МиБ.
+        'cache_size': -65536,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'memory',
+    }
+    # Режим журнала записывается в сам файл базы, поэтому WAL
+    # включается явно: DJANGO_SQLITE_JOURNAL_MODE=wal. В WAL чтение
+    # не блокируется записью, а запись — чтением; synchronous=NORMAL
+    # в этом режиме не теряет целостность, но не ждёт fsync на каждой
+    # транзакции.
+    SQLITE_JOURNAL_MODE = os.environ.get('DJANGO_SQLITE_JOURNAL_MODE')
+    if SQLITE_JOURNAL_MODE:
+        SQLITE_PRAGMAS['journal_mode'] = SQLITE_JOURNAL_MODE
+        if SQLITE_JOURNAL_MODE.lower() == 'wal':
+            SQLITE_PRAGMAS['synchronous'] = 'normal'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DJANGO_DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # Сколько секунд ждать освобождения блокировки записи.
+                'timeout': 20,
+            },
+            # Выполняются при каждом новом соединении (main.db).
+            'PRAGMAS': SQLITE_PRAGMAS,
+            # Тестовая база в файле: у общей in-memory базы SQLite
+            # параллельные транзакции сразу падают с «table is locked»,
+            # а не ждут блокировку, и тесты конкурентности невозможны.
+            'TEST': {
+                'NAME': BASE_DIR / 'test_db.sqlite3',
+            },
+        }
+    }
+
+# Кэш должен быть общим для всех воркеров (например, Redis или
+# файловый), иначе счётчики версий каталога не видны другим процессам.
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': os.environ.get(
+            'DJANGO_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'instrument'),
     }
 }
 
@@ -93,6 +179,23 @@ STATICFILES_DIRS = [
     BASE_DIR / 'static_dev'
 ]
 
+STATIC_ROOT = BASE_DIR / 'static'
+
+# collectstatic добавляет в имена файлов хэш содержимого и кладёт рядом
+# сжатые копии (.gz, .br при установленном brotli); в DEBUG и до первой
+# сборки используются исходные имена.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'main.staticfiles.PrecompressedManifestStaticFilesStorage',
+    },
+}
+# CSS-файлы, из которых при сборке удаляются правила с классами,
+# не встречающимися в шаблонах и коде.
+STATIC_PURGE_CSS = ('css/bootstrap.min.css',)
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_ROOT = BASE_DIR / 'media'
@@ -102,3 +205,75 @@ EMAIL_BACKEND = 'django.cor.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = BASE_DIR / 'sent_emails'
 
 LOGIN_REDIRECT_URL = 'main:index'
+
+# Курсорная пагинация списков каталога вместо OFFSET.
+CATALOG_KEYSET_PAGINATION = False
+# Сколько секунд хранить в кэше количество объектов для пагинатора.
+PAGINATOR_COUNT_TIMEOUT = 60
+
+# Кэш страниц для анонимных посетителей: имя маршрута -> время жизни
+# записи в секундах. Страницы, которых нет в списке, не кэшируются.
+# Страница продукта в списке не нужна: на ней формы корзины и избранного
+# с CSRF-токеном, такие ответы кэш не сохраняет.
+PAGE_CACHE_TIMEOUTS = {
+    'main:index': 60,
+    'main:category_list': 300,
+    'main:category_detail': 120,
+    'main:product_type_detail': 120,
+    'pages:about': 3600,
+    'pages:buyers': 3600,
+    'pages:contacts': 3600,
+}
+# Параметры запроса, которые входят в ключ кэша страниц: пагинация и
+# фильтры каталога. Запросы с другими параметрами кэш обходят.
+PAGE_CACHE_QUERY_PARAMS = (
+    'page', 'cursor', 'min_price', 'max_price', 'price', 'manufacturer',
+    'rating',
+)
+
+# Учёт запросов к БД (main.middleware.QueryInstrumentationMiddleware):
+# заголовок Server-Timing и предупреждение в логе main.instrumentation
+# при превышении бюджета маршрута.
+SQL_SERVER_TIMING = True
+# JSON-строка с метриками каждого запроса (уровень INFO) — для
+# профилирования; по умолчанию выключена.
+SQL_LOG_REQUESTS = os.environ.get('DJANGO_SQL_LOG_REQUESTS') == '1'
+# С какого числа одинаковых запросов они считаются N+1.
+SQL_DUPLICATE_THRESHOLD = 3
+# Бюджеты маршрутов: queries — запросов к БД, db_ms — их время в мс,
+# max_repeats — повторов одного запроса. Превышение пишется в лог
+# предупреждением, а при SQL_BUDGET_RAISE = True (тесты) — исключение.
+SQL_DEFAULT_BUDGET = {'queries': 30, 'max_repeats': 5}
+SQL_BUDGETS = {
+    'main:index': {'queries': 10, 'db_ms': 200, 'max_repeats': 2},
+    'main:category_detail': {'queries': 10, 'db_ms': 200, 'max_repeats': 2},
+    'main:product_type_detail': {'queries': 10, 'db_ms': 200, 'max_repeats': 2},
+    'main:product_detail': {'queries': 8, 'db_ms': 200, 'max_repeats': 2},
+    'main:comment_list': {'queries': 6, 'db_ms': 100, 'max_repeats': 2},
+    'main:search': {'queries': 8, 'db_ms': 300, 'max_repeats': 2},
+    'main:cart_view': {'queries': 8, 'db_ms': 200, 'max_repeats': 2},
+    'main:favorite_view': {'queries': 8, 'db_ms': 200, 'max_repeats': 2},
+    'main:history_view': {'queries': 8, 'db_ms': 200, 'max_repeats': 2},
+    # Первый POST пользователя создаёт корзину и избранное через
+    # get_or_create: на каждое SELECT, INSERT и пара SAVEPOINT.
+    'main:shopping_api': {'queries': 18, 'db_ms': 200, 'max_repeats': 2},
+}
+SQL_BUDGET_RAISE = False
+
+# Тесты идут с SQL_BUDGET_RAISE = True.
+TEST_RUNNER = 'main.testing.BudgetTestRunner'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'main.instrumentation': {
+            'handlers': ['console'],
+            'level': os.environ.get('DJANGO_SQL_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
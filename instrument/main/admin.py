@@ -1,18 +1,70 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.db.models import F
+from django.db.models.functions import Round
 
+from . import search, services, versioning
 from .models import (
-    Cart, Category,
+    Cart, CartItem, Category,
     Comment, Favorite,
     Product, ProductType,
     Manufacturer,
-    OrderHistory,
+    OrderHistory, OrderItem,
     Rating
 )
+from .paginators import EstimatedCountPaginator
 
 # admin 1234
 
 
-class ProductAdmin(admin.ModelAdmin):
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Список большой таблицы: без фильтров количество берётся из
+    статистики СУБД, и второй COUNT(*) по всей таблице для надписи
+    «из N» не выполняется.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class PublishActionsMixin:
+    """Публикация и снятие с публикации выбранного одним UPDATE."""
+
+    actions = ('publish', 'unpublish')
+
+    def published_changed(self):
+        """То, что при сохранении по одному сделали бы сигналы."""
+        versioning.bump_version()
+
+    def set_published(self, request, queryset, value):
+        updated = queryset.update(is_published=value)
+        self.published_changed()
+        self.message_user(
+            request,
+            f'{"Опубликовано" if value else "Снято с публикации"}: {updated}',
+            messages.SUCCESS
+        )
+
+    @admin.action(description='Опубликовать выбранные')
+    def publish(self, request, queryset):
+        self.set_published(request, queryset, True)
+
+    @admin.action(description='Снять с публикации выбранные')
+    def unpublish(self, request, queryset):
+        self.set_published(request, queryset, False)
+
+
+class ProductActionForm(ActionForm):
+    percent = forms.FloatField(
+        required=False,
+        min_value=-99,
+        label='Изменить цену на, %'
+    )
+
+
+class ProductAdmin(PublishActionsMixin, LargeTableAdmin):
     list_display = (
         'title',
         'category',
@@ -23,9 +75,44 @@ class ProductAdmin(admin.ModelAdmin):
         'manufacturer'
     )
     list_editable = ('is_published',)
+    list_select_related = ('category', 'product_type', 'manufacturer')
     search_fields = ('title',)
-    list_filter = ('category',)
+    list_filter = ('category', 'is_published')
     list_display_links = ('title',)
+    autocomplete_fields = ('category', 'product_type', 'manufacturer')
+    action_form = ProductActionForm
+    actions = (*PublishActionsMixin.actions, 'change_price')
+
+    def get_search_results(self, request, queryset, search_term):
+        """Поиск по полнотекстовому индексу вместо LIKE по всей таблице."""
+        if search_term and search.is_available():
+            return search.search_products(queryset, search_term), False
+        return super().get_search_results(request, queryset, search_term)
+
+    def published_changed(self):
+        services.products_changed_in_bulk()
+
+    @admin.action(description='Изменить цену выбранных на указанный процент')
+    def change_price(self, request, queryset):
+        form = self.action_form(request.POST)
+        form.fields['action'].choices = self.get_action_choices(request)
+        if not form.is_valid() or form.cleaned_data['percent'] is None:
+            self.message_user(
+                request,
+                'Укажите процент изменения цены не меньше -99.',
+                messages.ERROR
+            )
+            return
+        percent = form.cleaned_data['percent']
+        updated = queryset.update(
+            price=Round(F('price') * (1 + percent / 100), 2)
+        )
+        services.products_changed_in_bulk()
+        self.message_user(
+            request,
+            f'Цена изменена на {percent:g}% у продуктов: {updated}',
+            messages.SUCCESS
+        )
 
 
 class CategoryAdmin(admin.ModelAdmin):
@@ -49,26 +136,45 @@ class ProductTypeAdmin(admin.ModelAdmin):
         'created_at',
     )
     list_editable = ('is_published',)
+    list_select_related = ('category',)
     search_fields = ('title',)
     list_display_links = ('title',)
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(PublishActionsMixin, LargeTableAdmin):
     list_display = (
         'author',
         'text',
         'created_at',
-        'product_id'
+        'product_id',
+        'is_published'
     )
-    search_fields = ('author',)
+    list_select_related = ('author', 'product_id')
+    search_fields = ('author__username',)
     list_display_links = ('author',)
-    list_filter = ('created_at',)
+    list_filter = ('is_published', 'created_at')
+    autocomplete_fields = ('author', 'product_id')
 
 
-class CartAndFavoriteAdmin(admin.ModelAdmin):
+class CartItemInline(admin.TabularInline):
+    model = CartItem
+    autocomplete_fields = ('product',)
+    extra = 0
+
+
+class CartAndFavoriteAdmin(LargeTableAdmin):
     list_display = ('user',)
-    search_fields = ('user',)
-    list_filter = ('product',)
+    list_select_related = ('user',)
+    search_fields = ('user__username',)
+    autocomplete_fields = ('user',)
+
+
+class CartAdmin(CartAndFavoriteAdmin):
+    inlines = (CartItemInline,)
+
+
+class FavoriteAdmin(CartAndFavoriteAdmin):
+    autocomplete_fields = ('user', 'product')
 
 
 class ManufacturerAdmin(admin.ModelAdmin):
@@ -78,23 +184,70 @@ class ManufacturerAdmin(admin.ModelAdmin):
         'created_at'
     )
     list_editable = ('is_published',)
+    search_fields = ('name',)
 
 
-class RatingAdmin(admin.ModelAdmin):
+class RatingAdmin(LargeTableAdmin):
     list_display = (
         'rating',
         'product',
         'user',
         'created_at'
     )
+    list_select_related = ('product', 'user')
+    list_filter = ('rating',)
+    search_fields = ('user__username',)
+    autocomplete_fields = ('product', 'user')
+
+
+class OrderItemInline(admin.TabularInline):
+    """Позиции заказа — снимок на момент оформления, только для чтения."""
+
+    model = OrderItem
+    fields = (
+        'title',
+        'category_slug',
+        'product_type_slug',
+        'quantity',
+        'price'
+    )
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class OrderHistoryAdmin(LargeTableAdmin):
+    list_display = (
+        'id',
+        'user',
+        'created_at',
+        'item_count',
+        'total_price'
+    )
+    list_select_related = ('user',)
+    list_display_links = ('id',)
+    list_filter = ('created_at',)
+    search_fields = ('user__username',)
+    readonly_fields = (
+        'created_at',
+        'item_count',
+        'total_price',
+        'idempotency_key'
+    )
+    autocomplete_fields = ('user',)
+    raw_id_fields = ('cart',)
+    inlines = (OrderItemInline,)
 
 
 admin.site.register(Product, ProductAdmin)
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(ProductType, ProductTypeAdmin)
 admin.site.register(Comment, CommentAdmin)
-admin.site.register(Cart, CartAndFavoriteAdmin)
-admin.site.register(Favorite, CartAndFavoriteAdmin)
+admin.site.register(Cart, CartAdmin)
+admin.site.register(Favorite, FavoriteAdmin)
 admin.site.register(Rating, RatingAdmin)
 admin.site.register(Manufacturer, ManufacturerAdmin)
-admin.site.register(OrderHistory)
+admin.site.register(OrderHistory, OrderHistoryAdmin)
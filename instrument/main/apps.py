@@ -4,4 +4,7 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
-    verbose_name = 'Инструменты'
\ No newline at end of file
+    verbose_name = 'Инструменты'
+
+    def ready(self):
+        from . import db, signals  # noqa: F401
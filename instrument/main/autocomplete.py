@@ -0,0 +1,294 @@
+"""
+Подсказки поиска по мере ввода.
+
+Названия продуктов, категорий и типов продуктов хранятся в памяти
+процесса в отсортированном списке ключей, поиск по префиксу — это
+bisect и короткий проход по диапазону. Для одно- и двухбуквенных
+префиксов лучшие результаты посчитаны заранее. Индекс привязан к
+счётчику изменений каталога (main.versioning): изменения в своём процессе
+вносятся точечно, остальные процессы перестраивают индекс, увидев
+новую версию.
+
+Разделы попадают в подсказки, только если в них есть опубликованные
+продукты, и ранжируются по их среднему рейтингу. Появление продукта
+по дате публикации счётчик не меняет, поэтому индекс сам устаревает
+к ближайшей такой дате и не позже чем через AUTOCOMPLETE_MAX_AGE
+секунд — так подтягиваются и медленно меняющиеся ранги разделов.
+"""
+import heapq
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Min
+from django.urls import reverse
+from django.utils import timezone
+
+from . import versioning
+from .models import Category, Product, ProductType
+from .search import WORD_RE
+
+# Счётчик изменений каталога, на который опирается индекс.
+NAMESPACE = 'autocomplete'
+PRODUCT = 'products'
+CATEGORY = 'categories'
+PRODUCT_TYPE = 'product_types'
+KINDS = (PRODUCT, CATEGORY, PRODUCT_TYPE)
+# Префиксы не длиннее этого значения отвечают из заранее
+# посчитанных списков лучших результатов.
+SHORT_PREFIX_LENGTH = 2
+TOP_LIMIT = 20
+AUTOCOMPLETE_MAX_AGE = getattr(settings, 'AUTOCOMPLETE_MAX_AGE', 600)
+
+
+def normalize(text):
+    return (text or '').lower().replace('ё', 'е')
+
+
+class PrefixIndex:
+    """Отсортированный список ключей вида (ключ, вид, id) и их данные."""
+
+    def __init__(self, expires_at=None):
+        self.keys = []
+        self.items = {}
+        self.item_keys = {}
+        self.short = {}
+        self.expires_at = expires_at
+
+    @staticmethod
+    def _item_keys(kind, pk, title):
+        """Ключи для названия и для каждого слова в нём."""
+        title = normalize(title)
+        keys = {(title, kind, pk)}
+        for match in WORD_RE.finditer(title):
+            keys.add((title[match.start():], kind, pk))
+        return keys
+
+    def add(self, kind, pk, title, rank, url, sort=True):
+        self.items[(kind, pk)] = {
+            'title': title,
+            'rank': rank,
+            'url': url,
+        }
+        keys = self._item_keys(kind, pk, title)
+        self.item_keys[(kind, pk)] = keys
+        for key in keys:
+            if sort:
+                insort(self.keys, key)
+            else:
+                self.keys.append(key)
+
+    def remove(self, kind, pk):
+        for key in self.item_keys.pop((kind, pk), ()):
+            index = bisect_left(self.keys, key)
+            if index < len(self.keys) and self.keys[index] == key:
+                del self.keys[index]
+        self.items.pop((kind, pk), None)
+
+    def _scan(self, prefix):
+        found = {kind: set() for kind in KINDS}
+        index = bisect_left(self.keys, (prefix,))
+        while index < len(self.keys) and self.keys[index][0].startswith(prefix):
+            _, kind, pk = self.keys[index]
+            found[kind].add(pk)
+            index += 1
+        return {
+            kind: heapq.nlargest(
+                TOP_LIMIT,
+                pks,
+                key=lambda pk, kind=kind: (self.items[(kind, pk)]['rank'], -pk)
+            )
+            for kind, pks in found.items()
+        }
+
+    def refresh_short(self, prefixes=None):
+        """Пересчитывает лучшие результаты для коротких префиксов."""
+        if prefixes is None:
+            self.short = {}
+            prefixes = {
+                key[0][:length]
+                for key in self.keys
+                for length in range(1, SHORT_PREFIX_LENGTH + 1)
+            }
+        for prefix in prefixes:
+            if prefix:
+                self.short[prefix] = self._scan(prefix)
+
+    def lookup(self, prefix, limit):
+        prefix = normalize(prefix).strip()
+        if not prefix:
+            return {kind: [] for kind in KINDS}
+        if len(prefix) <= SHORT_PREFIX_LENGTH:
+            found = self.short.get(prefix) or {kind: [] for kind in KINDS}
+        else:
+            found = self._scan(prefix)
+        return {
+            kind: [
+                dict(self.items[(kind, pk)], id=pk)
+                for pk in pks[:limit]
+            ]
+            for kind, pks in found.items()
+        }
+
+
+def _product_entry(product):
+    return (
+        PRODUCT,
+        product.pk,
+        product.title,
+        product.average_rating,
+        reverse(
+            'main:product_detail',
+            args=(product.category.slug, product.product_type.slug, product.pk)
+        ),
+    )
+
+
+def _products():
+    return Product.objects.published().select_related(
+        'category',
+        'product_type'
+    ).only(
+        'title', 'average_rating', 'category__slug', 'product_type__slug'
+    )
+
+
+def next_publication(queryset):
+    """
+    Когда ближайший из продуктов станет виден по дате публикации.
+
+    published() сравнивает время с точностью до минуты, поэтому
+    продукт появляется в начале следующей минуты после pub_date.
+    """
+    pub_date = queryset.scheduled().aggregate(next=Min('pub_date'))['next']
+    if pub_date is None:
+        return None
+    minute = pub_date.replace(second=0, microsecond=0)
+    return minute if minute == pub_date else minute + timedelta(minutes=1)
+
+
+def build_index():
+    expires_at = timezone.now() + timedelta(seconds=AUTOCOMPLETE_MAX_AGE)
+    scheduled = next_publication(Product.objects.all())
+    index = PrefixIndex(
+        expires_at if scheduled is None else min(expires_at, scheduled)
+    )
+    # Сумма и число рейтингов опубликованных продуктов по разделам.
+    category_ranks = defaultdict(lambda: [0, 0])
+    product_type_ranks = defaultdict(lambda: [0, 0])
+    for product in _products().iterator(chunk_size=2000):
+        index.add(*_product_entry(product), sort=False)
+        for ranks, pk in (
+            (category_ranks, product.category_id),
+            (product_type_ranks, product.product_type_id),
+        ):
+            ranks[pk][0] += product.average_rating
+            ranks[pk][1] += 1
+    for category in Category.objects.filter(
+        is_published=True,
+        pk__in=list(category_ranks)
+    ):
+        total, count = category_ranks[category.pk]
+        index.add(
+            CATEGORY,
+            category.pk,
+            category.title,
+            total / count,
+            reverse('main:category_detail', args=(category.slug,)),
+            sort=False
+        )
+    for product_type in ProductType.objects.filter(
+        pk__in=list(product_type_ranks)
+    ).select_related('category'):
+        total, count = product_type_ranks[product_type.pk]
+        index.add(
+            PRODUCT_TYPE,
+            product_type.pk,
+            product_type.title,
+            total / count,
+            reverse(
+                'main:product_type_detail',
+                args=(product_type.category.slug, product_type.slug)
+            ),
+            sort=False
+        )
+    index.keys.sort()
+    index.refresh_short()
+    return index
+
+
+_lock = threading.Lock()
+_state = {'index': None, 'version': None}
+
+
+def _is_stale(version):
+    index = _state['index']
+    return (
+        index is None
+        or _state['version'] != version
+        or index.expires_at <= timezone.now()
+    )
+
+
+def get_index():
+    """Индекс текущей версии каталога, при необходимости перестроенный."""
+    version = versioning.get_version(NAMESPACE)
+    if _is_stale(version):
+        with _lock:
+            if _is_stale(version):
+                _state['index'] = build_index()
+                _state['version'] = version
+    return _state['index']
+
+
+def suggest(prefix, limit=8):
+    return get_index().lookup(prefix, limit)
+
+
+def _patch(kind, pk, entry, previous_version, version, expires_at=None):
+    """
+    Точечно обновляет индекс своего процесса после изменения объекта.
+
+    Если индекс был актуален до изменения, он остаётся актуальным и
+    для новой версии; иначе он перестроится при следующем обращении.
+    """
+    with _lock:
+        index = _state['index']
+        if index is None or _state['version'] != previous_version:
+            return
+        if expires_at is not None:
+            index.expires_at = min(index.expires_at, expires_at)
+        old_keys = index.item_keys.get((kind, pk), set())
+        index.remove(kind, pk)
+        if entry is not None:
+            index.add(*entry)
+        new_keys = index.item_keys.get((kind, pk), set())
+        index.refresh_short({
+            key[0][:length]
+            for key in old_keys | new_keys
+            for length in range(1, SHORT_PREFIX_LENGTH + 1)
+        })
+        _state['version'] = version
+
+
+def product_changed(product_id, deleted=False):
+    """Продукт изменён или удалён: новая версия индекса и точечная правка."""
+    version = versioning.bump_version(NAMESPACE)
+    if _state['index'] is None or _state['version'] != version - 1:
+        return
+    entry = scheduled = None
+    if not deleted:
+        product = _products().filter(pk=product_id).first()
+        if product is not None:
+            entry = _product_entry(product)
+        else:
+            # Продукт с датой публикации в будущем появится сам.
+            scheduled = next_publication(Product.objects.filter(pk=product_id))
+    _patch(PRODUCT, product_id, entry, version - 1, version, scheduled)
+
+
+def catalog_changed():
+    """Изменились категории или типы: индекс перестроится целиком."""
+    versioning.bump_version(NAMESPACE)
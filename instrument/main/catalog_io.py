@@ -0,0 +1,303 @@
+"""
+Потоковые импорт и экспорт каталога продуктов в CSV и JSON Lines.
+
+Строки читаются и пишутся по одной, поэтому память не зависит от
+размера файла. Категория и тип продукта указываются слагом,
+производитель — названием; все три справочника держатся в памяти
+целиком, так что строка разрешается без запросов к базе. Строка с id
+существующего продукта обновляет его, строка без id создаёт новый.
+Запись идёт пачками, каждая — в своей транзакции: новые продукты
+вставляются через bulk_create, изменившиеся обновляются одним
+executemany, а строки, совпадающие с базой, пропускаются.
+
+Сигналы при пакетной записи не вызываются, поэтому импорт сам
+обновляет поисковый индекс пачки, а в конце сбрасывает версии
+закэшированных страниц, фасетов, снимков и подсказок. Картинки
+не переносятся.
+"""
+import csv
+import gzip
+import json
+import sys
+from contextlib import nullcontext
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import search, services
+from .models import Category, Manufacturer, Product, ProductType
+
+FORMATS = ('csv', 'jsonl')
+FIELDS = (
+    'id', 'title', 'description', 'parameters', 'category', 'product_type',
+    'manufacturer', 'price', 'pub_date', 'is_published',
+)
+# Поля продукта, которые задаёт импорт; счётчики и картинки не меняются.
+UPDATE_FIELDS = (
+    'title', 'description', 'parameters', 'category', 'product_type',
+    'manufacturer', 'price', 'pub_date', 'is_published',
+)
+# Поля, от которых зависит документ продукта в поисковом индексе.
+SEARCH_FIELDS = ('title', 'description', 'parameters', 'manufacturer_id')
+# Связи проверяются по справочникам в памяти, а не запросами clean_fields.
+NOT_CLEANED = (
+    'id', 'category', 'product_type', 'manufacturer', 'image',
+    'image_variants', 'created_at', 'rating_count', 'rating_sum',
+    'average_rating', 'comment_count',
+)
+BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 2000
+
+
+def detect_format(path, explicit=None):
+    """Формат из параметра или из расширения файла (.csv, .jsonl, .gz)."""
+    if explicit:
+        return explicit
+    name = path[:-3] if path.endswith('.gz') else path
+    for fmt in FORMATS:
+        if name.endswith(f'.{fmt}'):
+            return fmt
+    raise ValueError(
+        f'Не удалось определить формат {path}: укажите {", ".join(FORMATS)}.'
+    )
+
+
+def open_text(path, mode):
+    """Текстовый поток файла, .gz-архива или stdin/stdout для «-»."""
+    if path == '-':
+        return nullcontext(sys.stdin if mode == 'r' else sys.stdout)
+    if path.endswith('.gz'):
+        return gzip.open(path, f'{mode}t', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def read_rows(stream, fmt):
+    """Строки файла: (номер строки, словарь или None, ошибка разбора)."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield number, None, f'некорректный JSON: {error}'
+            continue
+        if not isinstance(row, dict):
+            yield number, None, 'строка должна быть объектом JSON'
+            continue
+        yield number, row, None
+
+
+def export_rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Продукты как словари FIELDS; связи читаются тем же запросом."""
+    values = queryset.order_by('pk').values_list(
+        'pk', 'title', 'description', 'parameters', 'category__slug',
+        'product_type__slug', 'manufacturer__name', 'price', 'pub_date',
+        'is_published',
+    )
+    for row in values.iterator(chunk_size=chunk_size):
+        row = dict(zip(FIELDS, row))
+        row['manufacturer'] = row['manufacturer'] or ''
+        row['pub_date'] = row['pub_date'].isoformat()
+        yield row
+
+
+def write_rows(stream, fmt, rows):
+    """Пишет строки в поток и возвращает их количество."""
+    total = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            total += 1
+        return total
+    for row in rows:
+        stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+        total += 1
+    return total
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+class ProductImporter:
+    """Загружает строки продуктов пачками с обновлением по id."""
+
+    def __init__(self, batch_size=BATCH_SIZE, dry_run=False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.categories = Category.objects.in_bulk(field_name='slug')
+        self.categories_by_id = {
+            category.pk: category for category in self.categories.values()
+        }
+        self.product_types = ProductType.objects.in_bulk(field_name='slug')
+        self.manufacturers = Manufacturer.objects.in_bulk(field_name='name')
+        self.now = timezone.now()
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.rejected = 0
+
+    def run(self, rows, on_batch=None, on_reject=None):
+        """
+        Обрабатывает строки read_rows. on_batch вызывается после каждой
+        пачки, on_reject — для каждой отклонённой строки с номером,
+        исходной строкой и словарём ошибок.
+        """
+        batch = []
+        for number, row, error in rows:
+            self.rows += 1
+            if error is None:
+                product, errors = self.build(row)
+            else:
+                product, errors = None, {'__all__': [error]}
+            if errors:
+                self.rejected += 1
+                if on_reject is not None:
+                    on_reject(number, row, errors)
+                continue
+            batch.append((number, row, product))
+            if len(batch) >= self.batch_size:
+                self.save(batch, on_reject)
+                batch = []
+                if on_batch is not None:
+                    on_batch(self)
+        if batch:
+            self.save(batch, on_reject)
+            if on_batch is not None:
+                on_batch(self)
+        if (self.created or self.updated) and not self.dry_run:
+            services.products_changed_in_bulk()
+        return self
+
+    def build(self, row):
+        """Несохранённый продукт из строки и ошибки проверки."""
+        errors = {}
+        product_id = _text(row.get('id'))
+        category_slug = _text(row.get('category'))
+        product_type = self.product_types.get(_text(row.get('product_type')))
+        if product_type is None:
+            errors['product_type'] = [
+                f'Тип продукта «{_text(row.get("product_type"))}» не найден.'
+            ]
+        if category_slug:
+            category = self.categories.get(category_slug)
+            if category is None:
+                errors['category'] = [f'Категория «{category_slug}» не найдена.']
+        elif product_type is not None:
+            # Без категории продукт попадает в категорию своего типа.
+            category = self.categories_by_id[product_type.category_id]
+        manufacturer_name = _text(row.get('manufacturer'))
+        manufacturer = None
+        if manufacturer_name:
+            manufacturer = self.manufacturers.get(manufacturer_name)
+            if manufacturer is None:
+                errors['manufacturer'] = [
+                    f'Производитель «{manufacturer_name}» не найден.'
+                ]
+        if product_id and not product_id.isdigit():
+            errors['id'] = [f'Некорректный id «{product_id}».']
+        if errors:
+            return None, errors
+        product = Product(
+            pk=int(product_id) if product_id else None,
+            title=_text(row.get('title')),
+            description=_text(row.get('description')),
+            parameters=_text(row.get('parameters')),
+            category=category,
+            product_type=product_type,
+            manufacturer=manufacturer,
+            price=_text(row.get('price')) or Product._meta.get_field(
+                'price'
+            ).get_default(),
+            pub_date=_text(row.get('pub_date')) or self.now,
+        )
+        if _text(row.get('is_published')):
+            product.is_published = _text(row.get('is_published'))
+        try:
+            product.clean_fields(exclude=NOT_CLEANED)
+        except ValidationError as error:
+            return None, error.message_dict
+        if timezone.is_naive(product.pub_date):
+            product.pub_date = timezone.make_aware(product.pub_date)
+        return product, {}
+
+    def save(self, batch, on_reject=None):
+        """
+        Одна пачка: новые продукты создаются, изменившиеся обновляются,
+        совпадающие с базой строки не пишутся вовсе.
+        """
+        fields = [Product._meta.get_field(name) for name in UPDATE_FIELDS]
+        ids = {product.pk for _, _, product in batch if product.pk}
+        current = {
+            row[0]: row[1:]
+            for row in Product.objects.filter(pk__in=ids).values_list(
+                'pk', *(field.attname for field in fields)
+            )
+        } if ids else {}
+        new, changed, reindexed = [], {}, []
+        for number, row, product in batch:
+            if product.pk is None:
+                new.append(product)
+            elif product.pk in current:
+                values = tuple(getattr(product, field.attname) for field in fields)
+                if values != current[product.pk]:
+                    # Повтор id в пачке: побеждает последняя строка.
+                    changed[product.pk] = product
+            else:
+                self.rejected += 1
+                if on_reject is not None:
+                    on_reject(
+                        number, row, {'id': [f'Продукт {product.pk} не найден.']}
+                    )
+        for product in changed.values():
+            previous = dict(zip(
+                (field.attname for field in fields), current[product.pk]
+            ))
+            if any(
+                getattr(product, name) != previous[name] for name in SEARCH_FIELDS
+            ):
+                reindexed.append(product)
+        self.created += len(new)
+        self.updated += len(changed)
+        self.unchanged += len(current) - len(changed)
+        if self.dry_run:
+            return
+        with transaction.atomic():
+            Product.objects.bulk_create(new, batch_size=self.batch_size)
+            self._update(fields, changed.values())
+            search.index_products([*new, *reindexed])
+
+    @staticmethod
+    def _update(fields, products):
+        """
+        Один UPDATE на строку через executemany: bulk_update строит для
+        пачки выражение CASE по каждому полю, и на тысячах строк его
+        сборка занимает больше времени, чем сама запись.
+        """
+        if not products:
+            return
+        quote = connection.ops.quote_name
+        sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+            quote(Product._meta.db_table),
+            ', '.join(f'{quote(field.column)} = %s' for field in fields),
+            quote(Product._meta.pk.column),
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [
+                [
+                    field.get_db_prep_save(
+                        getattr(product, field.attname), connection
+                    )
+                    for field in fields
+                ] + [product.pk]
+                for product in products
+            ])
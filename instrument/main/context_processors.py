@@ -0,0 +1,16 @@
+from django.utils.functional import SimpleLazyObject
+
+from .navigation import get_tree
+from .shopping import get_shopping_state
+
+
+def shopping(request):
+    """Избранное и корзина текущего пользователя для шаблонов."""
+    return {
+        'shopping': SimpleLazyObject(lambda: get_shopping_state(request))
+    }
+
+
+def navigation(request):
+    """Дерево категорий и типов продуктов для боковой панели."""
+    return {'navigation': SimpleLazyObject(get_tree)}
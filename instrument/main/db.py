@@ -0,0 +1,20 @@
+"""
+Настройка новых соединений с базой данных.
+
+Для SQLite при каждом соединении выполняются PRAGMA из ключа PRAGMAS
+настроек базы (settings.DATABASES): режим журнала, синхронизация,
+размер кэша страниц и отображения в память. Ожидание блокировок
+задаёт параметр timeout из OPTIONS, остальные СУБД настраиваются
+только параметрами OPTIONS.
+"""
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = connection.settings_dict.get('PRAGMAS') or {}
+    for name, value in pragmas.items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,191 @@
+"""
+Фасетная навигация по продуктам одного типа.
+
+Одним агрегирующим запросом строится «куб» — количество продуктов,
+минимальная и максимальная цена для каждого сочетания производителя,
+ценового диапазона и целого значения рейтинга. Куб кэшируется по
+версии типа продукта, а счётчики фасетов для любого сочетания
+фильтров считаются из него в памяти, без дополнительных запросов.
+Куб для произвольных границ цены (min_price, max_price) не
+кэшируется: у таких ключей нет предела, и кэш заполнялся бы
+записями, которые не используются повторно.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Count, IntegerField, Max, Min, Q, Value, When
+from django.db.models.functions import Cast
+
+from . import versioning
+from .models import Product
+
+FACET_CACHE_TIMEOUT = getattr(settings, 'FACET_CACHE_TIMEOUT', 300)
+NAMESPACE = 'facets'
+
+# Ценовые диапазоны: ключ, нижняя граница (включительно),
+# верхняя граница (не включительно), подпись.
+PRICE_BUCKETS = (
+    ('0-500', 0, 500, 'до 500 руб.'),
+    ('500-1000', 500, 1000, '500 – 1 000 руб.'),
+    ('1000-5000', 1000, 5000, '1 000 – 5 000 руб.'),
+    ('5000-20000', 5000, 20000, '5 000 – 20 000 руб.'),
+    ('20000-', 20000, None, 'от 20 000 руб.'),
+)
+RATING_THRESHOLDS = (4, 3, 2, 1)
+
+
+def type_namespace(product_type_id):
+    return f'{NAMESPACE}:{product_type_id}'
+
+
+def price_bucket_expression():
+    return Case(
+        *[
+            When(
+                Q(price__gte=low) & (
+                    Q(price__lt=high) if high is not None else Q()
+                ),
+                then=Value(key)
+            )
+            for key, low, high, _ in PRICE_BUCKETS
+        ],
+        default=Value(PRICE_BUCKETS[0][0])
+    )
+
+
+def price_bucket_filter(keys):
+    condition = Q()
+    for key, low, high, _ in PRICE_BUCKETS:
+        if key in keys:
+            bucket = Q(price__gte=low)
+            if high is not None:
+                bucket &= Q(price__lt=high)
+            condition |= bucket
+    return condition
+
+
+def _build_cells(product_type, min_price=None, max_price=None):
+    queryset = Product.objects.published().filter(product_type=product_type)
+    if min_price is not None:
+        queryset = queryset.filter(price__gte=min_price)
+    if max_price is not None:
+        queryset = queryset.filter(price__lte=max_price)
+    return list(
+        queryset.order_by().values(
+            'manufacturer_id',
+            'manufacturer__name',
+            price_bucket=price_bucket_expression(),
+            rating_bucket=Cast('average_rating', IntegerField()),
+        ).annotate(
+            count=Count('id'),
+            min_price=Min('price'),
+            max_price=Max('price'),
+        )
+    )
+
+
+def facet_cells(product_type, min_price=None, max_price=None):
+    """
+    Куб фасетов для типа продукта в заданном диапазоне цен.
+
+    Из кэша берётся только куб без границ цены — по одному на тип.
+    """
+    if min_price is not None or max_price is not None:
+        return _build_cells(product_type, min_price, max_price)
+    key = 'facet-cells:{}:{}:{}'.format(
+        product_type.pk,
+        versioning.get_version(NAMESPACE),
+        versioning.get_version(type_namespace(product_type.pk)),
+    )
+    cells = cache.get(key)
+    if cells is None:
+        cells = _build_cells(product_type)
+        cache.set(key, cells, FACET_CACHE_TIMEOUT)
+    return cells
+
+
+def _matches(cell, filters, skip):
+    manufacturers = filters.get('manufacturer')
+    if skip != 'manufacturer' and manufacturers:
+        if cell['manufacturer_id'] not in manufacturers:
+            return False
+    prices = filters.get('price')
+    if skip != 'price' and prices and cell['price_bucket'] not in prices:
+        return False
+    rating = filters.get('rating')
+    if skip != 'rating' and rating and cell['rating_bucket'] < rating:
+        return False
+    return True
+
+
+def build_facets(cells, filters):
+    """
+    Счётчики фасетов для текущих фильтров.
+
+    Счётчик значения фасета учитывает все фильтры, кроме фильтра
+    этого же фасета, поэтому значения можно комбинировать.
+    В списки попадают только встречающиеся в выборке значения.
+    """
+    manufacturers = {}
+    prices = dict.fromkeys((bucket[0] for bucket in PRICE_BUCKETS), 0)
+    ratings = dict.fromkeys(RATING_THRESHOLDS, 0)
+    total = 0
+    min_price = max_price = None
+    for cell in cells:
+        if _matches(cell, filters, skip='manufacturer'):
+            if cell['manufacturer_id'] is not None:
+                name, count = manufacturers.get(
+                    cell['manufacturer_id'],
+                    (cell['manufacturer__name'], 0)
+                )
+                manufacturers[cell['manufacturer_id']] = (
+                    name, count + cell['count']
+                )
+        if _matches(cell, filters, skip='price'):
+            prices[cell['price_bucket']] += cell['count']
+            if min_price is None or cell['min_price'] < min_price:
+                min_price = cell['min_price']
+            if max_price is None or cell['max_price'] > max_price:
+                max_price = cell['max_price']
+        if _matches(cell, filters, skip='rating'):
+            for threshold in RATING_THRESHOLDS:
+                if cell['rating_bucket'] >= threshold:
+                    ratings[threshold] += cell['count']
+        if _matches(cell, filters, skip=None):
+            total += cell['count']
+    return {
+        'manufacturers': sorted(
+            (
+                (pk, name, count)
+                for pk, (name, count) in manufacturers.items()
+            ),
+            key=lambda item: item[1]
+        ),
+        'prices': [
+            (key, label, prices[key])
+            for key, _, _, label in PRICE_BUCKETS
+            if prices[key]
+        ],
+        'ratings': [
+            (threshold, f'от {threshold} ★', ratings[threshold])
+            for threshold in RATING_THRESHOLDS
+            if ratings[threshold]
+        ],
+        'total': total,
+        'min_price': min_price,
+        'max_price': max_price,
+    }
+
+
+def filter_products(queryset, filters):
+    """Применяет фильтры фасетов к набору продуктов."""
+    if filters.get('min_price') is not None:
+        queryset = queryset.filter(price__gte=filters['min_price'])
+    if filters.get('max_price') is not None:
+        queryset = queryset.filter(price__lte=filters['max_price'])
+    if filters.get('manufacturer'):
+        queryset = queryset.filter(manufacturer__in=filters['manufacturer'])
+    if filters.get('price'):
+        queryset = queryset.filter(price_bucket_filter(filters['price']))
+    if filters.get('rating'):
+        queryset = queryset.filter(average_rating__gte=filters['rating'])
+    return queryset
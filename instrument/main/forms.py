@@ -1,6 +1,7 @@
 from django import forms
 from django.contrib.auth.forms import UserChangeForm
 
+from .facets import PRICE_BUCKETS, RATING_THRESHOLDS
 from .models import Category, Comment, Product, ProductType, User, Manufacturer
 
 
@@ -61,15 +62,74 @@ class CustomUserChangeForm(UserChangeForm):
 
 
 class ProductFilterForm(forms.Form):
+    """Фасетный фильтр продуктов одного типа."""
+
+    min_price = forms.FloatField(
+        label='Минимальная цена',
+        required=False
+    )
     max_price = forms.FloatField(
         label='Максимальная цена',
         required=False
     )
-    manufacturer = forms.ModelChoiceField(
-        queryset=Manufacturer.objects.all(),
-        empty_label='Выберите производителя',
-        required=False
+    manufacturer = forms.TypedMultipleChoiceField(
+        label='Производитель',
+        coerce=int,
+        required=False,
+        widget=forms.CheckboxSelectMultiple
+    )
+    price = forms.MultipleChoiceField(
+        label='Цена',
+        choices=[(key, label) for key, _, _, label in PRICE_BUCKETS],
+        required=False,
+        widget=forms.CheckboxSelectMultiple
     )
+    rating = forms.TypedChoiceField(
+        label='Рейтинг',
+        coerce=int,
+        empty_value=None,
+        choices=[('', 'Любой')] + [
+            (threshold, f'от {threshold} ★')
+            for threshold in RATING_THRESHOLDS
+        ],
+        required=False,
+        widget=forms.RadioSelect
+    )
+
+    def __init__(self, *args, manufacturers=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['manufacturer'].choices = list(manufacturers)
+
+    def apply_facets(self, facets):
+        """Оставляет в фильтре встречающиеся значения и их количество."""
+        selected = self.cleaned_data if self.is_bound and self.is_valid() else {}
+        self.fields['manufacturer'].choices = [
+            (pk, f'{name} ({count})')
+            for pk, name, count in facets['manufacturers']
+        ] + [
+            choice for choice in self.fields['manufacturer'].choices
+            if choice[0] in selected.get('manufacturer', ())
+            and choice[0] not in {item[0] for item in facets['manufacturers']}
+        ]
+        self.fields['price'].choices = [
+            (key, f'{label} ({count})')
+            for key, label, count in facets['prices']
+        ] + [
+            (key, label) for key, _, _, label in PRICE_BUCKETS
+            if key in selected.get('price', ())
+            and key not in {item[0] for item in facets['prices']}
+        ]
+        self.fields['rating'].choices = [('', 'Любой')] + [
+            (threshold, f'{label} ({count})')
+            for threshold, label, count in facets['ratings']
+        ]
+        if facets['min_price'] is not None:
+            self.fields['min_price'].widget.attrs['placeholder'] = (
+                f'от {facets["min_price"]:g}'
+            )
+            self.fields['max_price'].widget.attrs['placeholder'] = (
+                f'до {facets["max_price"]:g}'
+            )
 
 
 class ProductTypeFilterForm(forms.Form):
@@ -0,0 +1,142 @@
+"""
+Уменьшенные копии изображений продуктов и категорий.
+
+Для каждой загруженной картинки создаются копии нескольких ширин в
+исходном формате (JPEG или PNG) и в WebP. Имена копий содержат хэш
+содержимого оригинала, поэтому их можно отдавать с «вечным» кэшем:
+новая картинка получает новые имена. Список копий хранится в поле
+image_variants модели, шаблонам не нужно обращаться к диску.
+"""
+import hashlib
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Ширины копий в пикселях; высота ограничена с тем же соотношением,
+# что у карточек (3:5), пропорции картинки сохраняются.
+VARIANT_WIDTHS = getattr(settings, 'IMAGE_VARIANT_WIDTHS', (160, 320, 640))
+HEIGHT_RATIO = 5 / 3
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+VARIANTS_DIR = 'variants'
+HASH_LENGTH = 12
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def variant_name(name, digest, width, extension):
+    """product/молоток.jpg -> product/variants/молоток.<хэш>.320.webp"""
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(
+        directory,
+        VARIANTS_DIR,
+        f'{stem}.{digest}.{width}.{extension}'
+    )
+
+
+def _encode(image, image_format, quality):
+    buffer = BytesIO()
+    options = {'optimize': True}
+    if image_format != 'PNG':
+        options['quality'] = quality
+    if image_format == 'JPEG':
+        options['progressive'] = True
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def generate_variants(name, storage=None, force=False):
+    """
+    Создаёт копии картинки name и возвращает их описание.
+
+    Уже существующие файлы с тем же хэшем не перезаписываются, при
+    force=True они удаляются и кодируются заново (например, после
+    смены качества сжатия). Возвращает None, если файла нет или это
+    не картинка.
+    """
+    storage = storage or default_storage
+    try:
+        with storage.open(name, 'rb') as file:
+            data = file.read()
+        source = Image.open(BytesIO(data))
+        source = ImageOps.exif_transpose(source)
+    except (OSError, UnidentifiedImageError):
+        return None
+    digest = content_hash(data)
+    has_alpha = source.mode in ('RGBA', 'LA') or (
+        source.mode == 'P' and 'transparency' in source.info
+    )
+    fallback_format, fallback_extension = (
+        ('PNG', 'png') if has_alpha else ('JPEG', 'jpg')
+    )
+    source = source.convert('RGBA' if has_alpha else 'RGB')
+    widths = [
+        width for width in VARIANT_WIDTHS if width < source.width
+    ] or [min(VARIANT_WIDTHS)]
+    manifest = {
+        'name': name,
+        'hash': digest,
+        'width': source.width,
+        'height': source.height,
+        'fallback': {},
+        'webp': {},
+    }
+    for width in widths:
+        image = source.copy()
+        image.thumbnail(
+            (width, round(width * HEIGHT_RATIO)),
+            Image.Resampling.LANCZOS
+        )
+        for kind, image_format, extension, quality in (
+            ('fallback', fallback_format, fallback_extension, JPEG_QUALITY),
+            ('webp', 'WEBP', 'webp', WEBP_QUALITY),
+        ):
+            path = variant_name(name, digest, width, extension)
+            if force and storage.exists(path):
+                storage.delete(path)
+            if not storage.exists(path):
+                path = storage.save(
+                    path,
+                    ContentFile(_encode(image, image_format, quality))
+                )
+            manifest[kind][str(image.width)] = path
+    return manifest
+
+
+def is_current(manifest, name):
+    """Описание копий относится к текущему файлу картинки."""
+    return bool(manifest) and manifest.get('name') == name
+
+
+def _srcset(variants, storage):
+    return ', '.join(
+        f'{storage.url(path)} {width}w'
+        for width, path in sorted(variants.items(), key=lambda item: int(item[0]))
+    )
+
+
+def image_sources(image, manifest, storage=None):
+    """
+    Адреса картинки для <picture>: src, srcset и srcset в WebP.
+
+    Если копий ещё нет, srcset пустые, а src — оригинал;
+    если нет и картинки — None.
+    """
+    if not image:
+        return None
+    if not is_current(manifest, image.name):
+        return {'src': image.url, 'srcset': '', 'webp_srcset': ''}
+    storage = storage or default_storage
+    fallback = manifest['fallback']
+    return {
+        'src': storage.url(fallback[min(fallback, key=int)]),
+        'srcset': _srcset(fallback, storage),
+        'webp_srcset': _srcset(manifest['webp'], storage),
+    }
@@ -0,0 +1,103 @@
+"""
+Учёт запросов к базе данных в пределах одного HTTP-запроса.
+
+QueryRecorder подключается к каждому соединению через
+connection.execute_wrapper и считает запросы, их суммарное время и
+повторы: запросы приводятся к «отпечатку» (числа, строки и списки
+IN заменяются заполнителями), и одинаковые отпечатки, выполненные
+несколько раз, — признак N+1. Бюджеты из SQL_BUDGETS сравниваются
+с итогами запроса; превышение пишется в лог как предупреждение,
+а при SQL_BUDGET_RAISE = True (в тестах) вызывает исключение.
+"""
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+# Сколько раз должен выполниться один отпечаток, чтобы считаться N+1.
+DUPLICATE_THRESHOLD = getattr(settings, 'SQL_DUPLICATE_THRESHOLD', 3)
+# Сколько самых частых повторов попадает в лог.
+DUPLICATES_LOGGED = 5
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+IN_LIST_RE = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+SPACE_RE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Запрос вышел за бюджет, заданный в SQL_BUDGETS."""
+
+
+def fingerprint(sql):
+    """SQL без конкретных значений: одинаков для запросов N+1."""
+    sql = STRING_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    sql = IN_LIST_RE.sub('(...)', sql)
+    return SPACE_RE.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    """Счётчики запросов к БД; вызывается как execute_wrapper."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self, threshold=DUPLICATE_THRESHOLD):
+        """Повторяющиеся отпечатки от самых частых: [(sql, count)]."""
+        return [
+            (sql, count)
+            for sql, count in self.fingerprints.most_common()
+            if count >= threshold
+        ]
+
+    @contextmanager
+    def record(self):
+        """Подключает счётчик ко всем соединениям на время блока."""
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+
+def get_budget(view_name):
+    budgets = getattr(settings, 'SQL_BUDGETS', {})
+    return budgets.get(view_name, getattr(settings, 'SQL_DEFAULT_BUDGET', None))
+
+
+def check_budget(budget, metrics):
+    """Нарушения бюджета: [(показатель, значение, предел)]."""
+    if not budget:
+        return []
+    return [
+        (name, metrics[name], limit)
+        for name, limit in budget.items()
+        if name in metrics and metrics[name] > limit
+    ]
+
+
+def server_timing(metrics):
+    """Значение заголовка Server-Timing."""
+    parts = [
+        'db;dur={:.1f};desc="{} queries"'.format(
+            metrics['db_ms'], metrics['queries']
+        ),
+    ]
+    if metrics['template_ms'] is not None:
+        parts.append('tpl;dur={:.1f}'.format(metrics['template_ms']))
+    parts.append('total;dur={:.1f}'.format(metrics['total_ms']))
+    return ', '.join(parts)
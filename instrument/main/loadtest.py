@@ -0,0 +1,344 @@
+"""
+Сценарии нагрузочного теста: виртуальные покупатели ходят по сайту
+по HTTP, как браузер.
+
+Каждый покупатель — отдельный аккаунт синтетического каталога со
+своими куками; формы отправляются с CSRF-токеном из куки. Редиректы
+не выполняются: каждый запрос сценария замеряется отдельно, и ответ
+302 на отправку формы считается успехом. Ошибка «database is locked»
+распознаётся по странице ответа 500 — её текст виден при DEBUG = True.
+
+Модуль не обращается к базе и настройкам Django: адреса заранее
+готовит команда load_test, а здесь выполняются только запросы.
+"""
+import bisect
+import http.client
+import http.cookiejar
+import random
+import re
+import statistics
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import Counter
+
+# Верхние границы корзин гистограммы задержек, мс; последняя — «больше».
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+REQUEST_TIMEOUT = 30
+LOCKED_MARKER = b'database is locked'
+IDEMPOTENCY_KEY_RE = re.compile(
+    rb'name="idempotency_key" value="([0-9a-f]+)"'
+)
+
+
+class StepFailed(Exception):
+    """Ответ не тот, которого ждёт сценарий; сценарий прерывается."""
+
+
+class _KeepResponses(urllib.request.HTTPErrorProcessor):
+    """Возвращает ответ с любым кодом и не выполняет редиректы."""
+
+    def http_response(self, request, response):
+        return response
+
+    https_response = http_response
+
+
+class ScenarioStats:
+    """Итоги одного сценария: задержки, ошибки и блокировки базы."""
+
+    def __init__(self):
+        self.runs = 0
+        self.failed_runs = 0
+        self.latencies = []
+        self.errors = Counter()
+        self.lock_errors = 0
+
+    def record(self, latency, error=None, locked=False):
+        self.latencies.append(latency)
+        if error is not None:
+            self.errors[str(error)] += 1
+        if locked:
+            self.lock_errors += 1
+
+    def merge(self, other):
+        self.runs += other.runs
+        self.failed_runs += other.failed_runs
+        self.latencies.extend(other.latencies)
+        self.errors.update(other.errors)
+        self.lock_errors += other.lock_errors
+
+    def summary(self, elapsed):
+        requests = len(self.latencies)
+        errors = sum(self.errors.values())
+        if requests >= 2:
+            quantiles = statistics.quantiles(self.latencies, n=100)
+            p50, p95, p99 = quantiles[49], quantiles[94], quantiles[98]
+        else:
+            p50 = p95 = p99 = self.latencies[0] if self.latencies else 0
+        histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        for latency in self.latencies:
+            histogram[bisect.bisect_left(LATENCY_BUCKETS_MS, latency)] += 1
+        return {
+            'runs': self.runs,
+            'failed_runs': self.failed_runs,
+            'requests': requests,
+            'requests_per_second': round(requests / elapsed, 1),
+            'p50_ms': round(p50, 1),
+            'p95_ms': round(p95, 1),
+            'p99_ms': round(p99, 1),
+            'errors': errors,
+            'error_rate': round(errors / requests, 4) if requests else 0,
+            'errors_by_status': dict(self.errors),
+            'lock_errors': self.lock_errors,
+            'histogram': histogram,
+        }
+
+
+class Shopper:
+    """Виртуальный покупатель со своим аккаунтом и куками."""
+
+    def __init__(self, base_url, account, targets, seed):
+        self.base_url = base_url.rstrip('/')
+        self.account = account
+        self.targets = targets
+        self.random = random.Random(seed)
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies),
+            _KeepResponses
+        )
+        self.stats = {}
+        self.current = None
+
+    def csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == self.targets['csrf_cookie']:
+                return cookie.value
+        return ''
+
+    def request(self, path, data=None, expected=200, referer=None):
+        """Запрос с замером; при неожиданном ответе — StepFailed."""
+        headers = {}
+        body = None
+        if data is not None:
+            body = urllib.parse.urlencode(data).encode()
+            headers['X-CSRFToken'] = self.csrf_token()
+        if referer is not None:
+            headers['Referer'] = self.base_url + referer
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=body,
+            headers=headers
+        )
+        started = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=REQUEST_TIMEOUT) as response:
+                content = response.read()
+                status = response.status
+        except (OSError, http.client.HTTPException) as error:
+            self.current.record(
+                (time.perf_counter() - started) * 1000,
+                type(error).__name__
+            )
+            raise StepFailed(f'{path}: {error}')
+        self.current.record(
+            (time.perf_counter() - started) * 1000,
+            None if status == expected else status,
+            status >= 500 and LOCKED_MARKER in content
+        )
+        if status != expected:
+            raise StepFailed(f'{path}: {status}')
+        return content
+
+    def get(self, path):
+        return self.request(path)
+
+    def post(self, path, data=None, referer=None):
+        return self.request(path, data or {}, expected=302, referer=referer)
+
+    def run_scenario(self, name, scenario):
+        self.current = self.stats.setdefault(name, ScenarioStats())
+        self.current.runs += 1
+        try:
+            scenario(self)
+        except StepFailed:
+            self.current.failed_runs += 1
+            return False
+        return True
+
+    def login(self):
+        return self.run_scenario('login', login)
+
+    def run(self, weights, deadline, think_time):
+        """Случайные сценарии с заданными весами до наступления deadline."""
+        names = list(weights)
+        chances = [weights[name] for name in names]
+        while time.monotonic() < deadline:
+            name = self.random.choices(names, chances)[0]
+            self.run_scenario(name, SCENARIOS[name])
+            if think_time:
+                time.sleep(self.random.uniform(0, 2 * think_time))
+
+    def product(self):
+        """Продукт с учётом популярности: первые в списке чаще."""
+        return self.random.choices(
+            self.targets['products'],
+            self.targets['product_weights']
+        )[0]
+
+
+def login(shopper):
+    shopper.get(shopper.targets['login'])
+    shopper.post(
+        shopper.targets['login'],
+        {
+            'username': shopper.account['username'],
+            'password': shopper.targets['password'],
+        }
+    )
+
+
+def browse(shopper):
+    shopper.get(shopper.targets['index'])
+    shopper.get(
+        '{}?page={}'.format(shopper.targets['index'], shopper.random.randint(2, 5))
+    )
+
+
+def open_category(shopper):
+    shopper.get(shopper.targets['category_list'])
+    shopper.get(shopper.random.choice(shopper.targets['categories']))
+
+
+def filter_product_type(shopper):
+    url = shopper.random.choice(shopper.targets['product_types'])
+    shopper.get(url)
+    low = shopper.random.choice((100, 500, 1000))
+    shopper.get('{}?{}'.format(url, urllib.parse.urlencode({
+        'min_price': low,
+        'max_price': low * shopper.random.choice((5, 10)),
+        'rating': shopper.random.randint(1, 4),
+    })))
+
+
+def search(shopper):
+    word = shopper.random.choice(shopper.targets['search_words'])
+    shopper.get('{}?{}'.format(
+        shopper.targets['autocomplete'],
+        urllib.parse.urlencode({'q': word[:3]})
+    ))
+    shopper.get('{}?{}'.format(
+        shopper.targets['search'],
+        urllib.parse.urlencode({'q': word})
+    ))
+
+
+def view_product(shopper):
+    product = shopper.product()
+    shopper.get(product['detail'])
+    shopper.get(product['comments'])
+
+
+def add_to_cart(shopper):
+    product = shopper.product()
+    shopper.get(product['detail'])
+    shopper.post(product['add_cart'])
+    shopper.get(shopper.account['cart'])
+
+
+def add_to_favorites(shopper):
+    product = shopper.product()
+    shopper.get(product['detail'])
+    shopper.post(product['add_favorite'], referer=product['detail'])
+    shopper.get(shopper.account['favorites'])
+
+
+def rate_product(shopper):
+    product = shopper.product()
+    shopper.get(product['detail'])
+    shopper.post(product['detail'], {'rating': shopper.random.randint(1, 5)})
+
+
+def comment_product(shopper):
+    product = shopper.product()
+    shopper.post(
+        product['add_comment'],
+        {'text': f'Отзыв покупателя {shopper.account["username"]}'}
+    )
+    shopper.get(product['comments'])
+
+
+def checkout(shopper):
+    shopper.post(shopper.product()['add_cart'])
+    match = IDEMPOTENCY_KEY_RE.search(shopper.get(shopper.account['cart']))
+    if match is None:
+        raise StepFailed('в корзине нет ключа оформления заказа')
+    shopper.post(
+        shopper.account['checkout'],
+        {'idempotency_key': match.group(1).decode()}
+    )
+    shopper.get(shopper.targets['history'])
+
+
+SCENARIOS = {
+    'browse': browse,
+    'category': open_category,
+    'filter': filter_product_type,
+    'search': search,
+    'product': view_product,
+    'cart': add_to_cart,
+    'favorite': add_to_favorites,
+    'rate': rate_product,
+    'comment': comment_product,
+    'checkout': checkout,
+}
+# Доли сценариев: в основном просмотр каталога, запись — реже.
+DEFAULT_WEIGHTS = {
+    'browse': 25,
+    'category': 15,
+    'filter': 15,
+    'search': 15,
+    'product': 12,
+    'cart': 6,
+    'favorite': 4,
+    'rate': 3,
+    'comment': 3,
+    'checkout': 2,
+}
+
+
+def run_worker(base_url, accounts, targets, weights, options, barrier, results):
+    """
+    Процесс нагрузки: входит под своими аккаунтами, ждёт остальные
+    процессы и гоняет сценарии в отдельном потоке на покупателя.
+    """
+    try:
+        shoppers = [
+            Shopper(base_url, account, targets, options['seed'] + number)
+            for number, account in zip(options['numbers'], accounts)
+        ]
+        for shopper in shoppers:
+            shopper.login()
+    except BaseException:
+        barrier.abort()
+        raise
+    barrier.wait()
+    deadline = time.monotonic() + options['duration']
+    threads = [
+        threading.Thread(
+            target=shopper.run,
+            args=(weights, deadline, options['think_time'])
+        )
+        for shopper in shoppers
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = {}
+    for shopper in shoppers:
+        for name, scenario_stats in shopper.stats.items():
+            stats.setdefault(name, ScenarioStats()).merge(scenario_stats)
+    results.put(stats)
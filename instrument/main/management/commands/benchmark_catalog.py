@@ -0,0 +1,301 @@
+import gc
+import json
+import logging
+import statistics
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from django.urls import reverse
+
+from main.models import Category, Product, ProductType, User
+from main.synthetic import DEFAULT_VOLUMES, USERNAME_PREFIX, CatalogGenerator
+
+DEFAULT_BASELINE = settings.BASE_DIR / 'benchmarks' / 'baseline.json'
+TIMING_KEYS = ('p50_ms', 'p95_ms', 'p99_ms')
+
+
+def percentile(quantiles, number):
+    return round(quantiles[number - 1], 2)
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет тестовую базу синтетическим каталогом, замеряет время '
+        'ответа и число запросов к БД основных страниц и сравнивает '
+        'результат с сохранённым эталоном. Общий эталон хранит только '
+        'число запросов: время ответа зависит от машины, и его эталон '
+        'записывается и сравнивается на одной машине (--timings).'
+    )
+
+    def add_arguments(self, parser):
+        for name, value in DEFAULT_VOLUMES.items():
+            parser.add_argument(
+                f'--{name.replace("_", "-")}',
+                type=int,
+                default=value,
+                help=f'Сколько создать: {name} (по умолчанию {value}).'
+            )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=50,
+            help='Замеров на страницу после прогрева (по умолчанию 50).'
+        )
+        parser.add_argument(
+            '--output',
+            help='Куда записать результат в JSON (по умолчанию — в вывод).'
+        )
+        parser.add_argument(
+            '--baseline',
+            default=str(DEFAULT_BASELINE),
+            help='Файл эталона для сравнения.'
+        )
+        parser.add_argument(
+            '--update-baseline',
+            action='store_true',
+            help='Записать результат как новый эталон.'
+        )
+        parser.add_argument(
+            '--timings',
+            action='store_true',
+            help=(
+                'Записывать в эталон и сравнивать также время ответа. '
+                'Такой эталон годится только для машины, на которой '
+                'он записан.'
+            )
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.5,
+            help='Допустимый рост p50 относительно эталона (0.5 — на 50%%).'
+        )
+        parser.add_argument(
+            '--min-delta-ms',
+            type=float,
+            default=2.0,
+            help='Рост p50 меньше этого значения в мс — шум, а не регрессия.'
+        )
+
+    def handle(self, *args, **options):
+        volumes = {name: options[name] for name in DEFAULT_VOLUMES}
+        # Замеры идут в отдельной тестовой базе, рабочая не меняется.
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0,
+            autoclobber=True,
+            serialize=False
+        )
+        instrumentation = logging.getLogger('main.instrumentation')
+        level = instrumentation.level
+        instrumentation.setLevel(logging.ERROR)
+        try:
+            cache.clear()
+            started = time.perf_counter()
+            counts = CatalogGenerator(volumes, options['seed']).generate()
+            self.stderr.write(
+                f'Каталог создан за {time.perf_counter() - started:.1f} с: '
+                + ', '.join(f'{label} {count}' for label, count in counts.items())
+            )
+            # Страницы замеряются без кэша страниц целиком: иначе
+            # измерялось бы чтение из кэша, а не представления.
+            with override_settings(PAGE_CACHE_TIMEOUTS={}):
+                routes = self.measure(options['iterations'])
+        finally:
+            instrumentation.setLevel(level)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        result = {
+            'volumes': volumes,
+            'seed': options['seed'],
+            'iterations': options['iterations'],
+            'routes': routes,
+        }
+        report = json.dumps(result, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(report + '\n')
+        else:
+            self.stdout.write(report)
+        if options['update_baseline']:
+            baseline = {
+                **result,
+                'routes': {
+                    key: {
+                        name: value for name, value in route.items()
+                        if options['timings'] or name not in TIMING_KEYS
+                    }
+                    for key, route in result['routes'].items()
+                },
+            }
+            with open(options['baseline'], 'w', encoding='utf-8') as file:
+                file.write(
+                    json.dumps(baseline, ensure_ascii=False, indent=2) + '\n'
+                )
+            self.stderr.write(f'Эталон записан в {options["baseline"]}')
+            return
+        self.compare(result, options)
+
+    def targets(self):
+        """Страницы для замера: (ключ, адрес, нужен ли вход)."""
+        category = Category.objects.annotate(
+            products=Count('products_category')
+        ).order_by('-products').first()
+        product_type = ProductType.objects.select_related(
+            'category'
+        ).annotate(products=Count('products_type')).order_by('-products').first()
+        product = Product.objects.select_related(
+            'category',
+            'product_type'
+        ).order_by('-comment_count').first()
+        product_args = (
+            product.category.slug, product.product_type.slug, product.pk
+        )
+        type_url = reverse(
+            'main:product_type_detail',
+            args=(product_type.category.slug, product_type.slug)
+        )
+        username = f'{USERNAME_PREFIX}0'
+        return [
+            ('main:index', reverse('main:index'), False),
+            ('main:index?page=20', reverse('main:index') + '?page=20', False),
+            ('main:category_list', reverse('main:category_list'), False),
+            (
+                'main:category_detail',
+                reverse('main:category_detail', args=(category.slug,)),
+                False
+            ),
+            ('main:product_type_detail', type_url, False),
+            (
+                'main:product_type_detail?filters',
+                type_url + '?min_price=500&max_price=5000&rating=3',
+                False
+            ),
+            (
+                'main:product_detail',
+                reverse('main:product_detail', args=product_args),
+                False
+            ),
+            (
+                'main:comment_list',
+                reverse('main:comment_list', args=product_args),
+                False
+            ),
+            ('main:search', reverse('main:search') + '?q=молоток', False),
+            (
+                'main:autocomplete',
+                reverse('main:autocomplete') + '?q=мол',
+                False
+            ),
+            (
+                'main:cart_view',
+                reverse('main:cart_view', args=(username,)),
+                True
+            ),
+            (
+                'main:favorite_view',
+                reverse('main:favorite_view', args=(username,)),
+                True
+            ),
+            ('main:history_view', reverse('main:history_view'), True),
+            ('main:shopping_api', reverse('main:shopping_api'), True),
+            ('pages:about', reverse('pages:about'), False),
+        ]
+
+    def measure(self, iterations):
+        anonymous, authenticated = Client(), Client()
+        authenticated.force_login(
+            User.objects.get(username=f'{USERNAME_PREFIX}0')
+        )
+        routes = {}
+        for key, url, login in self.targets():
+            client = authenticated if login else anonymous
+            # Прогрев: кэши версий, снимков и индекс подсказок.
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f'{key}: {url} ответил {response.status_code}')
+            timings = []
+            # Сборщик мусора в случайный момент даёт выбросы в десятки мс.
+            gc.collect()
+            gc.disable()
+            try:
+                for _ in range(iterations):
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        client.get(url)
+                        timings.append((time.perf_counter() - started) * 1000)
+            finally:
+                gc.enable()
+            quantiles = statistics.quantiles(timings, n=100)
+            routes[key] = {
+                'p50_ms': percentile(quantiles, 50),
+                'p95_ms': percentile(quantiles, 95),
+                'p99_ms': percentile(quantiles, 99),
+                'queries': len(queries),
+            }
+            self.stderr.write(
+                f'{key:<36} p50 {routes[key]["p50_ms"]:>7.2f} мс   '
+                f'p95 {routes[key]["p95_ms"]:>7.2f} мс   '
+                f'запросов {routes[key]["queries"]}'
+            )
+        return routes
+
+    def compare(self, result, options):
+        try:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+        except FileNotFoundError:
+            self.stderr.write(
+                'Эталона нет; сохраните его с --update-baseline.'
+            )
+            return
+        if baseline.get('volumes') != result['volumes']:
+            self.stderr.write(self.style.WARNING(
+                'Объёмы каталога отличаются от эталонных, сравнение пропущено.'
+            ))
+            return
+        compare_timings = options['timings']
+        if compare_timings and not all(
+            'p50_ms' in route for route in baseline['routes'].values()
+        ):
+            self.stderr.write(self.style.WARNING(
+                'В эталоне нет времени ответа, сравнивается только число '
+                'запросов; запишите эталон этой машины с --update-baseline '
+                '--timings.'
+            ))
+            compare_timings = False
+        regressions = []
+        for key, expected in baseline['routes'].items():
+            actual = result['routes'].get(key)
+            if actual is None:
+                continue
+            if actual['queries'] > expected['queries']:
+                regressions.append(
+                    f'{key}: запросов {actual["queries"]} '
+                    f'(эталон {expected["queries"]})'
+                )
+            if not compare_timings:
+                continue
+            # Сравнивается медиана: p95 и p99 на десятках замеров
+            # слишком зависят от случайных пауз машины.
+            limit = expected['p50_ms'] * (1 + options['threshold'])
+            if (actual['p50_ms'] > limit and actual['p50_ms']
+                    - expected['p50_ms'] > options['min_delta_ms']):
+                regressions.append(
+                    f'{key}: p50 {actual["p50_ms"]} мс '
+                    f'(эталон {expected["p50_ms"]} мс)'
+                )
+        if regressions:
+            raise CommandError(
+                'Регрессии относительно эталона:\n' + '\n'.join(regressions)
+            )
+        self.stderr.write(self.style.SUCCESS('Регрессий нет.'))
@@ -0,0 +1,166 @@
+import copy
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+from django.db.models import F
+
+from main.models import Cart, CartItem, Product, User
+
+# Профиль «до»: журнал отката SQLite по умолчанию и ожидание
+# блокировки, как у соединения без настроек.
+ROLLBACK_PRAGMAS = {'journal_mode': 'delete', 'synchronous': 'full'}
+# Профиль, который включает DJANGO_SQLITE_JOURNAL_MODE=wal.
+WAL_PRAGMAS = {'journal_mode': 'wal', 'synchronous': 'normal'}
+ROLLBACK_TIMEOUT = 5
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность параллельной записи в SQLite '
+        'с журналом отката, в режиме WAL и с настройками из '
+        'settings.DATABASES. '
+        'Запись идёт в копию базы, рабочая база не меняется.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=8,
+            help='Число параллельных потоков (по умолчанию 8).'
+        )
+        parser.add_argument(
+            '--writes',
+            type=int,
+            default=200,
+            help='Число транзакций записи на поток (по умолчанию 200).'
+        )
+        parser.add_argument(
+            '--profile',
+            choices=('rollback', 'wal', 'configured'),
+            action='append',
+            help='Какие профили измерять (по умолчанию все).'
+        )
+
+    def handle(self, *args, **options):
+        source = connections['default']
+        if source.vendor != 'sqlite':
+            raise CommandError('Сравнение профилей доступно только для SQLite.')
+        users = list(User.objects.values_list('pk', flat=True)[:options['threads']])
+        products = list(Product.objects.values_list('pk', flat=True)[:20])
+        if not users or not products:
+            raise CommandError('Для измерения нужны пользователи и продукты.')
+        configured = source.settings_dict.get('PRAGMAS') or {}
+        timeout = source.settings_dict['OPTIONS'].get('timeout', ROLLBACK_TIMEOUT)
+        profiles = {
+            'rollback': (ROLLBACK_PRAGMAS, ROLLBACK_TIMEOUT),
+            'wal': ({**configured, **WAL_PRAGMAS}, timeout),
+            'configured': (configured, timeout),
+        }
+        self.stdout.write(
+            f'{"Профиль":<12}{"записей/с":>12}{"p50, мс":>10}'
+            f'{"p95, мс":>10}{"p99, мс":>10}{"ошибок":>9}'
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            for name in options['profile'] or list(profiles):
+                pragmas, timeout = profiles[name]
+                path = os.path.join(directory, f'{name}.sqlite3')
+                self._copy_database(source, path)
+                alias = f'benchmark_{name}'
+                settings_dict = copy.deepcopy(source.settings_dict)
+                settings_dict.update(
+                    NAME=path,
+                    PRAGMAS=pragmas,
+                    CONN_MAX_AGE=0,
+                    OPTIONS={**settings_dict['OPTIONS'], 'timeout': timeout}
+                )
+                connections.settings[alias] = settings_dict
+                try:
+                    self._report(name, self._run(alias, users, products, options))
+                finally:
+                    del connections.settings[alias]
+
+    @staticmethod
+    def _copy_database(source, path):
+        source.ensure_connection()
+        target = sqlite3.connect(path)
+        try:
+            source.connection.backup(target)
+        finally:
+            target.close()
+
+    def _run(self, alias, users, products, options):
+        carts = [
+            Cart.objects.using(alias).get_or_create(user_id=user_id)[0].pk
+            for user_id in users
+        ]
+        connections[alias].close()
+        latencies, errors = [], []
+        lock = threading.Lock()
+        barrier = threading.Barrier(options['threads'])
+
+        def worker(number):
+            cart_id = carts[number % len(carts)]
+            own_latencies, own_errors = [], 0
+            barrier.wait()
+            try:
+                for index in range(options['writes']):
+                    product_id = products[(number + index) % len(products)]
+                    started = time.perf_counter()
+                    try:
+                        self._write(alias, cart_id, product_id)
+                    except OperationalError:
+                        own_errors += 1
+                        continue
+                    own_latencies.append(time.perf_counter() - started)
+            finally:
+                connections[alias].close()
+            with lock:
+                latencies.extend(own_latencies)
+                errors.append(own_errors)
+
+        threads = [
+            threading.Thread(target=worker, args=(number,))
+            for number in range(options['threads'])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, sum(errors), time.perf_counter() - started
+
+    @staticmethod
+    def _write(alias, cart_id, product_id):
+        """Транзакция как у добавления в корзину: UPDATE или INSERT."""
+        with transaction.atomic(using=alias):
+            updated = CartItem.objects.using(alias).filter(
+                cart_id=cart_id,
+                product_id=product_id
+            ).update(quantity=F('quantity') + 1)
+            if not updated:
+                CartItem.objects.using(alias).create(
+                    cart_id=cart_id,
+                    product_id=product_id,
+                    price=1
+                )
+
+    def _report(self, name, result):
+        latencies, errors, elapsed = result
+        if len(latencies) >= 2:
+            quantiles = statistics.quantiles(latencies, n=100)
+            p50, p95, p99 = (
+                quantiles[49] * 1000, quantiles[94] * 1000, quantiles[98] * 1000
+            )
+        else:
+            p50 = p95 = p99 = 0
+        self.stdout.write(
+            f'{name:<12}{len(latencies) / elapsed:>12.0f}{p50:>10.1f}'
+            f'{p95:>10.1f}{p99:>10.1f}{errors:>9}'
+        )
@@ -0,0 +1,81 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from main import images, services
+from main.models import Category, Product
+
+MODELS = (Product, Category)
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт уменьшенные копии и WebP-версии фото продуктов и '
+        'категорий, загруженных до появления копий.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Число параллельных процессов (по умолчанию — по числу ядер).'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help=(
+                'Заново закодировать копии и для картинок, у которых они '
+                'уже есть; прежние файлы копий удаляются.'
+            )
+        )
+
+    def handle(self, *args, **options):
+        pending = {}
+        for model in MODELS:
+            for pk, name, manifest in model.objects.exclude(
+                image=''
+            ).exclude(image__isnull=True).values_list(
+                'pk', 'image', 'image_variants'
+            ).iterator():
+                if options['force'] or not images.is_current(manifest, name):
+                    pending.setdefault(name, []).append((model, pk))
+        if not pending:
+            self.stdout.write(self.style.SUCCESS('Все копии уже созданы.'))
+            return
+        names = list(pending)
+        # Дочерним процессам соединения с БД не нужны и не должны
+        # достаться по наследству.
+        connections.close_all()
+        workers = max(1, min(options['workers'], len(names)))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            manifests = executor.map(
+                partial(images.generate_variants, force=options['force']),
+                names,
+                chunksize=max(1, len(names) // (workers * 4))
+            )
+            updates = {model: [] for model in MODELS}
+            failed = 0
+            for name, manifest in zip(names, manifests):
+                if manifest is None:
+                    failed += 1
+                    self.stderr.write(f'Не удалось прочитать {name}')
+                    continue
+                for model, pk in pending[name]:
+                    updates[model].append(model(pk=pk, image_variants=manifest))
+        for model, objects in updates.items():
+            model.objects.bulk_update(
+                objects,
+                ('image_variants',),
+                batch_size=500
+            )
+        # bulk_update проходит мимо сигналов: страницы и снимки
+        # продуктов со старыми адресами картинок нужно сбросить.
+        services.products_changed_in_bulk()
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {len(names) - failed} '
+            f'(процессов: {workers}), ошибок: {failed}'
+        ))
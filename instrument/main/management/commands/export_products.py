@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.catalog_io import (EXPORT_CHUNK_SIZE, FORMATS, detect_format,
+                             export_rows, open_text, write_rows)
+from main.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает продукты в CSV или JSON Lines (можно .gz, «-» — stdout) '
+        'в формате, который принимает import_products.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл для выгрузки.')
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=EXPORT_CHUNK_SIZE,
+            help=(
+                'Строк, читаемых из базы за раз '
+                f'(по умолчанию {EXPORT_CHUNK_SIZE}).'
+            )
+        )
+        parser.add_argument(
+            '--published',
+            action='store_true',
+            help='Только опубликованные продукты.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            fmt = detect_format(options['path'], options['format'])
+        except ValueError as error:
+            raise CommandError(error)
+        queryset = Product.objects.all()
+        if options['published']:
+            queryset = Product.objects.published()
+        started = time.perf_counter()
+        try:
+            with open_text(options['path'], 'w') as stream:
+                total = write_rows(
+                    stream,
+                    fmt,
+                    export_rows(queryset, options['chunk_size'])
+                )
+        except OSError as error:
+            raise CommandError(error)
+        self.stderr.write(self.style.SUCCESS(
+            f'Выгружено продуктов: {total} '
+            f'за {time.perf_counter() - started:.1f} с'
+        ))
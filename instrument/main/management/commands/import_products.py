@@ -0,0 +1,91 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.catalog_io import (BATCH_SIZE, FORMATS, ProductImporter,
+                             detect_format, open_text, read_rows)
+
+# Сколько отклонённых строк показывать в выводе.
+REJECTS_SHOWN = 20
+PROGRESS_INTERVAL = 2
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает продукты из CSV или JSON Lines (можно .gz, «-» — stdin). '
+        'Категория и тип указываются слагом, производитель — названием; '
+        'строка с id обновляет продукт, без id — создаёт новый.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл с продуктами.')
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help=f'Строк в пачке и транзакции (по умолчанию {BATCH_SIZE}).'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только проверить строки, ничего не записывая.'
+        )
+        parser.add_argument(
+            '--rejects',
+            help='Записать отклонённые строки с ошибками в файл JSON Lines.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            fmt = detect_format(options['path'], options['format'])
+        except ValueError as error:
+            raise CommandError(error)
+        importer = ProductImporter(options['batch_size'], options['dry_run'])
+        started = last_report = time.perf_counter()
+        rejects = open(options['rejects'], 'w', encoding='utf-8') \
+            if options['rejects'] else None
+
+        def on_batch(importer):
+            nonlocal last_report
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                self.stderr.write(self.progress(importer, now - started))
+
+        def on_reject(number, row, errors):
+            if importer.rejected <= REJECTS_SHOWN:
+                self.stderr.write(self.style.WARNING(
+                    f'Строка {number}: ' + '; '.join(
+                        f'{field}: {" ".join(messages)}'
+                        for field, messages in errors.items()
+                    )
+                ))
+            if rejects is not None:
+                rejects.write(json.dumps(
+                    {'line': number, 'errors': errors, 'row': row},
+                    ensure_ascii=False
+                ) + '\n')
+
+        try:
+            with open_text(options['path'], 'r') as stream:
+                importer.run(read_rows(stream, fmt), on_batch, on_reject)
+        except (OSError, UnicodeDecodeError) as error:
+            raise CommandError(error)
+        finally:
+            if rejects is not None:
+                rejects.close()
+        self.stdout.write(self.style.SUCCESS(
+            ('Проверено' if options['dry_run'] else 'Загружено') + ': '
+            + self.progress(importer, time.perf_counter() - started)
+        ))
+
+    @staticmethod
+    def progress(importer, elapsed):
+        return (
+            f'строк {importer.rows}, создано {importer.created}, '
+            f'обновлено {importer.updated}, без изменений {importer.unchanged}, '
+            f'отклонено {importer.rejected} '
+            f'за {elapsed:.1f} с ({importer.rows / max(elapsed, 1e-6):.0f} строк/с)'
+        )
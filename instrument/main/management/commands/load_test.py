@@ -0,0 +1,404 @@
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.urls import reverse
+
+from main.loadtest import (DEFAULT_WEIGHTS, LATENCY_BUCKETS_MS, SCENARIOS,
+                           ScenarioStats, run_worker)
+from main.models import Category, Product, ProductType, User
+from main.synthetic import (DEFAULT_VOLUMES, PASSWORD, TOOLS, USERNAME_PREFIX,
+                            CatalogGenerator, zipf_weights)
+
+# Сколько популярных продуктов достаётся сценариям.
+TARGET_PRODUCTS = 500
+SERVER_START_TIMEOUT = 60
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест: запускает WSGI-приложение проекта на '
+        'синтетическом каталоге в отдельной базе и гоняет по нему '
+        'сценарии покупателей из нескольких процессов. Выводит запросы '
+        'в секунду, задержки, долю ошибок и блокировки базы по сценариям.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            help=(
+                'Адрес уже запущенного сервера. Тогда каталог не создаётся: '
+                'продукты и аккаунты берутся из базы в settings.DATABASES, '
+                'она должна совпадать с базой сервера.'
+            )
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Число процессов нагрузки (по умолчанию 4).'
+        )
+        parser.add_argument(
+            '--shoppers',
+            type=int,
+            default=4,
+            help='Покупателей (потоков) на процесс (по умолчанию 4).'
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=30,
+            help='Длительность нагрузки в секундах (по умолчанию 30).'
+        )
+        parser.add_argument(
+            '--think-time',
+            type=float,
+            default=0,
+            help='Средняя пауза покупателя между сценариями, с (по умолчанию 0).'
+        )
+        parser.add_argument(
+            '--weight',
+            action='append',
+            default=[],
+            metavar='СЦЕНАРИЙ=ВЕС',
+            help=(
+                'Вес сценария, можно несколько раз; 0 отключает сценарий. '
+                'Сценарии: ' + ', '.join(SCENARIOS) + '.'
+            )
+        )
+        parser.add_argument(
+            '--password',
+            default=PASSWORD,
+            help='Пароль аккаунтов покупателей.'
+        )
+        for name, value in DEFAULT_VOLUMES.items():
+            parser.add_argument(
+                f'--{name.replace("_", "-")}',
+                type=int,
+                default=value,
+                help=f'Сколько создать: {name} (по умолчанию {value}).'
+            )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--output',
+            help='Куда записать результат в JSON.'
+        )
+        parser.add_argument(
+            '--max-error-rate',
+            type=float,
+            help='Завершиться с ошибкой, если доля ошибок выше (0.01 — 1%%).'
+        )
+
+    def handle(self, *args, **options):
+        weights = self.parse_weights(options['weight'])
+        accounts_count = options['workers'] * options['shoppers']
+        if accounts_count < 1:
+            raise CommandError('Нужен хотя бы один покупатель.')
+        if options['url']:
+            targets, accounts = self.collect_targets(options, accounts_count)
+            stats, elapsed = self.run_load(
+                options['url'], targets, accounts, weights, options
+            )
+        else:
+            stats, elapsed = self.run_local(weights, options, accounts_count)
+        self.report(stats, elapsed, weights, options)
+
+    def parse_weights(self, values):
+        weights = dict(DEFAULT_WEIGHTS)
+        for value in values:
+            name, _, weight = value.partition('=')
+            if name not in SCENARIOS:
+                raise CommandError(f'Неизвестный сценарий: {name}')
+            try:
+                weights[name] = float(weight)
+            except ValueError:
+                raise CommandError(f'Некорректный вес: {value}')
+        weights = {name: weight for name, weight in weights.items() if weight > 0}
+        if not weights:
+            raise CommandError('Все сценарии отключены.')
+        return weights
+
+    def run_local(self, weights, options, accounts_count):
+        """Каталог в отдельной базе, сервер в дочернем процессе."""
+        volumes = {name: options[name] for name in DEFAULT_VOLUMES}
+        if volumes['users'] < accounts_count:
+            raise CommandError(
+                f'Покупателей {accounts_count}, а аккаунтов {volumes["users"]}: '
+                'увеличьте --users или уменьшите --workers и --shoppers.'
+            )
+        with tempfile.TemporaryDirectory() as directory:
+            test_settings = connection.settings_dict['TEST']
+            old_test_name = test_settings.get('NAME')
+            if connection.vendor == 'sqlite':
+                # Сервер — отдельный процесс, база в памяти ему не видна.
+                test_settings['NAME'] = os.path.join(directory, 'load.sqlite3')
+            old_name = connection.creation.create_test_db(
+                verbosity=0,
+                autoclobber=True,
+                serialize=False
+            )
+            try:
+                started = time.perf_counter()
+                counts = CatalogGenerator(volumes, options['seed']).generate()
+                self.stderr.write(
+                    f'Каталог создан за {time.perf_counter() - started:.1f} с: '
+                    + ', '.join(
+                        f'{label} {count}' for label, count in counts.items()
+                    )
+                )
+                targets, accounts = self.collect_targets(options, accounts_count)
+                connection.close()
+                with self.server(directory) as url:
+                    return self.run_load(url, targets, accounts, weights, options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                test_settings['NAME'] = old_test_name
+
+    @contextmanager
+    def server(self, directory):
+        """Сервер разработки с WSGI-приложением проекта на свободном порту."""
+        port = free_port()
+        log_path = os.path.join(directory, 'server.log')
+        with open(log_path, 'wb') as log:
+            process = subprocess.Popen(
+                [
+                    sys.executable,
+                    str(settings.BASE_DIR / 'manage.py'),
+                    'runserver',
+                    '--noreload',
+                    '--nostatic',
+                    f'127.0.0.1:{port}',
+                ],
+                env={
+                    **os.environ,
+                    'DJANGO_DB_NAME': str(connection.settings_dict['NAME']),
+                },
+                stdout=subprocess.DEVNULL,
+                stderr=log
+            )
+            url = f'http://127.0.0.1:{port}'
+            try:
+                try:
+                    self.wait_for_server(url, process)
+                except CommandError:
+                    with open(log_path, encoding='utf-8', errors='replace') as output:
+                        self.stderr.write(output.read()[-2000:])
+                    raise
+                yield url
+            finally:
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+
+    @staticmethod
+    def wait_for_server(url, process):
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError('Сервер завершился при запуске.')
+            try:
+                with urllib.request.urlopen(url + reverse('main:index'), timeout=5):
+                    return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(
+            f'Сервер не ответил за {SERVER_START_TIMEOUT} с.'
+        )
+
+    def collect_targets(self, options, accounts_count):
+        """Адреса для сценариев и аккаунты покупателей."""
+        usernames = list(
+            User.objects.filter(
+                username__startswith=USERNAME_PREFIX
+            ).order_by('pk').values_list('username', flat=True)[:accounts_count]
+        )
+        if len(usernames) < accounts_count:
+            raise CommandError(
+                f'Нужно {accounts_count} аккаунтов {USERNAME_PREFIX}N, '
+                f'в базе {len(usernames)}.'
+            )
+        products = list(
+            Product.objects.published().select_related(
+                'category',
+                'product_type'
+            ).order_by('-comment_count', '-id')[:TARGET_PRODUCTS]
+        )
+        if not products:
+            raise CommandError('В базе нет опубликованных продуктов.')
+        product_targets = []
+        for product in products:
+            args = (product.category.slug, product.product_type.slug, product.pk)
+            product_targets.append({
+                'detail': reverse('main:product_detail', args=args),
+                'comments': reverse('main:comment_list', args=args),
+                'add_comment': reverse('main:comment_add', args=args),
+                'add_cart': reverse('main:cart_add_product', args=(product.pk,)),
+                'add_favorite': reverse(
+                    'main:favorite_add_product', args=(product.pk,)
+                ),
+            })
+        targets = {
+            'csrf_cookie': settings.CSRF_COOKIE_NAME,
+            'password': options['password'],
+            'login': reverse('login'),
+            'index': reverse('main:index'),
+            'category_list': reverse('main:category_list'),
+            'categories': [
+                reverse('main:category_detail', args=(slug,))
+                for slug in Category.objects.values_list('slug', flat=True)
+            ],
+            'product_types': [
+                reverse(
+                    'main:product_type_detail',
+                    args=(product_type.category.slug, product_type.slug)
+                )
+                for product_type in ProductType.objects.select_related(
+                    'category'
+                )
+            ],
+            'search': reverse('main:search'),
+            'autocomplete': reverse('main:autocomplete'),
+            'search_words': list(TOOLS),
+            'history': reverse('main:history_view'),
+            'products': product_targets,
+            'product_weights': zipf_weights(len(product_targets)),
+        }
+        accounts = [
+            {
+                'username': username,
+                'cart': reverse('main:cart_view', args=(username,)),
+                'favorites': reverse('main:favorite_view', args=(username,)),
+                'checkout': reverse('main:add_history', args=(username,)),
+            }
+            for username in usernames
+        ]
+        return targets, accounts
+
+    def run_load(self, url, targets, accounts, weights, options):
+        workers = options['workers']
+        users = options['shoppers']
+        barrier = multiprocessing.Barrier(workers + 1)
+        results = multiprocessing.Queue()
+        processes = []
+        for worker in range(workers):
+            numbers = range(worker * users, (worker + 1) * users)
+            processes.append(multiprocessing.Process(
+                target=run_worker,
+                args=(
+                    url,
+                    [accounts[number] for number in numbers],
+                    targets,
+                    weights,
+                    {
+                        'numbers': list(numbers),
+                        'seed': options['seed'],
+                        'duration': options['duration'],
+                        'think_time': options['think_time'],
+                    },
+                    barrier,
+                    results,
+                )
+            ))
+        for process in processes:
+            process.start()
+        try:
+            # Вход покупателей не входит в замер: отсчёт идёт, когда
+            # все процессы вошли.
+            barrier.wait(timeout=SERVER_START_TIMEOUT + 10 * users)
+        except threading.BrokenBarrierError:
+            for process in processes:
+                process.terminate()
+            raise CommandError('Процессы нагрузки не смогли начать работу.')
+        self.stderr.write(
+            f'Нагрузка: {workers} процессов × {users} покупателей, '
+            f'{options["duration"]:.0f} с на {url}'
+        )
+        started = time.perf_counter()
+        stats = {}
+        for _ in processes:
+            for name, scenario_stats in results.get(
+                timeout=options['duration'] + 120
+            ).items():
+                stats.setdefault(name, ScenarioStats()).merge(scenario_stats)
+        elapsed = time.perf_counter() - started
+        for process in processes:
+            process.join()
+        return stats, elapsed
+
+    def report(self, stats, elapsed, weights, options):
+        total = ScenarioStats()
+        scenarios = {}
+        for name in weights:
+            if name in stats:
+                scenarios[name] = stats[name].summary(elapsed)
+                total.merge(stats[name])
+        result = {
+            'workers': options['workers'],
+            'shoppers': options['shoppers'],
+            'duration': round(elapsed, 1),
+            'weights': weights,
+            'latency_buckets_ms': list(LATENCY_BUCKETS_MS),
+            'scenarios': scenarios,
+            'total': total.summary(elapsed),
+        }
+        if 'login' in stats:
+            result['login'] = stats['login'].summary(elapsed)
+        self.stdout.write(
+            f'{"Сценарий":<10}{"прогонов":>10}{"запросов":>10}{"запр/с":>9}'
+            f'{"p50, мс":>9}{"p95, мс":>9}{"p99, мс":>9}{"ошибок":>9}'
+            f'{"блок.":>7}'
+        )
+        for name, row in [*scenarios.items(), ('всего', result['total'])]:
+            self.stdout.write(
+                f'{name:<10}{row["runs"]:>10}{row["requests"]:>10}'
+                f'{row["requests_per_second"]:>9.1f}{row["p50_ms"]:>9.1f}'
+                f'{row["p95_ms"]:>9.1f}{row["p99_ms"]:>9.1f}'
+                f'{row["error_rate"]:>9.2%}{row["lock_errors"]:>7}'
+            )
+        bounds = [f'≤{bound}' for bound in LATENCY_BUCKETS_MS] + ['больше']
+        self.stdout.write('\nЗадержки, мс:')
+        self.stdout.write(
+            f'{"":<10}' + ''.join(f'{bound:>8}' for bound in bounds)
+        )
+        for name, row in scenarios.items():
+            self.stdout.write(
+                f'{name:<10}'
+                + ''.join(f'{count:>8}' for count in row['histogram'])
+            )
+        for name, row in scenarios.items():
+            if row['errors_by_status']:
+                self.stdout.write(self.style.WARNING(
+                    f'{name}: ошибки ' + ', '.join(
+                        f'{status} × {count}'
+                        for status, count in row['errors_by_status'].items()
+                    )
+                ))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(json.dumps(result, ensure_ascii=False, indent=2) + '\n')
+        limit = options['max_error_rate']
+        if limit is not None and result['total']['error_rate'] > limit:
+            raise CommandError(
+                f'Доля ошибок {result["total"]["error_rate"]:.2%} '
+                f'выше допустимой {limit:.2%}.'
+            )
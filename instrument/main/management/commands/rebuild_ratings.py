@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from main import ratings, services
+from main.models import Product, Rating
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики рейтинга всех продуктов.'
+
+    def handle(self, *args, **options):
+        rated = ratings.recount(Product, Rating)
+        services.products_changed_in_bulk()
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитан рейтинг продуктов: {rated}'
+        ))
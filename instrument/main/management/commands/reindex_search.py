@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main import search
+from main.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Полностью перестраивает поисковый индекс продуктов.'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            self.stdout.write(self.style.WARNING(
+                'Полнотекстовый индекс поддерживается только для SQLite.'
+            ))
+            return
+        with transaction.atomic():
+            total = search.rebuild_index(Product.objects.all())
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано продуктов: {total}'
+        ))
@@ -0,0 +1,231 @@
+import json
+import logging
+import time
+from hashlib import md5
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from . import versioning
+from .instrumentation import (DUPLICATES_LOGGED, QueryBudgetExceeded,
+                              QueryRecorder, check_budget, get_budget,
+                              server_timing)
+from .shopping import COOKIE_MAX_AGE, COOKIE_NAME
+
+CACHE_STATUS_HEADER = 'X-Cache'
+
+logger = logging.getLogger('main.instrumentation')
+
+
+class AnonymousPageCacheMiddleware:
+    """
+    Кэш страниц целиком для анонимных посетителей.
+
+    Кэшируются только страницы, перечисленные в PAGE_CACHE_TIMEOUTS
+    (имя маршрута -> время жизни в секундах). Ключ включает версию
+    каталога, поэтому любое изменение каталога делает старые записи
+    недоступными без явной очистки. Авторизованные пользователи и
+    посетители с анонимной корзиной или избранным обходят кэш.
+    В ключ входят только параметры из PAGE_CACHE_QUERY_PARAMS в
+    отсортированном виде; запросы с другими параметрами кэш обходят,
+    чтобы случайные параметры не плодили записи. Страницы с
+    CSRF-токеном не кэшируются: токен привязан к куке конкретного
+    посетителя. Состояние кэша передаётся в заголовке X-Cache.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.timeouts = getattr(settings, 'PAGE_CACHE_TIMEOUTS', {})
+        self.query_params = frozenset(
+            getattr(settings, 'PAGE_CACHE_QUERY_PARAMS', ())
+        )
+
+    def __call__(self, request):
+        return self.process_response(request, self.get_response(request))
+
+    def _is_anonymous(self, request):
+        # Без сессионной куки пользователь заведомо анонимный,
+        # и проверка не обращается к таблице сессий.
+        if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+            return True
+        return not request.user.is_authenticated
+
+    def _cache_key(self, request):
+        """Ключ страницы или None, если в запросе есть чужие параметры."""
+        if not self.query_params.issuperset(request.GET):
+            return None
+        query = urlencode(sorted(
+            (name, value)
+            for name in request.GET
+            for value in request.GET.getlist(name)
+        ))
+        path = md5(
+            f'{request.path}?{query}'.encode(), usedforsecurity=False
+        ).hexdigest()
+        return 'page:{}:{}:{}'.format(
+            versioning.get_version(),
+            request.resolver_match.view_name,
+            path
+        )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timeout = self.timeouts.get(request.resolver_match.view_name)
+        if timeout is None or request.method not in ('GET', 'HEAD'):
+            return None
+        key = None
+        if self._is_anonymous(request) and COOKIE_NAME not in request.COOKIES:
+            key = self._cache_key(request)
+        if key is None:
+            request._page_cache = 'BYPASS'
+            return None
+        cached = cache.get(key)
+        if cached is not None:
+            content, status, content_type = cached
+            response = HttpResponse(
+                content,
+                status=status,
+                content_type=content_type
+            )
+            response[CACHE_STATUS_HEADER] = 'HIT'
+            return response
+        request._page_cache = 'MISS'
+        request._page_cache_key = key
+        request._page_cache_timeout = timeout
+        return None
+
+    def process_response(self, request, response):
+        status = getattr(request, '_page_cache', None)
+        if status is None:
+            return response
+        response[CACHE_STATUS_HEADER] = status
+        if (
+            status == 'MISS'
+            and response.status_code == 200
+            and not response.streaming
+            # Страница с CSRF-токеном: Django до 4.1 отмечает это
+            # CSRF_COOKIE_USED, новые версии снова отправляют куку.
+            and not response.cookies
+            and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+            and not request.META.get('CSRF_COOKIE_USED')
+        ):
+            cache.set(
+                request._page_cache_key,
+                (
+                    response.content,
+                    response.status_code,
+                    response.get('Content-Type')
+                ),
+                request._page_cache_timeout
+            )
+        return response
+
+
+class AnonymousShoppingMiddleware:
+    """Записывает изменённые корзину и избранное анонима в куку."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        state = getattr(request, '_anonymous_shopping', None)
+        if state is None or not state.changed:
+            return response
+        if state.is_empty():
+            response.delete_cookie(COOKIE_NAME)
+        else:
+            response.set_cookie(
+                COOKIE_NAME,
+                state.dumps(),
+                max_age=COOKIE_MAX_AGE,
+                httponly=True,
+                samesite='Lax',
+                secure=settings.SESSION_COOKIE_SECURE
+            )
+        return response
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Учёт запросов к БД и времени отрисовки шаблонов.
+
+    Для каждого запроса считаются количество и время запросов к БД,
+    время отрисовки TemplateResponse и повторяющиеся (N+1) запросы.
+    Итоги отдаются в заголовке Server-Timing, а при
+    SQL_LOG_REQUESTS = True ещё и пишутся в лог main.instrumentation
+    одной JSON-строкой с именем маршрута. Превышение бюджета маршрута
+    из SQL_BUDGETS — предупреждение в логе или, при
+    SQL_BUDGET_RAISE = True, исключение QueryBudgetExceeded. Должен
+    стоять первым в MIDDLEWARE, чтобы учитывать запросы остальных
+    middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header = getattr(settings, 'SQL_SERVER_TIMING', True)
+        self.raise_on_budget = getattr(settings, 'SQL_BUDGET_RAISE', False)
+        self.log_requests = getattr(settings, 'SQL_LOG_REQUESTS', False)
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with recorder.record():
+            response = self.get_response(request)
+        metrics = self.collect(request, response, recorder, started)
+        if self.header:
+            response['Server-Timing'] = server_timing(metrics)
+        if self.log_requests:
+            logger.info(
+                json.dumps(metrics, ensure_ascii=False),
+                extra={'sql_metrics': metrics}
+            )
+        violations = check_budget(get_budget(metrics['view']), metrics)
+        if violations:
+            message = 'Превышен бюджет маршрута {}: {}'.format(
+                metrics['view'],
+                ', '.join(
+                    f'{name} = {value} (предел {limit})'
+                    for name, value, limit in violations
+                )
+            )
+            if self.raise_on_budget:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message, extra={'sql_metrics': metrics})
+        return response
+
+    def process_template_response(self, request, response):
+        # Шаблон отрисовывается после всех process_template_response,
+        # а этот middleware вызывается последним из них.
+        started = time.perf_counter()
+
+        def rendered(response):
+            request._template_duration = time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def collect(request, response, recorder, started):
+        match = getattr(request, 'resolver_match', None)
+        template_duration = getattr(request, '_template_duration', None)
+        duplicates = recorder.duplicates()
+        return {
+            'view': match.view_name if match else None,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'db_ms': round(recorder.duration * 1000, 2),
+            'template_ms': (
+                round(template_duration * 1000, 2)
+                if template_duration is not None else None
+            ),
+            'total_ms': round((time.perf_counter() - started) * 1000, 2),
+            'max_repeats': duplicates[0][1] if duplicates else 0,
+            'duplicates': [
+                {'sql': sql, 'count': count}
+                for sql, count in duplicates[:DUPLICATES_LOGGED]
+            ],
+        }
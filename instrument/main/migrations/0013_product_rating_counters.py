@@ -0,0 +1,57 @@
+# Generated by Django 4.2 on 2026-10-18 05:20
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_rating_counters(apps, schema_editor):
+    Product = apps.get_model('main', 'Product')
+    Rating = apps.get_model('main', 'Rating')
+    totals = Rating.objects.order_by().values('product').annotate(
+        count=Count('id'),
+        total=Sum('rating')
+    )
+    Product.objects.update(rating_count=0, rating_sum=0, average_rating=0)
+    Product.objects.bulk_update(
+        [
+            Product(
+                pk=row['product'],
+                rating_count=row['count'],
+                rating_sum=row['total'],
+                average_rating=row['total'] / row['count']
+            )
+            for row in totals
+        ],
+        ('rating_count', 'rating_sum', 'average_rating'),
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_alter_product_options_product_average_rating_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='product',
+            options={'ordering': ('-average_rating',), 'verbose_name': 'инструмент', 'verbose_name_plural': 'Инструменты'},
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество оценок'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Сумма оценок'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='average_rating',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_rating_counters, migrations.RunPython.noop),
+    ]
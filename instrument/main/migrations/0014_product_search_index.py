@@ -0,0 +1,160 @@
+import re
+from functools import lru_cache
+
+from django.db import migrations
+
+TABLE = 'main_product_search'
+BATCH_SIZE = 500
+
+WORD_RE = re.compile(r'\w+')
+
+# Стеммер скопирован из main.search на момент создания миграции:
+# последующие изменения модуля не должны менять её результат.
+VOWELS = 'аеиоуыэюя'
+PERFECTIVE_GERUND = (('в', 'вши', 'вшись'),
+                     ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+ADJECTIVE = ('ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой',
+             'ем', 'им', 'ым', 'ом', 'его', 'ого', 'ему', 'ому', 'их', 'ых',
+             'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+REFLEXIVE = ('ся', 'сь')
+VERB = (('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но',
+         'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'),
+        ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей',
+         'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят',
+         'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'))
+NOUN = ('а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии',
+        'и', 'ией', 'ей', 'ой', 'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам',
+        'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия',
+        'ья', 'я')
+SUPERLATIVE = ('ейш', 'ейше')
+DERIVATIONAL = ('ост', 'ость')
+
+
+def _region_after_consonant(word, start):
+    for index in range(max(start, 1), len(word)):
+        if word[index] not in VOWELS and word[index - 1] in VOWELS:
+            return index + 1
+    return len(word)
+
+
+def _strip(word, start, endings, after_a=()):
+    """
+    Отрезает самое длинное окончание, целиком лежащее в области start.
+
+    Окончания из after_a отрезаются, только если им предшествует
+    «а» или «я» в той же области.
+    """
+    match = None
+    for ending in (*endings, *after_a):
+        if (word.endswith(ending) and len(word) - len(ending) >= start
+                and (match is None or len(ending) > len(match))):
+            match = ending
+    if match is None:
+        return None
+    stem = word[:-len(match)]
+    if match in after_a and match not in endings:
+        if len(stem) - 1 < start or stem[-1] not in 'ая':
+            return None
+    return stem
+
+
+@lru_cache(maxsize=65536)
+def stem(word):
+    """Основа русского слова; прочие слова возвращаются в нижнем регистре."""
+    word = word.lower().replace('ё', 'е')
+    rv = next(
+        (index + 1 for index, char in enumerate(word) if char in VOWELS),
+        len(word)
+    )
+    if rv >= len(word):
+        return word
+    r2 = _region_after_consonant(word, _region_after_consonant(word, 1))
+
+    result = _strip(word, rv, PERFECTIVE_GERUND[1], PERFECTIVE_GERUND[0])
+    if result is None:
+        word = _strip(word, rv, REFLEXIVE) or word
+        adjective = _strip(word, rv, ADJECTIVE)
+        if adjective is not None:
+            result = _strip(adjective, rv, PARTICIPLE[1], PARTICIPLE[0])
+            result = adjective if result is None else result
+        else:
+            result = _strip(word, rv, VERB[1], VERB[0])
+            if result is None:
+                result = _strip(word, rv, NOUN)
+            if result is None:
+                result = word
+    word = result
+
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+    derived = _strip(word, r2, DERIVATIONAL)
+    if derived is not None:
+        word = derived
+
+    superlative = _strip(word, rv, SUPERLATIVE)
+    if superlative is not None:
+        word = superlative
+    if word.endswith('нн') and len(word) - 1 >= rv:
+        word = word[:-1]
+    elif superlative is None and word.endswith('ь') and len(word) - 1 >= rv:
+        word = word[:-1]
+    return word
+
+
+def normalize(text):
+    """Текст в виде последовательности основ, разделённых пробелами."""
+    return ' '.join(stem(word) for word in WORD_RE.findall(text or ''))
+
+
+def _document(product):
+    manufacturer = product.manufacturer.name if product.manufacturer_id else ''
+    return (
+        product.pk,
+        normalize(product.title),
+        normalize(f'{product.description} {product.parameters}'),
+        normalize(manufacturer),
+    )
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5('
+        f"title, body, manufacturer, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    products = apps.get_model('main', 'Product').objects.select_related(
+        'manufacturer'
+    )
+    insert = (
+        f'INSERT INTO {TABLE} (rowid, title, body, manufacturer) '
+        f'VALUES (%s, %s, %s, %s)'
+    )
+    batch = []
+    with schema_editor.connection.cursor() as cursor:
+        for product in products.iterator(chunk_size=BATCH_SIZE):
+            batch.append(_document(product))
+            if len(batch) == BATCH_SIZE:
+                cursor.executemany(insert, batch)
+                batch = []
+        if batch:
+            cursor.executemany(insert, batch)
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_product_rating_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,71 @@
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_cart_item_prices(apps, schema_editor):
+    CartItem = apps.get_model('main', 'CartItem')
+    Product = apps.get_model('main', 'Product')
+    CartItem.objects.update(
+        price=Subquery(
+            Product.objects.filter(
+                pk=OuterRef('product_id')
+            ).values('price')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+    """
+    Связь корзины с продуктами получает промежуточную модель.
+
+    Существующая таблица main_cart_product становится таблицей
+    CartItem: состояние описывается заново, строки корзин сохраняются.
+    """
+
+    dependencies = [
+        ('main', '0014_product_search_index'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='CartItem',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('cart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='main.cart', verbose_name='Корзина')),
+                        ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.product', verbose_name='Продукт')),
+                    ],
+                    options={
+                        'db_table': 'main_cart_product',
+                        'verbose_name': 'позиция корзины',
+                        'verbose_name_plural': 'Позиции корзины',
+                        'unique_together': {('cart', 'product')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='cart',
+                    name='product',
+                    field=models.ManyToManyField(through='main.CartItem', to='main.product', verbose_name='Продукт'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='cartitem',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)], verbose_name='Количество'),
+        ),
+        migrations.AddField(
+            model_name='cartitem',
+            name='price',
+            field=models.FloatField(default=0, help_text='Цена продукта на момент добавления в корзину.', verbose_name='Цена'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_cart_item_prices, migrations.RunPython.noop),
+        migrations.AlterModelTable(
+            name='cartitem',
+            table=None,
+        ),
+    ]
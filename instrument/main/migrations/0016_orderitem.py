@@ -0,0 +1,89 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_order_item_prices(apps, schema_editor):
+    OrderItem = apps.get_model('main', 'OrderItem')
+    Product = apps.get_model('main', 'Product')
+    OrderItem.objects.update(
+        price=Subquery(
+            Product.objects.filter(
+                pk=OuterRef('product_id')
+            ).values('price')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+    """
+    Связь заказа с продуктами получает промежуточную модель.
+
+    Существующая таблица main_orderhistory_product становится таблицей
+    OrderItem; цена позиций заполняется текущей ценой продукта.
+    """
+
+    dependencies = [
+        ('main', '0015_cartitem'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='OrderItem',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('orderhistory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.orderhistory')),
+                        ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.product', verbose_name='Продукт')),
+                    ],
+                    options={
+                        'db_table': 'main_orderhistory_product',
+                        'verbose_name': 'позиция заказа',
+                        'verbose_name_plural': 'Позиции заказа',
+                        'unique_together': {('orderhistory', 'product')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='orderhistory',
+                    name='product',
+                    field=models.ManyToManyField(through='main.OrderItem', to='main.product', verbose_name='Продукт'),
+                ),
+            ],
+        ),
+        migrations.RenameField(
+            model_name='orderitem',
+            old_name='orderhistory',
+            new_name='order',
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='main.orderhistory', verbose_name='Заказ'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1, verbose_name='Количество'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='price',
+            field=models.FloatField(default=0, help_text='Цена продукта на момент оформления заказа.', verbose_name='Цена'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_order_item_prices, migrations.RunPython.noop),
+        migrations.AlterModelTable(
+            name='orderitem',
+            table=None,
+        ),
+        migrations.AddField(
+            model_name='orderhistory',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, help_text='Повторная отправка заказа с тем же ключом не создаёт новый заказ.', max_length=64, null=True, verbose_name='Ключ идемпотентности'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='orderhistory',
+            unique_together={('user', 'idempotency_key')},
+        ),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 4.2 on 2026-10-18 05:31
+
+from django.db import migrations, models
+from django.db.models import (F, FloatField, IntegerField, OuterRef, Subquery,
+                              Sum)
+from django.db.models.functions import Coalesce
+
+
+def fill_order_snapshots(apps, schema_editor):
+    OrderHistory = apps.get_model('main', 'OrderHistory')
+    OrderItem = apps.get_model('main', 'OrderItem')
+    Product = apps.get_model('main', 'Product')
+    product = Product.objects.filter(pk=OuterRef('product_id'))
+    OrderItem.objects.update(
+        title=Subquery(product.values('title')[:1]),
+        category_slug=Subquery(product.values('category__slug')[:1]),
+        product_type_slug=Subquery(product.values('product_type__slug')[:1]),
+        image=Subquery(product.values('image')[:1]),
+    )
+    OrderItem.objects.filter(image__isnull=True).update(image='')
+    items = OrderItem.objects.filter(
+        order=OuterRef('pk')
+    ).order_by().values('order')
+    OrderHistory.objects.update(
+        total_price=Coalesce(
+            Subquery(
+                items.annotate(
+                    total=Sum(
+                        F('price') * F('quantity'),
+                        output_field=FloatField()
+                    )
+                ).values('total'),
+                output_field=FloatField()
+            ),
+            0.0
+        ),
+        item_count=Coalesce(
+            Subquery(
+                items.annotate(total=Sum('quantity')).values('total'),
+                output_field=IntegerField()
+            ),
+            0
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_orderitem'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='orderhistory',
+            options={'ordering': ('-created_at', '-id'), 'verbose_name': 'история заказов', 'verbose_name_plural': 'Истории заказов'},
+        ),
+        migrations.AddField(
+            model_name='orderhistory',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество товаров'),
+        ),
+        migrations.AddField(
+            model_name='orderhistory',
+            name='total_price',
+            field=models.FloatField(default=0, editable=False, verbose_name='Сумма заказа'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='category_slug',
+            field=models.SlugField(blank=True, db_index=False, verbose_name='Идентификатор категории'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='image',
+            field=models.ImageField(blank=True, upload_to='product/', verbose_name='Фото инструмента'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_type_slug',
+            field=models.SlugField(blank=True, db_index=False, verbose_name='Идентификатор типа продукта'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='title',
+            field=models.CharField(blank=True, max_length=40, verbose_name='Название'),
+        ),
+        migrations.AlterField(
+            model_name='orderhistory',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, verbose_name='Время создания'),
+        ),
+        migrations.AddIndex(
+            model_name='orderhistory',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='orderhistory_user_created_idx'),
+        ),
+        migrations.RunPython(fill_order_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2 on 2026-10-18 05:42
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_comment_count(apps, schema_editor):
+    Product = apps.get_model('main', 'Product')
+    Comment = apps.get_model('main', 'Comment')
+    Product.objects.update(
+        comment_count=Coalesce(
+            Subquery(
+                Comment.objects.filter(
+                    product_id=OuterRef('pk')
+                ).order_by().values('product_id').annotate(
+                    count=Count('id')
+                ).values('count')
+            ),
+            0
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0018_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='comment',
+            options={'ordering': ('created_at', 'id'), 'verbose_name': 'комментарий', 'verbose_name_plural': 'Комментарии'},
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество комментариев'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['product_id', 'created_at', 'id'], name='comment_product_created_idx'),
+        ),
+        migrations.RunPython(fill_comment_count, migrations.RunPython.noop),
+    ]
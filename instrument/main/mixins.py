@@ -1,7 +1,11 @@
+from django.conf import settings
+from django.core.paginator import InvalidPage
+from django.http import Http404
 from django.urls import reverse, reverse_lazy
 
 from .forms import CategoryForm, CommentForm, ProductForm, ProductTypeForm
 from .models import Category, Comment, Product, ProductType, User
+from .paginators import CachedCountPaginator, KeysetPaginator
 
 
 class ProductCreateUpdateDeleteMixin:
@@ -49,6 +53,32 @@ class CommentMixinCreateUpdateDeleteMixin:
         )
 
 
+class CommentPaginationMixin:
+    """
+    Миксин курсорной пагинации комментариев продукта.
+
+    Комментарии идут по ключу (created_at, id) вместе с авторами,
+    поэтому страница — это один запрос независимо от её номера
+    и количества комментариев у продукта.
+    """
+
+    comments_paginate_by = 20
+    comments_ordering = ('created_at', 'id')
+    comments_cursor_kwarg = 'comments_cursor'
+
+    def get_comments_page(self, product_id):
+        paginator = KeysetPaginator(
+            Comment.objects.filter(
+                product_id=product_id
+            ).select_related('author'),
+            self.comments_paginate_by,
+            ordering=self.comments_ordering
+        )
+        return paginator.page(
+            self.request.GET.get(self.comments_cursor_kwarg)
+        )
+
+
 class DispatchMixin:
     """
     Миксин для перенаправления нежелательного
@@ -76,3 +106,57 @@ class CartAndFavViewMixin:
     model = User
     slug_field = 'username'
     slug_url_kwarg = 'username'
+
+
+class CatalogPaginationMixin:
+    """
+    Миксин пагинации списков продуктов.
+
+    По умолчанию страницы выбираются через OFFSET с закэшированным
+    количеством объектов; при CATALOG_KEYSET_PAGINATION = True —
+    курсором по ключу (average_rating, id). Представление может
+    выбрать способ само, задав keyset_pagination.
+    """
+
+    paginator_class = CachedCountPaginator
+    # None — по настройке CATALOG_KEYSET_PAGINATION на момент запроса.
+    keyset_pagination = None
+    keyset_ordering = ('-average_rating', '-id')
+    page_kwarg = 'page'
+    cursor_kwarg = 'cursor'
+
+    def uses_keyset_pagination(self):
+        if self.keyset_pagination is None:
+            return getattr(settings, 'CATALOG_KEYSET_PAGINATION', False)
+        return self.keyset_pagination
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.uses_keyset_pagination():
+            paginator = KeysetPaginator(
+                queryset,
+                page_size,
+                ordering=self.keyset_ordering
+            )
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        else:
+            paginator = self.paginator_class(queryset, page_size)
+            try:
+                page = paginator.page(
+                    self.request.GET.get(self.page_kwarg) or 1
+                )
+            except InvalidPage:
+                raise Http404('Страница не найдена.')
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_paginated_context(self, queryset, context_object_name):
+        """Пагинация дополнительного списка в DetailView."""
+        paginator, page, object_list, is_paginated = self.paginate_queryset(
+            queryset.order_by(*self.keyset_ordering),
+            self.paginate_by
+        )
+        return {
+            'paginator': paginator,
+            'page_obj': page,
+            'is_paginated': is_paginated,
+            context_object_name: object_list,
+        }
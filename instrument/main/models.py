@@ -1,6 +1,9 @@
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Cast, Greatest, Substr
+from django.utils import timezone
 
 
 User = get_user_model()
@@ -61,6 +64,12 @@ class Category(Published):
         blank=True,
         verbose_name='Фото категории'
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии фото'
+    )
 
     class Meta:
         verbose_name = 'категория'
@@ -100,6 +109,91 @@ class ProductType(Published):
         return self.title
 
 
+# Длина фрагмента описания, достаточная для truncatewords в карточке.
+PREVIEW_LENGTH = 200
+
+
+class ProductQuerySet(models.QuerySet):
+    """Набор запросов для карточек продуктов каталога."""
+
+    def published(self):
+        """
+        Только опубликованные продукты из опубликованных разделов.
+
+        Время публикации сравнивается с точностью до минуты, чтобы
+        текст запроса не менялся от запроса к запросу и закэшированные
+        по нему результаты (например, количество объектов) оставались
+        действительными.
+        """
+        return self.filter(
+            is_published=True,
+            pub_date__lte=timezone.now().replace(second=0, microsecond=0),
+            category__is_published=True,
+            product_type__is_published=True,
+        )
+
+    def scheduled(self):
+        """
+        Продукты, которые станут видны в каталоге сами, когда наступит
+        время публикации.
+        """
+        return self.filter(
+            is_published=True,
+            pub_date__gt=timezone.now().replace(second=0, microsecond=0),
+            category__is_published=True,
+            product_type__is_published=True,
+        )
+
+    def with_related(self):
+        """
+        Данные для карточки продукта: категория и тип продукта одним
+        JOIN, без тяжёлых текстовых полей, с коротким фрагментом описания.
+        """
+        return self.select_related(
+            'category',
+            'product_type'
+        ).defer(
+            'description',
+            'parameters'
+        ).annotate(
+            description_preview=Substr(
+                'description', 1, PREVIEW_LENGTH
+            )
+        )
+
+    def for_listing(self):
+        """Опубликованные продукты для списков каталога."""
+        return self.published().with_related()
+
+    def apply_rating_change(self, count_delta, sum_delta):
+        """
+        Изменяет счётчики рейтинга одним UPDATE без чтения оценок.
+
+        Средний рейтинг пересчитывается в том же выражении из новых
+        значений rating_sum и rating_count.
+        """
+        new_count = F('rating_count') + count_delta
+        new_sum = F('rating_sum') + sum_delta
+        return self.update(
+            rating_count=new_count,
+            rating_sum=new_sum,
+            average_rating=Case(
+                When(
+                    rating_count__lte=-count_delta,
+                    then=Value(0.0)
+                ),
+                default=Cast(new_sum, FloatField()) / new_count,
+                output_field=FloatField()
+            )
+        )
+
+    def apply_comment_change(self, delta):
+        """Изменяет счётчик комментариев одним UPDATE."""
+        return self.update(
+            comment_count=Greatest(F('comment_count') + delta, Value(0))
+        )
+
+
 class Product(Published):
     """Таблица в БД - Продукт."""
 
@@ -133,6 +227,12 @@ class Product(Published):
         blank=True,
         verbose_name='Фото инструмента'
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии фото'
+    )
     pub_date = models.DateTimeField(
         verbose_name='Дата и время публикации',
         help_text='Если установить дату и время в будущем'
@@ -150,22 +250,50 @@ class Product(Published):
         null=True,
         verbose_name='Производетель'
     )
-    average_rating = models.FloatField(default=0)
+    rating_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество оценок'
+    )
+    rating_sum = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Сумма оценок'
+    )
+    average_rating = models.FloatField(default=0, editable=False)
+    comment_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество комментариев'
+    )
 
-    def update_average_rating(self):
-        ratings = Rating.objects.filter(product=self)
-        total_rating = sum([rating.rating for rating in ratings])
-        num_ratings = len(ratings)
-        if num_ratings > 0:
-            self.average_rating = total_rating / num_ratings
-        else:
-            self.average_rating = 0
-        self.save()
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'инструмент'
         verbose_name_plural = 'Инструменты'
         ordering = ('-average_rating',)
+        # Индексы под сортировку списков каталога по рейтингу: страница
+        # читается из индекса по порядку и обрывается на LIMIT.
+        indexes = (
+            models.Index(
+                fields=('-average_rating', '-id'),
+                condition=models.Q(is_published=True),
+                name='product_published_rating_idx'
+            ),
+            models.Index(
+                fields=('category', '-average_rating', '-id'),
+                name='product_category_rating_idx'
+            ),
+            models.Index(
+                fields=('product_type', '-average_rating', '-id'),
+                name='product_type_rating_idx'
+            ),
+            models.Index(
+                fields=('product_type', 'price'),
+                name='product_type_price_idx'
+            ),
+        )
 
     def __str__(self):
         return self.title
@@ -191,10 +319,16 @@ class Comment(Published):
     class Meta:
         verbose_name = 'комментарий'
         verbose_name_plural = 'Комментарии'
-        ordering = ('created_at',)
+        ordering = ('created_at', 'id')
+        indexes = (
+            models.Index(
+                fields=('product_id', 'created_at', 'id'),
+                name='comment_product_created_idx'
+            ),
+        )
 
     def __str__(self):
-        return self.author
+        return str(self.author)
 
 
 class CartAndFavModel(models.Model):
@@ -217,6 +351,12 @@ class CartAndFavModel(models.Model):
 class Cart(CartAndFavModel):
     """Таблица в БД - Корзина."""
 
+    product = models.ManyToManyField(
+        Product,
+        through='CartItem',
+        verbose_name='Продукт',
+    )
+
     def __str__(self):
         return f'{self.user} добавил в корзину {self.product}'
 
@@ -225,6 +365,39 @@ class Cart(CartAndFavModel):
         verbose_name_plural = 'Корзины'
 
 
+class CartItem(models.Model):
+    """Таблица в БД - Позиция корзины."""
+
+    cart = models.ForeignKey(
+        Cart,
+        on_delete=models.CASCADE,
+        verbose_name='Корзина',
+        related_name='items'
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        verbose_name='Продукт'
+    )
+    quantity = models.PositiveIntegerField(
+        default=1,
+        validators=[MinValueValidator(1)],
+        verbose_name='Количество'
+    )
+    price = models.FloatField(
+        verbose_name='Цена',
+        help_text='Цена продукта на момент добавления в корзину.'
+    )
+
+    class Meta:
+        verbose_name = 'позиция корзины'
+        verbose_name_plural = 'Позиции корзины'
+        unique_together = ('cart', 'product')
+
+    def __str__(self):
+        return f'{self.product} x {self.quantity}'
+
+
 class OrderHistory(models.Model):
     """Запись в БД - История заказов."""
 
@@ -240,12 +413,32 @@ class OrderHistory(models.Model):
     )
     product = models.ManyToManyField(
         Product,
+        through='OrderItem',
         verbose_name='Продукт'
     )
     created_at = models.DateTimeField(
-        auto_now=True,
+        auto_now_add=True,
         verbose_name='Время создания'
     )
+    total_price = models.FloatField(
+        default=0,
+        editable=False,
+        verbose_name='Сумма заказа'
+    )
+    item_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество товаров'
+    )
+    idempotency_key = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Ключ идемпотентности',
+        help_text='Повторная отправка заказа с тем же ключом'
+                  ' не создаёт новый заказ.'
+    )
 
     def __str__(self):
         return f'{self.user} - {self.cart}'
@@ -253,7 +446,68 @@ class OrderHistory(models.Model):
     class Meta:
         verbose_name = 'история заказов'
         verbose_name_plural = 'Истории заказов'
-        ordering = ('-created_at',)
+        ordering = ('-created_at', '-id')
+        unique_together = ('user', 'idempotency_key')
+        indexes = (
+            models.Index(
+                fields=('user', '-created_at', '-id'),
+                name='orderhistory_user_created_idx'
+            ),
+        )
+
+
+class OrderItem(models.Model):
+    """Таблица в БД - Позиция заказа."""
+
+    order = models.ForeignKey(
+        OrderHistory,
+        on_delete=models.CASCADE,
+        verbose_name='Заказ',
+        related_name='items'
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        verbose_name='Продукт'
+    )
+    quantity = models.PositiveIntegerField(
+        default=1,
+        verbose_name='Количество'
+    )
+    price = models.FloatField(
+        verbose_name='Цена',
+        help_text='Цена продукта на момент оформления заказа.'
+    )
+    # Данные продукта на момент заказа: история показывается
+    # без обращения к продуктам, категориям и типам.
+    title = models.CharField(
+        max_length=40,
+        blank=True,
+        verbose_name='Название'
+    )
+    category_slug = models.SlugField(
+        db_index=False,
+        blank=True,
+        verbose_name='Идентификатор категории'
+    )
+    product_type_slug = models.SlugField(
+        db_index=False,
+        blank=True,
+        verbose_name='Идентификатор типа продукта'
+    )
+    image = models.ImageField(
+        upload_to='product/',
+        blank=True,
+        verbose_name='Фото инструмента'
+    )
+
+    class Meta:
+        verbose_name = 'позиция заказа'
+        verbose_name_plural = 'Позиции заказа'
+        unique_together = ('order', 'product')
+
+    def __str__(self):
+        return f'{self.product} x {self.quantity}'
 
 
 class Favorite(CartAndFavModel):
@@ -298,8 +552,19 @@ class Rating(models.Model):
     def __str__(self):
         return f'{self.user} - {self.product} - {self.rating}'
 
+    def save(self, *args, **kwargs):
+        # Счётчики продукта обновляются в сигналах той же транзакции.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'рейтинг'
         verbose_name_plural = 'Рейтинги'
         ordering = ('-created_at',)
+        indexes = (
+            models.Index(
+                fields=('product', 'user', '-created_at', '-id'),
+                name='rating_product_user_idx'
+            ),
+        )
 
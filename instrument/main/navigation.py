@@ -0,0 +1,63 @@
+"""
+Дерево навигации по каталогу для боковой панели.
+
+Опубликованные категории с их типами продуктов строятся двумя
+запросами при изменении каталога и хранятся в кэше и в памяти
+процесса под номером версии; в остальное время отрисовка боковой
+панели не обращается к базе данных.
+"""
+import threading
+
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from . import versioning
+from .models import Category, ProductType
+
+NAMESPACE = 'navigation'
+
+_lock = threading.Lock()
+_state = {'tree': None, 'version': None}
+
+
+def build_tree():
+    categories = Category.objects.filter(
+        is_published=True
+    ).order_by('title', 'id').prefetch_related(
+        Prefetch(
+            'types',
+            queryset=ProductType.objects.filter(
+                is_published=True
+            ).order_by('title', 'id')
+        )
+    )
+    return [
+        {
+            'title': category.title,
+            'slug': category.slug,
+            'types': [
+                {'title': product_type.title, 'slug': product_type.slug}
+                for product_type in category.types.all()
+            ],
+        }
+        for category in categories
+    ]
+
+
+def get_tree():
+    """Дерево навигации текущей версии каталога."""
+    version = versioning.get_version(NAMESPACE)
+    if _state['version'] == version:
+        return _state['tree']
+    key = f'navigation:{version}'
+    tree = cache.get(key)
+    if tree is None:
+        tree = build_tree()
+        cache.set(key, tree, None)
+    with _lock:
+        _state['tree'], _state['version'] = tree, version
+    return tree
+
+
+def invalidate():
+    versioning.bump_version(NAMESPACE)
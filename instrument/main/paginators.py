@@ -0,0 +1,284 @@
+import datetime
+import json
+from hashlib import md5
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Page, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+# Время жизни закэшированного количества объектов, в секундах.
+COUNT_CACHE_TIMEOUT = getattr(settings, 'PAGINATOR_COUNT_TIMEOUT', 60)
+# Сколько ссылок на соседние страницы показывать с каждой стороны.
+PAGE_WINDOW_SIDE = 2
+PAGE_WINDOW_ENDS = 1
+CURSOR_SALT = 'main.paginators.cursor'
+# С какого числа строк количество в списке без фильтров берётся из
+# статистики СУБД, а не из COUNT(*).
+ESTIMATED_COUNT_THRESHOLD = getattr(
+    settings, 'PAGINATOR_ESTIMATE_THRESHOLD', 10000
+)
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    Время записывается с микросекундами: DjangoJSONEncoder округляет
+    его до миллисекунд, и сравнение с ключом в курсоре пропускало бы
+    или повторяло строки, созданные в одну миллисекунду.
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class CursorSerializer:
+    """
+    JSON-сериализатор курсора: даты и время ключа записываются строками
+    ISO 8601, которые фильтры по DateTimeField принимают как есть.
+    """
+
+    def dumps(self, obj):
+        return json.dumps(
+            obj,
+            separators=(',', ':'),
+            cls=CursorEncoder
+        ).encode('latin-1')
+
+    def loads(self, data):
+        return json.loads(data.decode('latin-1'))
+
+
+class WindowedPage(Page):
+    """Страница с ограниченным окном ссылок на соседние страницы."""
+
+    is_keyset = False
+
+    @property
+    def page_window(self):
+        return self.paginator.get_elided_page_range(
+            self.number,
+            on_each_side=PAGE_WINDOW_SIDE,
+            on_ends=PAGE_WINDOW_ENDS
+        )
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Пагинатор, который не выполняет COUNT(*) на каждый запрос:
+    количество объектов кэшируется по тексту SQL-запроса.
+    """
+
+    def _get_page(self, *args, **kwargs):
+        return WindowedPage(*args, **kwargs)
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        try:
+            sql = str(query) if query is not None else None
+        except EmptyResultSet:
+            sql = None
+        if sql is None:
+            return super().count
+        key = 'paginator-count:' + md5(
+            sql.encode(), usedforsecurity=False
+        ).hexdigest()
+        return cache.get_or_set(
+            key,
+            lambda: Paginator.count.func(self),
+            COUNT_CACHE_TIMEOUT
+        )
+
+
+def estimated_count(model, using='default'):
+    """
+    Число строк таблицы по статистике СУБД (pg_class в PostgreSQL,
+    sqlite_stat1 после ANALYZE в SQLite) или None, если её нет.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)',
+                [table]
+            )
+            row = cursor.fetchone()
+            # -1 — таблица ещё ни разу не анализировалась.
+            return int(row[0]) if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+            )
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table])
+            # Первое число статистики индекса — строк в нём; частичные
+            # индексы короче таблицы, поэтому берётся наибольшее.
+            counts = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+            return max(counts) if counts else None
+    return None
+
+
+class EstimatedCountPaginator(CachedCountPaginator):
+    """
+    Пагинатор списков админки для больших таблиц: без фильтров и
+    поиска количество берётся из статистики СУБД, а не из COUNT(*)
+    по всей таблице. Оценка бывает неточной, поэтому последние
+    страницы могут оказаться короче или пустыми.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        if query is not None and not query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class KeysetPage:
+    """Страница курсорной пагинации."""
+
+    is_keyset = True
+
+    def __init__(self, object_list, paginator, number,
+                 next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.number = number
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __repr__(self):
+        return f'<Keyset page {self.number}>'
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Курсорная пагинация по упорядоченному набору полей.
+
+    Последнее поле ordering должно быть уникальным (обычно id),
+    тогда выборка любой страницы — это индексный поиск по ключу
+    и LIMIT, без OFFSET, и глубокие страницы стоят столько же,
+    сколько первая.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-average_rating', '-id')):
+        self.per_page = per_page
+        self.ordering = ordering
+        self.fields = [field.lstrip('-') for field in ordering]
+        self.queryset = queryset.order_by(*ordering)
+        self.count_paginator = CachedCountPaginator(self.queryset, per_page)
+
+    @property
+    def count(self):
+        return self.count_paginator.count
+
+    @property
+    def num_pages(self):
+        return self.count_paginator.num_pages
+
+    def encode_cursor(self, obj, direction, number):
+        return signing.dumps(
+            {
+                'key': [getattr(obj, field) for field in self.fields],
+                'dir': direction,
+                'num': number,
+            },
+            salt=CURSOR_SALT,
+            serializer=CursorSerializer,
+            compress=True
+        )
+
+    def decode_cursor(self, cursor):
+        try:
+            data = signing.loads(
+                cursor,
+                salt=CURSOR_SALT,
+                serializer=CursorSerializer
+            )
+            key, direction = data['key'], data['dir']
+            number = int(data['num'])
+        except (signing.BadSignature, KeyError, TypeError, ValueError):
+            return None
+        if len(key) != len(self.fields) or direction not in ('next', 'prev'):
+            return None
+        return key, direction, number
+
+    def _seek(self, key, forward):
+        """Условие «строго после ключа» (или «строго до» при forward=False)."""
+        condition = Q()
+        for index, field in enumerate(self.fields):
+            descending = self.ordering[index].startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            step = Q(**{f'{field}__{lookup}': key[index]})
+            for previous, value in zip(self.fields[:index], key):
+                step &= Q(**{previous: value})
+            condition |= step
+        return condition
+
+    def page(self, cursor=None):
+        decoded = self.decode_cursor(cursor) if cursor else None
+        if decoded is None:
+            rows = list(self.queryset[:self.per_page + 1])
+            has_more, number, forward = len(rows) > self.per_page, 1, True
+            rows = rows[:self.per_page]
+            has_before = False
+        else:
+            key, direction, number = decoded
+            forward = direction == 'next'
+            queryset = self.queryset.filter(self._seek(key, forward))
+            if not forward:
+                queryset = queryset.reverse()
+            rows = list(queryset[:self.per_page + 1])
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            if not forward:
+                rows.reverse()
+            has_before = True
+        if forward:
+            has_next, has_previous = has_more, has_before
+        else:
+            has_next, has_previous = has_before, has_more
+        number = max(number, 1)
+        return KeysetPage(
+            rows,
+            self,
+            number,
+            next_cursor=(
+                self.encode_cursor(rows[-1], 'next', number + 1)
+                if has_next and rows else None
+            ),
+            previous_cursor=(
+                self.encode_cursor(rows[0], 'prev', number - 1)
+                if has_previous and rows else None
+            ),
+        )
@@ -0,0 +1,39 @@
+"""
+Полный пересчёт счётчиков рейтинга продуктов по таблице оценок.
+
+В обычной работе счётчики поддерживают сигналы оценок (main.signals);
+пересчёт нужен после загрузки данных в обход сигналов.
+"""
+from django.db import transaction
+from django.db.models import Count, Sum
+
+BATCH_SIZE = 500
+
+
+def recount(product_model, rating_model, batch_size=BATCH_SIZE):
+    """Пересчитывает счётчики всех продуктов; возвращает число оценённых."""
+    totals = rating_model.objects.order_by().values('product').annotate(
+        count=Count('id'),
+        total=Sum('rating')
+    )
+    products = [
+        product_model(
+            pk=row['product'],
+            rating_count=row['count'],
+            rating_sum=row['total'],
+            average_rating=row['total'] / row['count']
+        )
+        for row in totals
+    ]
+    with transaction.atomic():
+        product_model.objects.update(
+            rating_count=0,
+            rating_sum=0,
+            average_rating=0
+        )
+        product_model.objects.bulk_update(
+            products,
+            ('rating_count', 'rating_sum', 'average_rating'),
+            batch_size=batch_size
+        )
+    return len(products)
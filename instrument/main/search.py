@@ -0,0 +1,238 @@
+"""
+Полнотекстовый поиск по продуктам.
+
+Индекс хранится в виртуальной таблице SQLite FTS5. Русская морфология
+учитывается заранее: и текст продукта, и поисковый запрос проходят
+через один и тот же стеммер (облегчённый Snowball для русского языка),
+поэтому «молотки» и «молотков» находятся по одной основе. На других
+СУБД поиск откатывается к icontains по тем же полям.
+"""
+import re
+from functools import lru_cache
+
+from django.db import connection
+from django.db.models import Q
+
+TABLE = 'main_product_search'
+# Веса bm25 для столбцов title, body, manufacturer.
+COLUMN_WEIGHTS = (10.0, 1.0, 3.0)
+BATCH_SIZE = 500
+MAX_QUERY_TERMS = 8
+# Словарь каталога невелик: при индексации тысяч продуктов одни и те
+# же слова встречаются снова и снова.
+STEM_CACHE_SIZE = 65536
+# С какой длины основы последняя буква не участвует в префиксном
+# поиске: так «молотки» (основа «молотк») находит и «молоток».
+LOOSE_PREFIX_LENGTH = 6
+
+WORD_RE = re.compile(r'\w+')
+
+VOWELS = 'аеиоуыэюя'
+PERFECTIVE_GERUND = (('в', 'вши', 'вшись'),
+                     ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+ADJECTIVE = ('ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой',
+             'ем', 'им', 'ым', 'ом', 'его', 'ого', 'ему', 'ому', 'их', 'ых',
+             'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+REFLEXIVE = ('ся', 'сь')
+VERB = (('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но',
+         'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'),
+        ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей',
+         'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят',
+         'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'))
+NOUN = ('а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии',
+        'и', 'ией', 'ей', 'ой', 'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам',
+        'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия',
+        'ья', 'я')
+SUPERLATIVE = ('ейш', 'ейше')
+DERIVATIONAL = ('ост', 'ость')
+
+
+def _region_after_consonant(word, start):
+    for index in range(max(start, 1), len(word)):
+        if word[index] not in VOWELS and word[index - 1] in VOWELS:
+            return index + 1
+    return len(word)
+
+
+def _strip(word, start, endings, after_a=()):
+    """
+    Отрезает самое длинное окончание, целиком лежащее в области start.
+
+    Окончания из after_a отрезаются, только если им предшествует
+    «а» или «я» в той же области.
+    """
+    match = None
+    for ending in (*endings, *after_a):
+        if (word.endswith(ending) and len(word) - len(ending) >= start
+                and (match is None or len(ending) > len(match))):
+            match = ending
+    if match is None:
+        return None
+    stem = word[:-len(match)]
+    if match in after_a and match not in endings:
+        if len(stem) - 1 < start or stem[-1] not in 'ая':
+            return None
+    return stem
+
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(word):
+    """Основа русского слова; прочие слова возвращаются в нижнем регистре."""
+    word = word.lower().replace('ё', 'е')
+    rv = next(
+        (index + 1 for index, char in enumerate(word) if char in VOWELS),
+        len(word)
+    )
+    if rv >= len(word):
+        return word
+    r2 = _region_after_consonant(word, _region_after_consonant(word, 1))
+
+    result = _strip(word, rv, PERFECTIVE_GERUND[1], PERFECTIVE_GERUND[0])
+    if result is None:
+        word = _strip(word, rv, REFLEXIVE) or word
+        adjective = _strip(word, rv, ADJECTIVE)
+        if adjective is not None:
+            result = _strip(adjective, rv, PARTICIPLE[1], PARTICIPLE[0])
+            result = adjective if result is None else result
+        else:
+            result = _strip(word, rv, VERB[1], VERB[0])
+            if result is None:
+                result = _strip(word, rv, NOUN)
+            if result is None:
+                result = word
+    word = result
+
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+    derived = _strip(word, r2, DERIVATIONAL)
+    if derived is not None:
+        word = derived
+
+    superlative = _strip(word, rv, SUPERLATIVE)
+    if superlative is not None:
+        word = superlative
+    if word.endswith('нн') and len(word) - 1 >= rv:
+        word = word[:-1]
+    elif superlative is None and word.endswith('ь') and len(word) - 1 >= rv:
+        word = word[:-1]
+    return word
+
+
+def normalize(text):
+    """Текст в виде последовательности основ, разделённых пробелами."""
+    return ' '.join(stem(word) for word in WORD_RE.findall(text or ''))
+
+
+def query_terms(query):
+    """Основы слов поискового запроса без повторов."""
+    terms = []
+    for word in WORD_RE.findall(query or ''):
+        term = stem(word)
+        if term not in terms:
+            terms.append(term)
+    return terms[:MAX_QUERY_TERMS]
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def _document(product):
+    manufacturer = product.manufacturer.name if product.manufacturer_id else ''
+    return (
+        product.pk,
+        normalize(product.title),
+        normalize(f'{product.description} {product.parameters}'),
+        normalize(manufacturer),
+    )
+
+
+def index_products(products):
+    """Добавляет или обновляет продукты в поисковом индексе."""
+    if not is_available():
+        return
+    rows = [_document(product) for product in products]
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'DELETE FROM {TABLE} WHERE rowid = %s',
+            [(row[0],) for row in rows]
+        )
+        cursor.executemany(
+            f'INSERT INTO {TABLE} (rowid, title, body, manufacturer) '
+            f'VALUES (%s, %s, %s, %s)',
+            rows
+        )
+
+
+def remove_products(product_ids):
+    """Удаляет продукты из поискового индекса."""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'DELETE FROM {TABLE} WHERE rowid = %s',
+            [(product_id,) for product_id in product_ids]
+        )
+
+
+def rebuild_index(queryset):
+    """Полностью перестраивает индекс по переданным продуктам."""
+    if not is_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+    total = 0
+    batch = []
+    for product in queryset.select_related('manufacturer').iterator(
+        chunk_size=BATCH_SIZE
+    ):
+        batch.append(product)
+        if len(batch) == BATCH_SIZE:
+            index_products(batch)
+            total += len(batch)
+            batch = []
+    index_products(batch)
+    total += len(batch)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+    return total
+
+
+def search_products(queryset, query):
+    """
+    Продукты из queryset, подходящие под запрос, по убыванию релевантности.
+
+    Каждое слово запроса ищется как префикс основы, все слова
+    должны встретиться в продукте.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return queryset.none()
+    if not is_available():
+        condition = Q()
+        for word in WORD_RE.findall(query):
+            condition &= (
+                Q(title__icontains=word)
+                | Q(description__icontains=word)
+                | Q(parameters__icontains=word)
+                | Q(manufacturer__name__icontains=word)
+            )
+        return queryset.filter(condition)
+    match = ' '.join(
+        f'"{term[:-1] if len(term) >= LOOSE_PREFIX_LENGTH else term}"*'
+        for term in terms
+    )
+    table = queryset.model._meta.db_table
+    weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+    # MATCH выполняется один раз: индекс соединяется с продуктами по
+    # rowid, и bm25 считается для той же найденной строки индекса.
+    return queryset.extra(
+        select={'search_rank': f'bm25({TABLE}, {weights})'},
+        tables=[TABLE],
+        where=[f'{TABLE}.rowid = "{table}"."id"', f'{TABLE} MATCH %s'],
+        params=[match],
+        order_by=['search_rank', '-average_rating', '-id'],
+    )
@@ -0,0 +1,397 @@
+"""Операции с корзиной и заказами, выполняемые минимальным числом запросов."""
+from django.db import IntegrityError, connection, transaction
+from django.db.models import (Case, F, FloatField, PositiveIntegerField,
+                              Prefetch, Subquery, Sum, Value, When)
+from django.db.models.functions import Substr
+
+from . import autocomplete, facets, snapshots, versioning
+from .models import (PREVIEW_LENGTH, Cart, CartItem, Favorite, OrderHistory,
+                     OrderItem, Product)
+
+
+def current_price(product_id):
+    """
+    Подзапрос цены опубликованного продукта: цена фиксируется без
+    загрузки продукта, у неопубликованного она NULL.
+    """
+    return Subquery(
+        Product.objects.published().filter(pk=product_id).values('price')[:1],
+        output_field=FloatField()
+    )
+
+
+def add_to_cart(user, product_id, quantity=1):
+    """
+    Добавляет продукт в корзину.
+
+    Если позиция уже есть, количество увеличивается одним UPDATE,
+    иначе позиция вставляется одним INSERT с ценой из подзапроса.
+    Для неопубликованного продукта — Product.DoesNotExist.
+    """
+    published = Product.objects.published().filter(pk=product_id)
+    updated = CartItem.objects.filter(
+        cart__user=user,
+        product__in=published
+    ).update(quantity=F('quantity') + quantity)
+    if updated:
+        return
+    cart, _ = Cart.objects.get_or_create(user=user)
+    try:
+        with transaction.atomic():
+            CartItem.objects.create(
+                cart=cart,
+                product_id=product_id,
+                quantity=quantity,
+                price=current_price(product_id)
+            )
+    except IntegrityError:
+        # Продукт не опубликован (цена NULL) либо позицию только что
+        # добавил параллельный запрос.
+        if not CartItem.objects.filter(
+            cart=cart,
+            product__in=published
+        ).update(quantity=F('quantity') + quantity):
+            raise Product.DoesNotExist('Продукт не найден.')
+
+
+def set_cart_quantity(user, product_id, quantity):
+    """Устанавливает количество; при нуле позиция удаляется."""
+    items = CartItem.objects.filter(cart__user=user, product_id=product_id)
+    if quantity <= 0:
+        items.delete()
+    else:
+        items.update(quantity=quantity)
+
+
+def remove_from_cart(user, product_id):
+    CartItem.objects.filter(cart__user=user, product_id=product_id).delete()
+
+
+def cart_items(user):
+    """Позиции корзины вместе с данными для карточек продуктов."""
+    return CartItem.objects.filter(cart__user=user).select_related(
+        'product__category',
+        'product__product_type'
+    ).defer(
+        'product__description',
+        'product__parameters'
+    ).annotate(
+        description_preview=Substr(
+            'product__description', 1, PREVIEW_LENGTH
+        )
+    ).order_by('id')
+
+
+def anonymous_cart_items(anonymous):
+    """
+    Позиции корзины анонимного посетителя одним запросом к продуктам.
+
+    Позиции не сохраняются в БД, цена берётся текущая.
+    """
+    products = Product.objects.for_listing().in_bulk(list(anonymous.cart))
+    items = []
+    for product_id, quantity in anonymous.cart.items():
+        product = products.get(product_id)
+        if product is None:
+            continue
+        item = CartItem(product=product, quantity=quantity, price=product.price)
+        item.description_preview = product.description_preview
+        items.append(item)
+    return items
+
+
+def merge_anonymous_shopping(user, anonymous):
+    """
+    Переносит корзину и избранное анонима пользователю при входе.
+
+    Позиции вставляются одним INSERT на корзину и одним на избранное;
+    продукты, которые уже есть у пользователя, не меняются.
+    """
+    if anonymous.cart:
+        prices = dict(
+            Product.objects.filter(
+                pk__in=list(anonymous.cart)
+            ).values_list('pk', 'price')
+        )
+        if prices:
+            cart, _ = Cart.objects.get_or_create(user=user)
+            CartItem.objects.bulk_create(
+                [
+                    CartItem(
+                        cart=cart,
+                        product_id=product_id,
+                        quantity=quantity,
+                        price=prices[product_id]
+                    )
+                    for product_id, quantity in anonymous.cart.items()
+                    if product_id in prices
+                ],
+                ignore_conflicts=True
+            )
+    if anonymous.favorites:
+        product_ids = list(
+            Product.objects.filter(
+                pk__in=anonymous.favorites
+            ).values_list('pk', flat=True)
+        )
+        if product_ids:
+            favorite, _ = Favorite.objects.get_or_create(user=user)
+            through = Favorite.product.through
+            through.objects.bulk_create(
+                [
+                    through(favorite=favorite, product_id=product_id)
+                    for product_id in product_ids
+                ],
+                ignore_conflicts=True
+            )
+    anonymous.clear()
+
+
+def products_changed_in_bulk():
+    """
+    Продукты изменены пакетно (update, bulk_create, bulk_update), мимо
+    сигналов: устаревают закэшированные страницы, фасеты, снимки и
+    подсказки. Поисковый индекс вызывающий код обновляет сам, если
+    менялся текст продуктов.
+    """
+    versioning.bump_version()
+    versioning.bump_version(facets.NAMESPACE)
+    snapshots.catalog_changed()
+    autocomplete.catalog_changed()
+
+
+def published_prices(product_ids):
+    """Цены опубликованных продуктов из списка, без загрузки объектов."""
+    if not product_ids:
+        return {}
+    return dict(
+        Product.objects.published().filter(
+            pk__in=list(product_ids)
+        ).values_list('pk', 'price')
+    )
+
+
+def apply_shopping_changes(user, changes):
+    """
+    Применяет пакет операций (shopping.ShoppingChanges) к корзине
+    и избранному пользователя.
+
+    На корзину уходит не больше одного DELETE, одного UPDATE с CASE
+    и одного INSERT, на избранное — по одному DELETE и INSERT,
+    всё в одной транзакции. Неопубликованные продукты не добавляются.
+    """
+    prices = published_prices(changes.added_ids)
+    with transaction.atomic():
+        if changes.cart_add or changes.cart_set or changes.cart_remove:
+            cart, _ = Cart.objects.get_or_create(user=user)
+            items = CartItem.objects.filter(cart=cart)
+            if changes.cart_remove:
+                items.filter(product_id__in=changes.cart_remove).delete()
+            quantities = {**changes.cart_add, **changes.cart_set}
+            existing = set(
+                items.filter(
+                    product_id__in=list(quantities)
+                ).values_list('product_id', flat=True)
+            ) if quantities else set()
+            if existing:
+                items.filter(product_id__in=existing).update(
+                    quantity=Case(
+                        *[
+                            When(
+                                product_id=product_id,
+                                then=(
+                                    F('quantity') + quantity
+                                    if product_id in changes.cart_add
+                                    else Value(quantity)
+                                )
+                            )
+                            for product_id, quantity in quantities.items()
+                            if product_id in existing
+                        ],
+                        default=F('quantity'),
+                        output_field=PositiveIntegerField()
+                    )
+                )
+            CartItem.objects.bulk_create(
+                [
+                    CartItem(
+                        cart=cart,
+                        product_id=product_id,
+                        quantity=quantity,
+                        price=prices[product_id]
+                    )
+                    for product_id, quantity in quantities.items()
+                    if product_id not in existing and product_id in prices
+                ],
+                ignore_conflicts=True
+            )
+        if changes.favorite_add or changes.favorite_remove:
+            favorite, _ = Favorite.objects.get_or_create(user=user)
+            through = Favorite.product.through
+            if changes.favorite_remove:
+                through.objects.filter(
+                    favorite=favorite,
+                    product_id__in=changes.favorite_remove
+                ).delete()
+            through.objects.bulk_create(
+                [
+                    through(favorite=favorite, product_id=product_id)
+                    for product_id in changes.favorite_add
+                    if product_id in prices
+                ],
+                ignore_conflicts=True
+            )
+
+
+def _summary(cart_rows, favorite_ids):
+    return {
+        'cart': {
+            'product_ids': sorted(row[0] for row in cart_rows),
+            'count': len(cart_rows),
+            'quantity': sum(row[1] for row in cart_rows),
+            'price': round(sum(row[1] * row[2] for row in cart_rows), 2),
+        },
+        'favorites': {
+            'product_ids': sorted(favorite_ids),
+            'count': len(favorite_ids),
+        },
+    }
+
+
+def shopping_summary(user):
+    """Состав, количество и сумма корзины и избранного двумя запросами."""
+    return _summary(
+        list(
+            CartItem.objects.filter(cart__user=user).values_list(
+                'product_id', 'quantity', 'price'
+            )
+        ),
+        list(
+            Favorite.product.through.objects.filter(
+                favorite__user=user
+            ).values_list('product_id', flat=True)
+        )
+    )
+
+
+def anonymous_shopping_summary(anonymous):
+    """То же для анонима: один запрос за текущими ценами."""
+    prices = dict(
+        Product.objects.filter(
+            pk__in=list(anonymous.cart)
+        ).values_list('pk', 'price')
+    ) if anonymous.cart else {}
+    return _summary(
+        [
+            (product_id, quantity, prices[product_id])
+            for product_id, quantity in anonymous.cart.items()
+            if product_id in prices
+        ],
+        anonymous.favorites
+    )
+
+
+def cart_totals(user):
+    """Сумма и количество товаров в корзине одним агрегирующим запросом."""
+    totals = CartItem.objects.filter(cart__user=user).aggregate(
+        price=Sum(F('price') * F('quantity'), output_field=FloatField()),
+        quantity=Sum('quantity')
+    )
+    return {
+        'price': totals['price'] or 0,
+        'quantity': totals['quantity'] or 0,
+    }
+
+
+def _lock_cart(user):
+    """
+    Блокирует корзину пользователя до конца транзакции.
+
+    SQLite не поддерживает SELECT ... FOR UPDATE, поэтому там
+    блокировка на запись берётся пустым UPDATE строки корзины.
+    """
+    carts = Cart.objects.filter(user=user)
+    if connection.features.has_select_for_update:
+        return carts.select_for_update().first()
+    if not carts.update(user=user):
+        return None
+    return carts.first()
+
+
+def _existing_order(user, idempotency_key):
+    if not idempotency_key:
+        return None
+    return OrderHistory.objects.filter(
+        user=user,
+        idempotency_key=idempotency_key
+    ).first()
+
+
+def checkout(user, idempotency_key=None):
+    """
+    Оформляет заказ из корзины пользователя в одной транзакции.
+
+    Позиции переносятся в заказ одним INSERT вместе с ценой, названием
+    и адресом продукта на момент покупки, сумма и количество товаров
+    сохраняются в самом заказе, корзина очищается одним DELETE.
+    Повторный вызов с тем же ключом идемпотентности возвращает уже
+    созданный заказ. Возвращает заказ или None, если корзина пуста.
+    """
+    order = _existing_order(user, idempotency_key)
+    if order is not None:
+        return order
+    try:
+        with transaction.atomic():
+            cart = _lock_cart(user)
+            if cart is None:
+                return None
+            # Параллельный запрос мог оформить заказ, пока ждали блокировку.
+            order = _existing_order(user, idempotency_key)
+            if order is not None:
+                return order
+            items = [
+                OrderItem(
+                    product_id=row['product_id'],
+                    quantity=row['quantity'],
+                    price=row['price'],
+                    title=row['product__title'],
+                    category_slug=row['product__category__slug'],
+                    product_type_slug=row['product__product_type__slug'],
+                    image=row['product__image'] or ''
+                )
+                for row in CartItem.objects.filter(cart=cart).values(
+                    'product_id',
+                    'quantity',
+                    'price',
+                    'product__title',
+                    'product__category__slug',
+                    'product__product_type__slug',
+                    'product__image'
+                )
+            ]
+            if not items:
+                return None
+            order = OrderHistory.objects.create(
+                user=user,
+                cart=cart,
+                idempotency_key=idempotency_key or None,
+                total_price=sum(item.price * item.quantity for item in items),
+                item_count=sum(item.quantity for item in items)
+            )
+            for item in items:
+                item.order = order
+            OrderItem.objects.bulk_create(items)
+            CartItem.objects.filter(cart=cart).delete()
+    except IntegrityError:
+        # Заказ с этим ключом только что создал параллельный запрос.
+        order = _existing_order(user, idempotency_key)
+        if order is None:
+            raise
+    return order
+
+
+def order_history(user):
+    """Заказы пользователя с позициями, подгружаемыми одним запросом."""
+    return OrderHistory.objects.filter(user=user).prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.order_by('id'))
+    )
@@ -0,0 +1,273 @@
+from django.conf import settings
+from django.core import signing
+from django.utils.functional import cached_property
+
+from .models import Cart, Favorite
+
+COOKIE_NAME = getattr(settings, 'SHOPPING_COOKIE_NAME', 'shopping')
+COOKIE_SALT = 'main.shopping'
+COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+# Ограничение размера куки: не больше стольких продуктов
+# в корзине и в избранном анонимного посетителя.
+MAX_ITEMS = 100
+
+
+class AnonymousShopping:
+    """
+    Корзина и избранное анонимного посетителя.
+
+    Состояние хранится в подписанной куке браузера, поэтому для
+    посетителей, которые так и не вошли на сайт, в БД не создаётся
+    ни одной строки. Изменения записываются в куку в
+    AnonymousShoppingMiddleware.
+    """
+
+    def __init__(self, cart=None, favorites=None):
+        self.cart = dict(cart or {})
+        self.favorites = list(favorites or [])
+        self.changed = False
+
+    @classmethod
+    def from_request(cls, request):
+        value = request.COOKIES.get(COOKIE_NAME)
+        if not value:
+            return cls()
+        try:
+            data = signing.loads(
+                value,
+                salt=COOKIE_SALT,
+                max_age=COOKIE_MAX_AGE
+            )
+            cart = {
+                int(product_id): max(int(quantity), 1)
+                for product_id, quantity in data.get('c', {}).items()
+            }
+            favorites = [int(product_id) for product_id in data.get('f', [])]
+        except (signing.BadSignature, AttributeError, TypeError, ValueError):
+            # Испорченная кука перезаписывается пустым состоянием.
+            state = cls()
+            state.changed = True
+            return state
+        return cls(cart, favorites)
+
+    def dumps(self):
+        return signing.dumps(
+            {
+                'c': {str(pk): quantity for pk, quantity in self.cart.items()},
+                'f': self.favorites,
+            },
+            salt=COOKIE_SALT,
+            compress=True
+        )
+
+    def is_empty(self):
+        return not self.cart and not self.favorites
+
+    def add_to_cart(self, product_id, quantity=1):
+        if product_id not in self.cart and len(self.cart) >= MAX_ITEMS:
+            return
+        self.cart[product_id] = self.cart.get(product_id, 0) + quantity
+        self.changed = True
+
+    def set_cart_quantity(self, product_id, quantity):
+        if product_id not in self.cart:
+            return
+        if quantity <= 0:
+            del self.cart[product_id]
+        else:
+            self.cart[product_id] = quantity
+        self.changed = True
+
+    def remove_from_cart(self, product_id):
+        if self.cart.pop(product_id, None) is not None:
+            self.changed = True
+
+    def add_favorite(self, product_id):
+        if product_id in self.favorites or len(self.favorites) >= MAX_ITEMS:
+            return
+        self.favorites.append(product_id)
+        self.changed = True
+
+    def remove_favorite(self, product_id):
+        if product_id in self.favorites:
+            self.favorites.remove(product_id)
+            self.changed = True
+
+    def clear(self):
+        self.cart = {}
+        self.favorites = []
+        self.changed = True
+
+    def apply_changes(self, changes, published_ids):
+        """
+        Применяет пакет операций (ShoppingChanges).
+
+        Добавлять можно только продукты из published_ids, менять
+        количество и удалять — любые уже добавленные.
+        """
+        for product_id in changes.cart_remove:
+            self.remove_from_cart(product_id)
+        for product_id, quantity in changes.cart_set.items():
+            if product_id in self.cart:
+                self.set_cart_quantity(product_id, quantity)
+            elif product_id in published_ids:
+                self.add_to_cart(product_id, quantity)
+        for product_id, quantity in changes.cart_add.items():
+            if product_id in self.cart or product_id in published_ids:
+                self.add_to_cart(product_id, quantity)
+        for product_id in changes.favorite_remove:
+            self.remove_favorite(product_id)
+        for product_id in changes.favorite_add:
+            if product_id in published_ids:
+                self.add_favorite(product_id)
+
+
+def get_anonymous_shopping(request):
+    """Состояние анонимного посетителя, общее для всего запроса."""
+    if not hasattr(request, '_anonymous_shopping'):
+        request._anonymous_shopping = AnonymousShopping.from_request(request)
+    return request._anonymous_shopping
+
+
+class ShoppingState:
+    """
+    Состояние покупок пользователя в рамках одного запроса.
+
+    Идентификаторы продуктов из избранного и корзины загружаются
+    одним запросом каждый при первом обращении, дальше проверки
+    принадлежности выполняются по множествам в памяти. У анонимного
+    посетителя они берутся из куки, без запросов к БД.
+    """
+
+    def __init__(self, user, anonymous=None):
+        self.user = user
+        self.anonymous = anonymous
+
+    def _product_ids(self, model):
+        if not self.user.is_authenticated:
+            return frozenset()
+        through = model.product.through
+        owner = model._meta.model_name
+        return frozenset(
+            through.objects.filter(
+                **{f'{owner}__user': self.user}
+            ).values_list('product_id', flat=True)
+        )
+
+    @cached_property
+    def favorite_ids(self):
+        if not self.user.is_authenticated and self.anonymous is not None:
+            return frozenset(self.anonymous.favorites)
+        return self._product_ids(Favorite)
+
+    @cached_property
+    def cart_ids(self):
+        if not self.user.is_authenticated and self.anonymous is not None:
+            return frozenset(self.anonymous.cart)
+        return self._product_ids(Cart)
+
+    def is_favorite(self, product):
+        return product.pk in self.favorite_ids
+
+    def in_cart(self, product):
+        return product.pk in self.cart_ids
+
+
+def get_shopping_state(request):
+    """Возвращает состояние покупок, общее для всего запроса."""
+    if not hasattr(request, '_shopping_state'):
+        request._shopping_state = ShoppingState(
+            request.user,
+            get_anonymous_shopping(request)
+        )
+    return request._shopping_state
+
+
+CART_ADD = 'cart_add'
+CART_SET = 'cart_set'
+CART_REMOVE = 'cart_remove'
+FAVORITE_ADD = 'favorite_add'
+FAVORITE_REMOVE = 'favorite_remove'
+OPERATIONS = (CART_ADD, CART_SET, CART_REMOVE, FAVORITE_ADD, FAVORITE_REMOVE)
+MAX_OPERATIONS = 100
+
+
+class ShoppingChanges:
+    """
+    Итог пакета операций с корзиной и избранным.
+
+    Операции сворачиваются по продуктам в порядке поступления,
+    так что каждый продукт попадает ровно в одну группу:
+    cart_add — прибавить количество, cart_set — установить,
+    cart_remove — удалить; для избранного — добавить или удалить.
+    """
+
+    def __init__(self):
+        self.cart_add = {}
+        self.cart_set = {}
+        self.cart_remove = set()
+        self.favorite_add = set()
+        self.favorite_remove = set()
+
+    @classmethod
+    def parse(cls, operations):
+        """Разбирает список операций из JSON; ошибки — ValueError."""
+        if not isinstance(operations, list):
+            raise ValueError('Ожидается список операций.')
+        if len(operations) > MAX_OPERATIONS:
+            raise ValueError(f'Не больше {MAX_OPERATIONS} операций за раз.')
+        changes = cls()
+        for operation in operations:
+            if not isinstance(operation, dict):
+                raise ValueError('Операция должна быть объектом.')
+            op = operation.get('op')
+            if op not in OPERATIONS:
+                raise ValueError(f'Неизвестная операция: {op}.')
+            product_id = operation.get('product_id')
+            quantity = operation.get('quantity', 1)
+            if (
+                type(product_id) is not int or product_id <= 0
+                or type(quantity) is not int
+            ):
+                raise ValueError('Некорректный продукт или количество.')
+            if op == CART_ADD and quantity < 1:
+                raise ValueError('Количество должно быть положительным.')
+            changes.apply(op, product_id, quantity)
+        return changes
+
+    def apply(self, op, product_id, quantity=1):
+        if op == CART_ADD:
+            if product_id in self.cart_set:
+                self.cart_set[product_id] += quantity
+            elif product_id in self.cart_remove:
+                self.cart_remove.discard(product_id)
+                self.cart_set[product_id] = quantity
+            else:
+                self.cart_add[product_id] = (
+                    self.cart_add.get(product_id, 0) + quantity
+                )
+        elif op == CART_SET:
+            self.cart_add.pop(product_id, None)
+            self.cart_remove.discard(product_id)
+            self.cart_set[product_id] = quantity
+        elif op == CART_REMOVE:
+            self.cart_add.pop(product_id, None)
+            self.cart_set.pop(product_id, None)
+            self.cart_remove.add(product_id)
+        elif op == FAVORITE_ADD:
+            self.favorite_remove.discard(product_id)
+            self.favorite_add.add(product_id)
+        elif op == FAVORITE_REMOVE:
+            self.favorite_add.discard(product_id)
+            self.favorite_remove.add(product_id)
+        # Нулевое или отрицательное количество означает удаление.
+        if self.cart_set.get(product_id, 1) <= 0:
+            del self.cart_set[product_id]
+            self.cart_remove.add(product_id)
+
+    @property
+    def added_ids(self):
+        """Продукты, которые могут появиться в корзине или избранном."""
+        return (
+            set(self.cart_add) | set(self.cart_set) | self.favorite_add
+        )
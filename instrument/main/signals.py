@@ -0,0 +1,263 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import (autocomplete, facets, images, navigation, search, services,
+               snapshots, versioning)
+from .shopping import get_anonymous_shopping
+from .models import (
+    Category,
+    Comment,
+    Manufacturer,
+    Product,
+    ProductType,
+    Rating
+)
+
+
+@receiver(pre_save, sender=Rating)
+def remember_previous_rating(sender, instance, **kwargs):
+    """Запоминает прежнюю оценку, чтобы учесть только разницу."""
+    instance._previous_rating = None
+    if instance.pk is not None:
+        instance._previous_rating = Rating.objects.filter(
+            pk=instance.pk
+        ).values_list('product_id', 'rating').first()
+
+
+@receiver(post_save, sender=Rating)
+def apply_saved_rating(sender, instance, created, **kwargs):
+    """Обновляет счётчики рейтинга продукта после сохранения оценки."""
+    previous = getattr(instance, '_previous_rating', None)
+    if previous is None:
+        Product.objects.filter(pk=instance.product_id).apply_rating_change(
+            1, instance.rating
+        )
+        return
+    product_id, rating = previous
+    if product_id == instance.product_id:
+        Product.objects.filter(pk=product_id).apply_rating_change(
+            0, instance.rating - rating
+        )
+        return
+    Product.objects.filter(pk=product_id).apply_rating_change(-1, -rating)
+    Product.objects.filter(pk=instance.product_id).apply_rating_change(
+        1, instance.rating
+    )
+
+
+@receiver(post_delete, sender=Rating)
+def apply_deleted_rating(sender, instance, **kwargs):
+    """Вычитает удалённую оценку из счётчиков продукта."""
+    Product.objects.filter(pk=instance.product_id).apply_rating_change(
+        -1, -instance.rating
+    )
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def rerank_rated_products(sender, instance, **kwargs):
+    """
+    Средний рейтинг продукта — его ранг в подсказках. Ранги разделов
+    обновятся при плановой перестройке индекса подсказок.
+    """
+    previous = getattr(instance, '_previous_rating', None)
+    product_ids = {instance.product_id, previous and previous[0]}
+    for product_id in product_ids - {None}:
+        autocomplete.product_changed(product_id)
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, **kwargs):
+    """Увеличивает счётчик комментариев продукта."""
+    if created:
+        Product.objects.filter(
+            pk=instance.product_id_id
+        ).apply_comment_change(1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    """Уменьшает счётчик комментариев продукта."""
+    Product.objects.filter(pk=instance.product_id_id).apply_comment_change(-1)
+
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, **kwargs):
+    """Обновляет продукт в поисковом индексе и в подсказках."""
+    search.index_products([instance])
+    autocomplete.product_changed(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    """Удаляет продукт из поискового индекса и из подсказок."""
+    search.remove_products([instance.pk])
+    autocomplete.product_changed(instance.pk, deleted=True)
+
+
+@receiver(post_save, sender=Manufacturer)
+def reindex_manufacturer_products(sender, instance, created, **kwargs):
+    """Название производителя входит в индекс его продуктов."""
+    if not created:
+        search.index_products(
+            Product.objects.filter(
+                manufacturer=instance
+            ).select_related('manufacturer')
+        )
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProductType)
+@receiver(post_delete, sender=ProductType)
+def rebuild_autocomplete(sender, **kwargs):
+    """Названия и адреса разделов входят в подсказки поиска."""
+    autocomplete.catalog_changed()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProductType)
+@receiver(post_delete, sender=ProductType)
+def rebuild_navigation(sender, **kwargs):
+    """Боковая панель строится заново после изменения разделов."""
+    navigation.invalidate()
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_product_type(sender, instance, **kwargs):
+    """Запоминает прежний тип продукта, чтобы сбросить и его фасеты."""
+    instance._previous_product_type_id = None
+    if instance.pk is not None:
+        instance._previous_product_type_id = Product.objects.filter(
+            pk=instance.pk
+        ).values_list('product_type_id', flat=True).first()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_type_facets(sender, instance, **kwargs):
+    """Фасеты типа продукта пересчитываются после изменения продукта."""
+    product_type_ids = {
+        instance.product_type_id,
+        getattr(instance, '_previous_product_type_id', None),
+    }
+    for product_type_id in product_type_ids - {None}:
+        versioning.bump_version(facets.type_namespace(product_type_id))
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def invalidate_rated_product_facets(sender, instance, **kwargs):
+    """
+    Средний рейтинг входит в куб фасетов, а счётчики продукта
+    обновляются через update(), без сигналов Product.
+    """
+    previous = getattr(instance, '_previous_rating', None)
+    product_ids = {instance.product_id, previous and previous[0]} - {None}
+    product_type_ids = set(
+        Product.objects.filter(
+            pk__in=product_ids
+        ).values_list('product_type_id', flat=True)
+    )
+    for product_type_id in product_type_ids:
+        versioning.bump_version(facets.type_namespace(product_type_id))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+def update_image_variants(sender, instance, **kwargs):
+    """
+    Создаёт уменьшенные копии новой картинки.
+
+    Копии старой картинки, как и сам оригинал, с диска не удаляются:
+    один файл может использоваться несколькими объектами.
+    """
+    name = instance.image.name if instance.image else ''
+    previous = instance.image_variants or {}
+    if images.is_current(previous, name) or (not name and not previous):
+        return
+    manifest = images.generate_variants(name) if name else None
+    instance.image_variants = manifest or {}
+    sender.objects.filter(pk=instance.pk).update(
+        image_variants=instance.image_variants
+    )
+
+
+@receiver(post_save, sender=Manufacturer)
+@receiver(post_delete, sender=Manufacturer)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProductType)
+@receiver(post_delete, sender=ProductType)
+def invalidate_all_facets(sender, **kwargs):
+    """
+    Названия производителей хранятся в фасетах всех типов, а от
+    публикации разделов зависит, какие продукты попадают в куб.
+    """
+    versioning.bump_version(facets.NAMESPACE)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProductType)
+@receiver(post_delete, sender=ProductType)
+@receiver(post_save, sender=Manufacturer)
+@receiver(post_delete, sender=Manufacturer)
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def bump_catalog_version(sender, **kwargs):
+    """Закэшированные страницы каталога устаревают при любом изменении."""
+    versioning.bump_version()
+
+
+# Снимки сбрасываются последними, после того как остальные обработчики
+# обновили счётчики и копии картинок продукта.
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_snapshot(sender, instance, **kwargs):
+    """Снимок продукта устаревает после его изменения."""
+    snapshots.product_changed(instance.pk)
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def invalidate_rated_product_snapshot(sender, instance, **kwargs):
+    """В снимок входят средний рейтинг и количество оценок."""
+    previous = getattr(instance, '_previous_rating', None)
+    if previous is not None and previous[0] != instance.product_id:
+        snapshots.product_changed(previous[0])
+    snapshots.product_changed(instance.product_id)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_commented_product_snapshot(sender, instance, **kwargs):
+    """В снимок входит количество комментариев."""
+    snapshots.product_changed(instance.product_id_id)
+
+
+@receiver(post_save, sender=Manufacturer)
+@receiver(post_delete, sender=Manufacturer)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProductType)
+@receiver(post_delete, sender=ProductType)
+def invalidate_all_snapshots(sender, **kwargs):
+    """Названия производителей и разделов хранятся во всех снимках."""
+    snapshots.catalog_changed()
+
+
+@receiver(user_logged_in)
+def merge_anonymous_shopping(sender, request, user, **kwargs):
+    """Корзина и избранное, собранные до входа, переходят пользователю."""
+    if request is None:
+        return
+    anonymous = get_anonymous_shopping(request)
+    if not anonymous.is_empty():
+        services.merge_anonymous_shopping(user, anonymous)
@@ -0,0 +1,81 @@
+"""
+Снимки продуктов для детальной страницы.
+
+Снимок — словарь с полями продукта, названиями и слагами категории и
+типа, именем производителя, рейтингом и адресами уменьшенных копий
+фото. Он строится одним запросом и хранится в кэше под ключом с двумя
+версиями: версией самого продукта (меняется при изменении продукта,
+его оценок и комментариев) и общей версией снимков (меняется при
+изменении производителей, категорий и типов продуктов). Данные
+конкретного пользователя в снимок не входят.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from . import versioning
+from .images import image_sources
+from .models import Product
+
+SNAPSHOT_CACHE_TIMEOUT = getattr(settings, 'PRODUCT_SNAPSHOT_TIMEOUT', 3600)
+NAMESPACE = 'product-snapshots'
+
+
+def product_namespace(product_id):
+    return f'{NAMESPACE}:{product_id}'
+
+
+def _section(obj):
+    return {'id': obj.pk, 'slug': obj.slug, 'title': obj.title}
+
+
+def build_snapshot(product_id):
+    product = Product.objects.select_related(
+        'category',
+        'product_type',
+        'manufacturer'
+    ).filter(pk=product_id).first()
+    if product is None:
+        return None
+    return {
+        'id': product.pk,
+        'pk': product.pk,
+        'title': product.title,
+        'description': product.description,
+        'parameters': product.parameters,
+        'price': product.price,
+        'pub_date': product.pub_date,
+        'is_published': product.is_published,
+        'category': _section(product.category),
+        'product_type': _section(product.product_type),
+        'manufacturer': (
+            product.manufacturer.name if product.manufacturer_id else ''
+        ),
+        'average_rating': product.average_rating,
+        'rating_count': product.rating_count,
+        'comment_count': product.comment_count,
+        'image': image_sources(product.image, product.image_variants),
+    }
+
+
+def get_snapshot(product_id):
+    """Снимок продукта текущей версии или None, если продукта нет."""
+    key = 'product-snapshot:{}:{}:{}'.format(
+        product_id,
+        versioning.get_version(NAMESPACE),
+        versioning.get_version(product_namespace(product_id)),
+    )
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build_snapshot(product_id)
+        if snapshot is not None:
+            cache.set(key, snapshot, SNAPSHOT_CACHE_TIMEOUT)
+    return snapshot
+
+
+def product_changed(product_id):
+    versioning.bump_version(product_namespace(product_id))
+
+
+def catalog_changed():
+    """Изменились производители или разделы: устаревают все снимки."""
+    versioning.bump_version(NAMESPACE)
@@ -0,0 +1,326 @@
+"""
+Сборка и раздача статики.
+
+PrecompressedManifestStaticFilesStorage при collectstatic:
+
+1. вырезает из CSS-файлов, перечисленных в STATIC_PURGE_CSS, правила,
+   классы и id которых не встречаются в шаблонах, JS и коде приложений;
+2. добавляет в имена файлов хэш содержимого (ManifestStaticFilesStorage);
+3. рядом с каждым текстовым файлом кладёт сжатые копии .gz и, если
+   установлен пакет brotli, .br.
+
+Представление serve отдаёт собранные файлы из STATIC_ROOT: файлы с хэшем
+в имени — с заголовком Cache-Control на год и immutable, остальные —
+с коротким временем жизни; сжатая копия выбирается по Accept-Encoding.
+Так же можно настроить и веб-сервер (gzip_static/brotli_static в nginx).
+"""
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.staticfiles.storage import (ManifestStaticFilesStorage,
+                                                staticfiles_storage)
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = (
+    '.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.html',
+    '.xml', '.ico', '.ttf', '.otf', '.eot',
+)
+# Файлы меньше этого размера не сжимаются: выигрыш меньше заголовков.
+MIN_COMPRESS_SIZE = 256
+# Сжатая копия сохраняется, только если она заметно меньше оригинала.
+MIN_COMPRESS_RATIO = 0.95
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+MUTABLE_MAX_AGE = 60
+
+# Классы, которые добавляет JavaScript Bootstrap и которых нет в шаблонах.
+PURGE_CSS_SAFELIST = getattr(settings, 'STATIC_PURGE_CSS_SAFELIST', (
+    'active', 'collapse', 'collapsing', 'disabled', 'fade', 'hide', 'hiding',
+    'show', 'showing', 'modal-open', 'modal-backdrop', 'offcanvas-backdrop',
+    'dropdown-menu-end', 'was-validated', 'is-valid', 'is-invalid',
+    'valid-feedback', 'invalid-feedback', 'tooltip', 'tooltip-arrow',
+    'tooltip-inner', 'popover', 'popover-arrow', 'popover-header',
+    'popover-body', 'bs-tooltip-auto', 'bs-popover-auto',
+))
+CONTENT_EXTENSIONS = ('.html', '.js', '.py', '.txt')
+
+CHARSET_RE = re.compile(r'^\s*(@charset\s+"[^"]*";)')
+COMMENT_RE = re.compile(r'/\*(?!!).*?\*/', re.S)
+LICENSE_RE = re.compile(r'/\*!.*?\*/', re.S)
+SOURCE_MAP_RE = re.compile(
+    r'^(?:/\*|//)#\s*sourceMappingURL=(?P<url>\S+?)\s*(?:\*/)?\s*$', re.M
+)
+CLASS_OR_ID_RE = re.compile(r'[.#]((?:\\.|[\w-])+)')
+NOT_RE = re.compile(r':not\([^()]*\)')
+TOKEN_RE = re.compile(r'[\w-]+')
+# Групповые @-правила, внутри которых чистятся вложенные правила.
+NESTED_AT_RULES = ('media', 'supports', 'layer', 'container')
+
+
+def _skip_string(css, index):
+    quote = css[index]
+    index += 1
+    while index < len(css) and css[index] != quote:
+        index += 2 if css[index] == '\\' else 1
+    return index + 1
+
+
+def _split_rules(css):
+    """Правила верхнего уровня: (заголовок, тело) или (@-инструкция, None)."""
+    index, length = 0, len(css)
+    while index < length:
+        start = index
+        while index < length and css[index] not in '{;':
+            if css[index] in '"\'':
+                index = _skip_string(css, index)
+            else:
+                index += 1
+        prelude = css[start:index].strip()
+        if index >= length:
+            if prelude:
+                yield prelude, None
+            return
+        if css[index] == ';':
+            yield prelude, None
+            index += 1
+            continue
+        depth, body_start = 1, index + 1
+        index += 1
+        while index < length and depth:
+            char = css[index]
+            if char in '"\'':
+                index = _skip_string(css, index)
+                continue
+            if char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+            index += 1
+        yield prelude, css[body_start:index - 1]
+
+
+def _split_selectors(prelude):
+    selectors, depth, start = [], 0, 0
+    for index, char in enumerate(prelude):
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            selectors.append(prelude[start:index].strip())
+            start = index + 1
+    selectors.append(prelude[start:].strip())
+    return selectors
+
+
+def _selector_used(selector, used):
+    names = CLASS_OR_ID_RE.findall(NOT_RE.sub('', selector))
+    return all(name.replace('\\', '') in used for name in names)
+
+
+def purge_css(css, used):
+    """Удаляет из CSS правила с классами и id, которых нет в used."""
+    output = []
+    for prelude, body in _split_rules(css):
+        if body is None:
+            if prelude:
+                output.append(f'{prelude};')
+            continue
+        if prelude.startswith('@'):
+            name = prelude[1:].split(None, 1)[0].lower() if prelude[1:] else ''
+            if name in NESTED_AT_RULES:
+                inner = purge_css(body, used)
+                if inner:
+                    output.append(f'{prelude}{{{inner}}}')
+            else:
+                output.append(f'{prelude}{{{body}}}')
+            continue
+        selectors = [
+            selector for selector in _split_selectors(prelude)
+            if _selector_used(selector, used)
+        ]
+        if selectors:
+            output.append(f'{",".join(selectors)}{{{body}}}')
+    return ''.join(output)
+
+
+def content_directories():
+    """Где искать используемые классы: шаблоны, статика и код приложений."""
+    directories = getattr(settings, 'STATIC_PURGE_CSS_CONTENT', None)
+    if directories is not None:
+        return list(directories)
+    directories = [
+        directory
+        for engine in settings.TEMPLATES
+        for directory in engine.get('DIRS', ())
+    ]
+    directories += list(getattr(settings, 'STATICFILES_DIRS', ()))
+    directories += [
+        app_config.path for app_config in apps.get_app_configs()
+        if not app_config.name.startswith('django.')
+    ]
+    return directories
+
+
+def used_tokens():
+    """Все слова из шаблонов и кода — кандидаты в имена классов и id."""
+    tokens = set(PURGE_CSS_SAFELIST)
+    for directory in content_directories():
+        for root, _, files in os.walk(directory):
+            for filename in files:
+                if not filename.endswith(CONTENT_EXTENSIONS):
+                    continue
+                with open(
+                    os.path.join(root, filename),
+                    encoding='utf-8',
+                    errors='ignore'
+                ) as file:
+                    tokens.update(TOKEN_RE.findall(file.read()))
+    return tokens
+
+
+def compress(content):
+    """Сжатые копии содержимого: {'.gz': ..., '.br': ...}."""
+    variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(content, quality=11)
+    return {
+        extension: data for extension, data in variants.items()
+        if len(data) < len(content) * MIN_COMPRESS_RATIO
+    }
+
+
+class PrecompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Статика с хэшем содержимого в именах и предсжатыми копиями."""
+
+    def stored_name(self, name):
+        # До первого collectstatic (разработка, тесты) манифеста нет,
+        # и ссылки ведут на исходные имена.
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            return
+        self._prepare(paths)
+        yield from super().post_process(paths, dry_run, **options)
+        for name in set(paths) | set(self.hashed_files.values()):
+            self._compress(name)
+
+    def _rewrite(self, paths, name, content):
+        """Заменяет скопированный файл, хэш считается уже по новому."""
+        self.delete(name)
+        self._save(name, ContentFile(content.encode()))
+        paths[name] = (self, name)
+
+    def _prepare(self, paths):
+        purge = set(getattr(settings, 'STATIC_PURGE_CSS', ()))
+        used = used_tokens() if purge else set()
+        for name in list(paths):
+            if not name.endswith(('.css', '.js')):
+                continue
+            storage, path = paths[name]
+            with storage.open(path) as file:
+                original = file.read().decode('utf-8')
+            content = original
+            if name in purge:
+                content = self._purge(content, used)
+            # Ссылку на отсутствующую карту исходников ManifestStaticFilesStorage
+            # считает ошибкой, поэтому такие ссылки убираются.
+            content = SOURCE_MAP_RE.sub(
+                lambda match: match.group(0) if posixpath.join(
+                    posixpath.dirname(name), match.group('url')
+                ) in paths else '',
+                content
+            )
+            if content != original:
+                self._rewrite(paths, name, content)
+
+    @staticmethod
+    def _purge(content, used):
+        # @charset должен оставаться первым, за ним — комментарии
+        # с лицензиями, которые минификаторы тоже сохраняют.
+        licenses = LICENSE_RE.findall(content)
+        content = COMMENT_RE.sub('', LICENSE_RE.sub('', content))
+        charset = CHARSET_RE.match(content)
+        if charset:
+            content = content[charset.end():]
+        return '\n'.join(
+            ([charset.group(1)] if charset else [])
+            + licenses
+            + [purge_css(content, used)]
+        )
+
+    def _compress(self, name):
+        if not name.endswith(COMPRESSIBLE_EXTENSIONS) or not self.exists(name):
+            return
+        with self.open(name) as file:
+            content = file.read()
+        if len(content) < MIN_COMPRESS_SIZE:
+            return
+        for extension, data in compress(content).items():
+            if self.exists(name + extension):
+                self.delete(name + extension)
+            self._save(name + extension, ContentFile(data))
+
+
+def _hashed_names():
+    if not hasattr(_hashed_names, 'cache'):
+        _hashed_names.cache = frozenset(
+            getattr(staticfiles_storage, 'hashed_files', {}).values()
+        )
+    return _hashed_names.cache
+
+
+def serve(request, path):
+    """Файл из STATIC_ROOT со сжатой копией и заголовками кэширования."""
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Файл не найден.')
+    if not os.path.isfile(fullpath):
+        raise Http404('Файл не найден.')
+    stat = os.stat(fullpath)
+    if not was_modified_since(
+        request.META.get('HTTP_IF_MODIFIED_SINCE'),
+        stat.st_mtime
+    ):
+        return HttpResponseNotModified()
+    content_type, _ = mimetypes.guess_type(fullpath)
+    accept = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    encoding = None
+    for extension, name in (('.br', 'br'), ('.gz', 'gzip')):
+        if name in accept and os.path.isfile(fullpath + extension):
+            fullpath, encoding = fullpath + extension, name
+            break
+    response = FileResponse(
+        open(fullpath, 'rb'),
+        content_type=content_type or 'application/octet-stream'
+    )
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    if path in _hashed_names():
+        response['Cache-Control'] = (
+            f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+        )
+    else:
+        response['Cache-Control'] = f'public, max-age={MUTABLE_MAX_AGE}'
+    return response
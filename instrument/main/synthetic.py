@@ -0,0 +1,290 @@
+"""
+Синтетический каталог для замеров производительности.
+
+Объекты создаются через bulk_create пачками, сигналы при этом не
+вызываются, поэтому денормализованные поля (счётчики рейтинга и
+комментариев, суммы заказов) считаются здесь же, а поисковый индекс
+строится в конце. Распределения неравномерные, как в живом магазине:
+популярность разделов, производителей, продуктов и покупателей
+подчиняется закону Ципфа, и оценки, комментарии, корзины и заказы
+достаются в основном популярным продуктам.
+"""
+import random
+from collections import Counter
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from . import search
+from .models import (Cart, CartItem, Category, Comment, Favorite,
+                     Manufacturer, OrderHistory, OrderItem, Product,
+                     ProductType, Rating, User)
+
+DEFAULT_VOLUMES = {
+    'categories': 8,
+    'product_types': 40,
+    'manufacturers': 60,
+    'products': 3000,
+    'users': 300,
+    'ratings': 15000,
+    'comments': 15000,
+    'carts': 150,
+    'favorites': 150,
+    'orders': 1500,
+}
+BATCH_SIZE = 1000
+ZIPF_EXPONENT = 1.1
+# Оценки смещены к высоким, как обычно в магазинах.
+RATING_WEIGHTS = (1, 1, 2, 4, 6)
+MAX_CART_ITEMS = 6
+MAX_FAVORITES = 12
+MAX_ORDER_ITEMS = 5
+USERNAME_PREFIX = 'bench'
+PASSWORD = 'bench-password'
+
+TOOLS = (
+    'Молоток', 'Ножовка', 'Дрель', 'Шуруповёрт', 'Рубанок', 'Стамеска',
+    'Отвёртка', 'Плоскогубцы', 'Уровень', 'Рулетка', 'Киянка', 'Лобзик',
+    'Перфоратор', 'Болгарка', 'Ключ', 'Напильник', 'Топор', 'Пила',
+)
+WORDS = (
+    'стальной', 'прочный', 'лёгкий', 'профессиональный', 'бытовой',
+    'деревянная', 'прорезиненная', 'рукоятка', 'аккумуляторный',
+    'сетевой', 'кованый', 'набор', 'кейс', 'мощность', 'вес', 'длина',
+    'гарантия', 'металл', 'дерево', 'пластик', 'точный', 'удобный',
+)
+
+
+def zipf_weights(count, exponent=ZIPF_EXPONENT):
+    return [1 / rank ** exponent for rank in range(1, count + 1)]
+
+
+class CatalogGenerator:
+    """Заполняет базу синтетическим каталогом заданного объёма."""
+
+    def __init__(self, volumes=None, seed=0):
+        self.volumes = {**DEFAULT_VOLUMES, **(volumes or {})}
+        self.random = random.Random(seed)
+
+    def _sample(self, population, weights, count):
+        """До count различных элементов с учётом весов."""
+        chosen = set()
+        for _ in range(count * 3):
+            chosen.add(self.random.choices(population, weights)[0])
+            if len(chosen) >= count:
+                break
+        return list(chosen)
+
+    def _text(self, words):
+        return ' '.join(self.random.choices(WORDS, k=words))
+
+    def generate(self):
+        with transaction.atomic():
+            users = self._users()
+            product_types = self._sections()
+            manufacturers = self._manufacturers()
+            products, popularity = self._products(
+                product_types, manufacturers, users
+            )
+            carts = self._carts_and_favorites(users, products, popularity)
+            self._orders(users, carts, products, popularity)
+        search.rebuild_index(Product.objects.all())
+        return {
+            model._meta.label: model.objects.count()
+            for model in (
+                User, Category, ProductType, Manufacturer, Product, Rating,
+                Comment, CartItem, OrderHistory, OrderItem,
+            )
+        }
+
+    def _users(self):
+        password = make_password(PASSWORD)
+        return User.objects.bulk_create(
+            [
+                User(username=f'{USERNAME_PREFIX}{number}', password=password)
+                for number in range(self.volumes['users'])
+            ],
+            batch_size=BATCH_SIZE
+        )
+
+    def _sections(self):
+        categories = Category.objects.bulk_create([
+            Category(title=f'Раздел {number}', slug=f'section-{number}')
+            for number in range(self.volumes['categories'])
+        ])
+        weights = zipf_weights(len(categories))
+        product_types = ProductType.objects.bulk_create([
+            ProductType(
+                title=f'{TOOLS[number % len(TOOLS)]} {number}',
+                slug=f'type-{number}',
+                category=self.random.choices(categories, weights)[0]
+            )
+            for number in range(self.volumes['product_types'])
+        ])
+        return product_types
+
+    def _manufacturers(self):
+        return Manufacturer.objects.bulk_create([
+            Manufacturer(name=f'Производитель {number}')
+            for number in range(self.volumes['manufacturers'])
+        ])
+
+    def _products(self, product_types, manufacturers, users):
+        count = self.volumes['products']
+        # Популярность продукта не зависит от порядка создания.
+        popularity = zipf_weights(count)
+        self.random.shuffle(popularity)
+        indexes = range(count)
+        rated = self.random.choices(
+            indexes, popularity, k=self.volumes['ratings']
+        )
+        ratings = [
+            (
+                index,
+                self.random.randrange(len(users)),
+                self.random.choices(range(1, 6), RATING_WEIGHTS)[0]
+            )
+            for index in rated
+        ]
+        comments = self.random.choices(
+            indexes, popularity, k=self.volumes['comments']
+        )
+        rating_counts, rating_sums = Counter(), Counter()
+        for index, _, rating in ratings:
+            rating_counts[index] += 1
+            rating_sums[index] += rating
+        comment_counts = Counter(comments)
+        type_weights = zipf_weights(len(product_types))
+        manufacturer_weights = zipf_weights(len(manufacturers))
+        pub_date = timezone.now() - timezone.timedelta(days=1)
+        product_list = []
+        for index in indexes:
+            product_type = self.random.choices(
+                product_types, type_weights
+            )[0]
+            manufacturer = self.random.choices(
+                manufacturers, manufacturer_weights
+            )[0]
+            product_list.append(Product(
+                title=f'{product_type.title.split()[0]} {index}'[:40],
+                description=self._text(30),
+                parameters=self._text(10),
+                category_id=product_type.category_id,
+                product_type=product_type,
+                manufacturer=manufacturer,
+                pub_date=pub_date,
+                price=round(max(1, self.random.lognormvariate(7, 1.2)), 2),
+                rating_count=rating_counts[index],
+                rating_sum=rating_sums[index],
+                average_rating=(
+                    rating_sums[index] / rating_counts[index]
+                    if rating_counts[index] else 0
+                ),
+                comment_count=comment_counts[index],
+            ))
+        products = Product.objects.bulk_create(
+            product_list,
+            batch_size=BATCH_SIZE
+        )
+        Rating.objects.bulk_create(
+            [
+                Rating(product=products[index], user=users[user], rating=rating)
+                for index, user, rating in ratings
+            ],
+            batch_size=BATCH_SIZE
+        )
+        Comment.objects.bulk_create(
+            [
+                Comment(
+                    text=self._text(15),
+                    author=self.random.choice(users),
+                    product_id=products[index]
+                )
+                for index in comments
+            ],
+            batch_size=BATCH_SIZE
+        )
+        return products, popularity
+
+    def _carts_and_favorites(self, users, products, popularity):
+        carts = Cart.objects.bulk_create(
+            [Cart(user=user) for user in users],
+            batch_size=BATCH_SIZE
+        )
+        items = []
+        for cart in carts[:self.volumes['carts']]:
+            for product in self._sample(
+                products, popularity,
+                self.random.randint(1, MAX_CART_ITEMS)
+            ):
+                items.append(CartItem(
+                    cart=cart,
+                    product=product,
+                    quantity=self.random.randint(1, 3),
+                    price=product.price
+                ))
+        CartItem.objects.bulk_create(items, batch_size=BATCH_SIZE)
+        favorites = Favorite.objects.bulk_create(
+            [Favorite(user=user) for user in users[:self.volumes['favorites']]],
+            batch_size=BATCH_SIZE
+        )
+        through = Favorite.product.through
+        through.objects.bulk_create(
+            [
+                through(favorite_id=favorite.pk, product_id=product.pk)
+                for favorite in favorites
+                for product in self._sample(
+                    products, popularity,
+                    self.random.randint(1, MAX_FAVORITES)
+                )
+            ],
+            batch_size=BATCH_SIZE
+        )
+        return carts
+
+    def _orders(self, users, carts, products, popularity):
+        categories = dict(Category.objects.values_list('pk', 'slug'))
+        product_types = dict(ProductType.objects.values_list('pk', 'slug'))
+        buyers = self.random.choices(
+            range(len(users)),
+            zipf_weights(len(users)),
+            k=self.volumes['orders']
+        )
+        orders, lines = [], []
+        for buyer in buyers:
+            chosen = self._sample(
+                products, popularity,
+                self.random.randint(1, MAX_ORDER_ITEMS)
+            )
+            quantities = [self.random.randint(1, 3) for _ in chosen]
+            orders.append(OrderHistory(
+                user=users[buyer],
+                cart=carts[buyer],
+                total_price=sum(
+                    product.price * quantity
+                    for product, quantity in zip(chosen, quantities)
+                ),
+                item_count=sum(quantities)
+            ))
+            lines.append(list(zip(chosen, quantities)))
+        orders = OrderHistory.objects.bulk_create(
+            orders,
+            batch_size=BATCH_SIZE
+        )
+        OrderItem.objects.bulk_create(
+            [
+                OrderItem(
+                    order=order,
+                    product=product,
+                    quantity=quantity,
+                    price=product.price,
+                    title=product.title,
+                    category_slug=categories[product.category_id],
+                    product_type_slug=product_types[product.product_type_id]
+                )
+                for order, order_lines in zip(orders, lines)
+                for product, quantity in order_lines
+            ],
+            batch_size=BATCH_SIZE
+        )
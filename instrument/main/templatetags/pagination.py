@@ -0,0 +1,19 @@
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def query_replace(context, **kwargs):
+    """
+    Строка запроса текущей страницы с заменёнными параметрами.
+
+    Параметр со значением None удаляется, остальные (например,
+    фильтры) сохраняются.
+    """
+    query = context['request'].GET.copy()
+    for key, value in kwargs.items():
+        query.pop(key, None)
+        if value is not None:
+            query[key] = value
+    return query.urlencode()
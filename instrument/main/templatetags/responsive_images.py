@@ -0,0 +1,50 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+from main.images import image_sources
+
+register = template.Library()
+
+# Карточки занимают четверть контейнера на больших экранах
+# и всю ширину на маленьких.
+DEFAULT_SIZES = '(min-width: 768px) 25vw, 100vw'
+PLACEHOLDER = 'images/no_img.png'
+
+
+@register.simple_tag
+def responsive_image(obj, alt='', css_class='card-img-top', width=120,
+                     height=200, sizes=DEFAULT_SIZES):
+    """
+    Картинка объекта с полем image: <picture> с WebP и srcset из
+    уменьшенных копий и ленивой загрузкой.
+
+    Вместо объекта можно передать снимок (словарь) с готовыми
+    адресами в ключе image. Если копий ещё нет, выводится оригинал,
+    если нет и картинки — заглушка.
+    """
+    if isinstance(obj, dict):
+        sources = obj.get('image')
+    else:
+        sources = image_sources(
+            getattr(obj, 'image', None),
+            getattr(obj, 'image_variants', None)
+        )
+    if sources is None or not sources['srcset']:
+        return format_html(
+            '<img class="{}" src="{}" alt="{}" width="{}" height="{}" '
+            'loading="lazy" decoding="async">',
+            css_class,
+            sources['src'] if sources else static(PLACEHOLDER),
+            alt, width, height
+        )
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img class="{}" src="{}" srcset="{}" sizes="{}" alt="{}" '
+        'width="{}" height="{}" loading="lazy" decoding="async">'
+        '</picture>',
+        sources['webp_srcset'], sizes,
+        css_class, sources['src'],
+        sources['srcset'], sizes, alt, width, height
+    )
@@ -0,0 +1,22 @@
+"""
+Запуск тестов с проверкой бюджетов запросов.
+
+На время прогона включается SQL_BUDGET_RAISE: маршрут, вышедший за
+бюджет из SQL_BUDGETS, роняет тест исключением QueryBudgetExceeded,
+а не только пишет предупреждение в лог.
+"""
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class BudgetTestRunner(DiscoverRunner):
+    """DiscoverRunner, в котором превышение бюджета — ошибка теста."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._budget_settings = override_settings(SQL_BUDGET_RAISE=True)
+        self._budget_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._budget_settings.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,1308 @@
-from django.test import TestCase
+import io
+import json
+import re
+import threading
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.storage import InMemoryStorage
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import autocomplete, catalog_io, facets, images, search, services
+from .instrumentation import QueryBudgetExceeded, QueryRecorder, fingerprint
+from .middleware import CACHE_STATUS_HEADER
+from .shopping import COOKIE_NAME
+from .models import (Cart, CartItem, Category, Comment, Favorite, Manufacturer,
+                     OrderHistory, OrderItem, Product, ProductType, Rating,
+                     User)
+from .paginators import EstimatedCountPaginator, KeysetPaginator
+
+
+class CheckoutConcurrencyTest(TransactionTestCase):
+    """Параллельное оформление заказа из одной корзины."""
+
+    THREADS = 8
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='x')
+        category = Category.objects.create(title='Инструмент', slug='tools')
+        product_type = ProductType.objects.create(
+            title='Молотки',
+            slug='hammers',
+            category=category
+        )
+        self.products = [
+            Product.objects.create(
+                title=f'Молоток {number}',
+                description='Описание',
+                pub_date=timezone.now() - timezone.timedelta(days=1),
+                parameters='Параметры',
+                price=100 * number,
+                category=category,
+                product_type=product_type
+            )
+            for number in range(1, 4)
+        ]
+        for product in self.products:
+            services.add_to_cart(self.user, product.pk, quantity=2)
+
+    def run_parallel(self, keys):
+        barrier = threading.Barrier(len(keys))
+        results, errors = [], []
+
+        def worker(key):
+            try:
+                barrier.wait()
+                results.append(services.checkout(self.user, key))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(key,)) for key in keys]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def assert_single_order(self):
+        self.assertEqual(OrderHistory.objects.count(), 1)
+        order = OrderHistory.objects.get()
+        self.assertEqual(
+            sorted(order.items.values_list('product_id', 'quantity', 'price')),
+            [(product.pk, 2, product.price) for product in self.products]
+        )
+        self.assertFalse(CartItem.objects.exists())
+        return order
+
+    def test_same_key_creates_one_order(self):
+        results = self.run_parallel(['retry'] * self.THREADS)
+        order = self.assert_single_order()
+        self.assertEqual({result.pk for result in results}, {order.pk})
+
+    def test_different_keys_empty_cart_once(self):
+        results = self.run_parallel(
+            [f'click-{number}' for number in range(self.THREADS)]
+        )
+        order = self.assert_single_order()
+        self.assertEqual(
+            [result.pk for result in results if result is not None],
+            [order.pk]
+        )
+
+    def test_repeat_returns_existing_order(self):
+        order = services.checkout(self.user, 'once')
+        services.add_to_cart(self.user, self.products[0].pk)
+        self.assertEqual(services.checkout(self.user, 'once'), order)
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 3)
+        self.assertTrue(Cart.objects.get(user=self.user).items.exists())
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN есть только в SQLite')
+class QueryPlanTest(TestCase):
+    """
+    Планы основных запросов страниц не должны опускаться до полного
+    просмотра больших таблиц и до сортировки во временном B-дереве.
+
+    Статистика (ANALYZE) не собирается: без неё планировщик SQLite
+    считает таблицы большими, как в рабочей базе.
+    """
+
+    HOT_TABLES = (
+        'main_product', 'main_comment', 'main_rating', 'main_orderhistory',
+        'main_orderitem', 'main_cartitem',
+    )
+    FULL_SCAN_RE = re.compile(
+        r'\bSCAN ({})\b(?! USING (?:COVERING )?INDEX)'.format(
+            '|'.join(HOT_TABLES)
+        )
+    )
+    TEMP_SORT_RE = re.compile(r'USE TEMP B-TREE FOR (?:ORDER BY|RIGHT PART)')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader', password='x')
+        cls.category = Category.objects.create(title='Инструмент', slug='tools')
+        cls.product_type = ProductType.objects.create(
+            title='Молотки',
+            slug='hammers',
+            category=cls.category
+        )
+        cls.manufacturer = Manufacturer.objects.create(name='Зубр')
+        yesterday = timezone.now() - timezone.timedelta(days=1)
+        Product.objects.bulk_create([
+            Product(
+                title=f'Молоток {number}',
+                description='Описание',
+                parameters='Параметры',
+                pub_date=yesterday,
+                price=10 * number,
+                average_rating=number % 5,
+                category=cls.category,
+                product_type=cls.product_type,
+                manufacturer=cls.manufacturer if number % 2 else None
+            )
+            for number in range(50)
+        ])
+        cls.product = Product.objects.first()
+        Comment.objects.bulk_create([
+            Comment(text=f'Отзыв {number}', author=cls.user, product_id=cls.product)
+            for number in range(30)
+        ])
+        Rating.objects.create(user=cls.user, product=cls.product, rating=5)
+        services.add_to_cart(cls.user, cls.product.pk)
+        services.checkout(cls.user)
+
+    def assert_uses_indexes(self, queryset, allow_sort=False):
+        """
+        Нет полного просмотра больших таблиц; без allow_sort — и
+        сортировки: страница должна читаться из индекса по порядку.
+        """
+        plan = queryset.explain()
+        self.assertIsNone(
+            self.FULL_SCAN_RE.search(plan),
+            f'Полный просмотр таблицы:\n{queryset.query}\n{plan}'
+        )
+        if not allow_sort:
+            self.assertIsNone(
+                self.TEMP_SORT_RE.search(plan),
+                f'Сортировка без индекса:\n{queryset.query}\n{plan}'
+            )
+
+    def test_main_page(self):
+        self.assert_uses_indexes(
+            Product.objects.for_listing().order_by('-average_rating', '-id')[:9]
+        )
+
+    def test_main_page_keyset_next_page(self):
+        paginator = KeysetPaginator(Product.objects.for_listing(), 9)
+        last = paginator.page().object_list[-1]
+        self.assert_uses_indexes(
+            paginator.queryset.filter(
+                paginator._seek([last.average_rating, last.pk], True)
+            )[:10]
+        )
+
+    def test_category_page(self):
+        self.assert_uses_indexes(
+            Product.objects.for_listing().filter(
+                category=self.category
+            ).order_by('-average_rating', '-id')[:9]
+        )
+
+    def test_product_type_page(self):
+        self.assert_uses_indexes(
+            Product.objects.for_listing().filter(
+                product_type=self.product_type
+            ).order_by('-average_rating', '-id')[:9]
+        )
+
+    def test_product_type_price_filter(self):
+        # Диапазон цен выбирается по индексу (product_type, price),
+        # отобранные продукты сортируются.
+        self.assert_uses_indexes(
+            facets.filter_products(
+                Product.objects.for_listing().filter(
+                    product_type=self.product_type
+                ),
+                {'min_price': 100, 'max_price': 300}
+            ).order_by('-average_rating', '-id')[:9],
+            allow_sort=True
+        )
+
+    def test_product_type_facets(self):
+        self.assert_uses_indexes(
+            Product.objects.published().filter(
+                product_type=self.product_type,
+                price__gte=100,
+                price__lte=300
+            ).order_by().values('manufacturer_id', 'price')
+        )
+
+    def test_manufacturer_filter(self):
+        self.assert_uses_indexes(
+            facets.filter_products(
+                Product.objects.for_listing(),
+                {'manufacturer': [self.manufacturer.pk]}
+            ).order_by('-average_rating', '-id')[:9],
+            allow_sort=True
+        )
+
+    def test_comments_page(self):
+        paginator = KeysetPaginator(
+            Comment.objects.filter(
+                product_id=self.product.pk
+            ).select_related('author'),
+            20,
+            ordering=('created_at', 'id')
+        )
+        first = paginator.page().object_list[-1]
+        self.assert_uses_indexes(
+            paginator.queryset.filter(
+                paginator._seek([first.created_at, first.pk], True)
+            )[:21]
+        )
+
+    def test_user_rating(self):
+        self.assert_uses_indexes(
+            Rating.objects.filter(
+                user=self.user,
+                product_id=self.product.pk
+            ).order_by('-created_at', '-id').values_list('rating')[:1]
+        )
+
+    def test_rating_recount(self):
+        self.assert_uses_indexes(
+            Rating.objects.filter(
+                product=self.product
+            ).order_by().values('rating')
+        )
+
+    def test_order_history(self):
+        self.assert_uses_indexes(services.order_history(self.user)[:9])
+
+    def test_cart(self):
+        self.assert_uses_indexes(services.cart_items(self.user))
+
+    def test_seeded_queries_return_rows(self):
+        # Планы проверяются на запросах, которые что-то находят.
+        self.assertEqual(
+            len(Product.objects.for_listing().filter(
+                category=self.category
+            )[:9]),
+            9
+        )
+        self.assertEqual(
+            Comment.objects.filter(product_id=self.product.pk).count(), 30
+        )
+        self.assertTrue(services.order_history(self.user).exists())
+
+
+class KeysetPaginationTest(TestCase):
+    """Курсорная пагинация: обход в обе стороны, равные ключи, подделки."""
+
+    PER_PAGE = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Инструмент', slug='tools')
+        product_type = ProductType.objects.create(
+            title='Молотки',
+            slug='hammers',
+            category=category
+        )
+        yesterday = timezone.now() - timezone.timedelta(days=1)
+        # Много одинаковых рейтингов: порядок внутри них задаёт id.
+        Product.objects.bulk_create([
+            Product(
+                title=f'Молоток {number}',
+                description='Описание',
+                parameters='Параметры',
+                pub_date=yesterday,
+                price=100,
+                average_rating=number % 3,
+                category=category,
+                product_type=product_type
+            )
+            for number in range(11)
+        ])
+        cls.expected = list(
+            Product.objects.order_by('-average_rating', '-id').values_list(
+                'pk', flat=True
+            )
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def paginator(self):
+        return KeysetPaginator(Product.objects.for_listing(), self.PER_PAGE)
+
+    def test_cursor_round_trip(self):
+        paginator = self.paginator()
+        pages = [paginator.page()]
+        while pages[-1].next_cursor:
+            pages.append(paginator.page(pages[-1].next_cursor))
+        self.assertEqual(
+            [product.pk for page in pages for product in page.object_list],
+            self.expected
+        )
+        self.assertEqual([page.number for page in pages], [1, 2, 3])
+        self.assertIsNone(pages[0].previous_cursor)
+        for page, previous in zip(pages[1:], pages):
+            back = paginator.page(page.previous_cursor)
+            self.assertEqual(back.number, previous.number)
+            self.assertEqual(
+                [product.pk for product in back.object_list],
+                [product.pk for product in previous.object_list]
+            )
+
+    def test_invalid_cursor_returns_first_page(self):
+        paginator = self.paginator()
+        cursor = paginator.page().next_cursor
+        for bad in ('garbage', cursor[:-2] + 'xx', cursor.replace(':', '.', 1)):
+            with self.subTest(cursor=bad):
+                page = paginator.page(bad)
+                self.assertEqual(page.number, 1)
+                self.assertEqual(
+                    [product.pk for product in page.object_list],
+                    self.expected[:self.PER_PAGE]
+                )
+
+    def test_setting_read_per_request(self):
+        url = reverse('main:index')
+        with override_settings(CATALOG_KEYSET_PAGINATION=True):
+            response = self.client.get(url + '?cursor=garbage')
+        self.assertTrue(response.context['page_obj'].is_keyset)
+        cache.clear()
+        with override_settings(CATALOG_KEYSET_PAGINATION=False):
+            response = self.client.get(url)
+        self.assertFalse(getattr(response.context['page_obj'], 'is_keyset', False))
+
+
+class PageCacheTest(TestCase):
+    """Кэш страниц для анонимов: попадания, обход и сброс."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title='Инструмент', slug='tools')
+        product_type = ProductType.objects.create(
+            title='Молотки',
+            slug='hammers',
+            category=cls.category
+        )
+        cls.product = Product.objects.create(
+            title='Молоток',
+            description='Описание',
+            parameters='Параметры',
+            pub_date=timezone.now() - timezone.timedelta(days=1),
+            price=100,
+            category=cls.category,
+            product_type=product_type
+        )
+        cls.url = reverse('main:category_detail', args=('tools',))
+
+    def setUp(self):
+        cache.clear()
+
+    def status(self, url=None, **query):
+        response = self.client.get(url or self.url, query)
+        self.assertEqual(response.status_code, 200)
+        return response[CACHE_STATUS_HEADER]
+
+    def test_hit_after_miss(self):
+        self.assertEqual(self.status(), 'MISS')
+        self.assertEqual(self.status(), 'HIT')
+
+    def test_query_order_does_not_matter(self):
+        self.assertEqual(self.client.get(
+            self.url + '?page=1&rating=4'
+        )[CACHE_STATUS_HEADER], 'MISS')
+        self.assertEqual(self.client.get(
+            self.url + '?rating=4&page=1'
+        )[CACHE_STATUS_HEADER], 'HIT')
+        self.assertEqual(self.status(rating=3), 'MISS')
+
+    def test_unknown_params_bypass(self):
+        self.assertEqual(self.status(utm_source='mail'), 'BYPASS')
+        self.assertEqual(self.status(utm_source='mail'), 'BYPASS')
+
+    def test_shoppers_bypass(self):
+        self.client.post(reverse('main:cart_add_product', args=(self.product.pk,)))
+        self.assertEqual(self.status(), 'BYPASS')
+        self.client.cookies.clear()
+        self.client.force_login(User.objects.create_user(username='u', password='x'))
+        self.assertEqual(self.status(), 'BYPASS')
+
+    def test_catalog_change_invalidates(self):
+        self.status()
+        self.product.title = 'Кувалда'
+        self.product.save()
+        self.assertEqual(self.status(), 'MISS')
+        self.assertContains(self.client.get(self.url), 'Кувалда')
+
+    @override_settings(PAGE_CACHE_TIMEOUTS={'login': 60})
+    def test_page_with_csrf_token_not_stored(self):
+        url = reverse('login')
+        # Первый ответ ставит куку csrftoken, дальше она уже есть.
+        self.client.get(url)
+        self.assertEqual(self.status(url), 'MISS')
+        self.assertEqual(self.status(url), 'MISS')
+
+
+class FacetCellsTest(TestCase):
+    """Куб фасетов: кэшируется один на тип, диапазоны цен — нет."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Инструмент', slug='tools')
+        cls.product_type = ProductType.objects.create(
+            title='Молотки',
+            slug='hammers',
+            category=category
+        )
+        yesterday = timezone.now() - timezone.timedelta(days=1)
+        Product.objects.bulk_create([
+            Product(
+                title=f'Молоток {price}',
+                description='Описание',
+                parameters='Параметры',
+                pub_date=yesterday,
+                price=price,
+                category=category,
+                product_type=cls.product_type
+            )
+            for price in (100, 700, 3000)
+        ])
+        cls.category = category
+        cls.user = User.objects.create_user(username='rater', password='x')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_rating_refreshes_cube(self):
+        product = Product.objects.get(price=700)
+        self.assertEqual(
+            facets.build_facets(
+                facets.facet_cells(self.product_type), {}
+            )['ratings'],
+            []
+        )
+        rating = Rating.objects.create(
+            user=self.user, product=product, rating=5
+        )
+        built = facets.build_facets(facets.facet_cells(self.product_type), {})
+        self.assertEqual(built['ratings'][0], (4, 'от 4 ★', 1))
+        rating.delete()
+        built = facets.build_facets(facets.facet_cells(self.product_type), {})
+        self.assertEqual(built['ratings'], [])
+
+    def test_unpublished_category_refreshes_cube(self):
+        facets.facet_cells(self.product_type)
+        self.category.is_published = False
+        self.category.save()
+        built = facets.build_facets(facets.facet_cells(self.product_type), {})
+        self.assertEqual(built['total'], 0)
+
+    def test_full_cube_cached(self):
+        cells = facets.facet_cells(self.product_type)
+        with self.assertNumQueries(0):
+            self.assertEqual(facets.facet_cells(self.product_type), cells)
+        self.assertEqual(facets.build_facets(cells, {})['total'], 3)
+
+    def test_price_range_not_cached(self):
+        with mock.patch.object(facets.cache, 'set') as cache_set:
+            cells = facets.facet_cells(self.product_type, 500.5, 3000)
+        cache_set.assert_not_called()
+        built = facets.build_facets(cells, {})
+        self.assertEqual(
+            (built['total'], built['min_price'], built['max_price']),
+            (2, 700, 3000)
+        )
+
+
+class CartTest(TestCase):
+    """Добавление в корзину: только опубликованные продукты."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='buyer', password='x')
+        category = Category.objects.create(title='Инструмент', slug='tools')
+        product_type = ProductType.objects.create(
+            title='Молотки',
+            slug='hammers',
+            category=category
+        )
+        yesterday = timezone.now() - timezone.timedelta(days=1)
+        cls.product, cls.hidden = [
+            Product.objects.create(
+                title=title,
+                description='Описание',
+                parameters='Параметры',
+                pub_date=yesterday,
+                price=100,
+                category=category,
+                product_type=product_type,
+                is_published=is_published
+            )
+            for title, is_published in (('Молоток', True), ('Кувалда', False))
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def add_url(self, product):
+        return reverse('main:cart_add_product', args=(product.pk,))
+
+    def test_service_rejects_unpublished(self):
+        services.add_to_cart(self.user, self.product.pk)
+        services.add_to_cart(self.user, self.product.pk)
+        with self.assertRaises(Product.DoesNotExist):
+            services.add_to_cart(self.user, self.hidden.pk)
+        self.assertEqual(
+            list(CartItem.objects.values_list('product_id', 'quantity')),
+            [(self.product.pk, 2)]
+        )
+
+    def test_view_returns_404_for_unpublished(self):
+        for login in (False, True):
+            with self.subTest(login=login):
+                if login:
+                    self.client.force_login(self.user)
+                response = self.client.post(self.add_url(self.hidden))
+                self.assertEqual(response.status_code, 404)
+        self.assertFalse(CartItem.objects.exists())
+
+
+class AnonymousShoppingTest(TestCase):
+    """Корзина и избранное анонима в подписанной куке и перенос при входе."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='buyer', password='secret')
+        category = Category.objects.create(title='Инструмент', slug='tools')
+        product_type = ProductType.objects.create(
+            title='Молотки',
+            slug='hammers',
+            category=category
+        )
+        yesterday = timezone.now() - timezone.timedelta(days=1)
+        cls.first, cls.second = [
+            Product.objects.create(
+                title=title,
+                description='Описание',
+                parameters='Параметры',
+                pub_date=yesterday,
+                price=price,
+                category=category,
+                product_type=product_type
+            )
+            for title, price in (('Молоток', 100), ('Кувалда', 300))
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def add_to_cart(self, product):
+        return self.client.post(
+            reverse('main:cart_add_product', args=(product.pk,))
+        )
+
+    def test_state_kept_in_signed_cookie(self):
+        self.add_to_cart(self.first)
+        self.add_to_cart(self.first)
+        self.client.post(
+            reverse('main:favorite_add_product', args=(self.second.pk,)),
+            HTTP_REFERER='/'
+        )
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(Favorite.objects.exists())
+        summary = self.client.get(reverse('main:shopping_api')).json()
+        self.assertEqual(summary['cart']['quantity'], 2)
+        self.assertEqual(summary['favorites']['product_ids'], [self.second.pk])
+
+    def test_tampered_cookie_is_reset(self):
+        self.add_to_cart(self.first)
+        value = self.client.cookies[COOKIE_NAME].value
+        self.client.cookies[COOKIE_NAME] = value[:-2] + 'xx'
+        response = self.client.get(reverse('main:shopping_api'))
+        self.assertEqual(response.json()['cart']['quantity'], 0)
+        self.assertEqual(response.cookies[COOKIE_NAME].value, '')
+
+    def test_login_merges_into_account(self):
+        services.add_to_cart(self.user, self.first.pk)
+        self.add_to_cart(self.first)
+        self.add_to_cart(self.second)
+        self.add_to_cart(self.second)
+        self.client.post(
+            reverse('main:favorite_add_product', args=(self.first.pk,)),
+            HTTP_REFERER='/'
+        )
+        response = self.client.post(
+            reverse('login'),
+            {'username': 'buyer', 'password': 'secret'}
+        )
+        self.assertEqual(response.status_code, 302)
+        # Позиция, которая уже была у пользователя, не меняется.
+        self.assertEqual(
+            sorted(CartItem.objects.filter(cart__user=self.user).values_list(
+                'product_id', 'quantity'
+            )),
+            [(self.first.pk, 1), (self.second.pk, 2)]
+        )
+        self.assertEqual(
+            list(Favorite.objects.get(user=self.user).product.all()),
+            [self.first]
+        )
+        self.assertEqual(response.cookies[COOKIE_NAME].value, '')
+
+    def test_listing_offers_favorites_and_stays_cached(self):
+        url = reverse('main:index')
+        response = self.client.get(url)
+        self.assertContains(response, 'data-shopping-op="favorite_add"')
+        self.assertNotContains(response, 'csrfmiddlewaretoken')
+        self.assertEqual(self.client.get(url)[CACHE_STATUS_HEADER], 'HIT')
+        api = self.client.get(reverse('main:shopping_api'))
+        self.assertIn('csrftoken', api.cookies)
+
+
+class JsonApiTest(TestCase):
+    """JSON-ответы: корзина и избранное, комментарии, подсказки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='buyer', password='x')
+        category = Category.objects.create(title='Инструмент', slug='tools')
+        product_type = ProductType.objects.create(
+            title='Молотки',
+            slug='hammers',
+            category=category
+        )
+        yesterday = timezone.now() - timezone.timedelta(days=1)
+        cls.product, cls.hidden = [
+            Product.objects.create(
+                title=title,
+                description='Описание',
+                parameters='Параметры',
+                pub_date=yesterday,
+                price=150,
+                category=category,
+                product_type=product_type,
+                is_published=is_published
+            )
+            for title, is_published in (('Молоток', True), ('Молот', False))
+        ]
+        for number in range(25):
+            Comment.objects.create(
+                text=f'Отзыв {number}',
+                author=cls.user,
+                product_id=cls.product
+            )
+        cls.comments_url = reverse(
+            'main:comment_list',
+            args=('tools', 'hammers', cls.product.pk)
+        )
+
+    def setUp(self):
+        cache.clear()
+        autocomplete._state.update(index=None, version=None)
+
+    def post_operations(self, operations):
+        return self.client.post(
+            reverse('main:shopping_api'),
+            json.dumps({'operations': operations}),
+            content_type='application/json'
+        )
+
+    def test_shopping_summary_shape(self):
+        self.client.force_login(self.user)
+        response = self.post_operations([
+            {'op': 'cart_add', 'product_id': self.product.pk, 'quantity': 2},
+            {'op': 'cart_add', 'product_id': self.hidden.pk},
+            {'op': 'favorite_add', 'product_id': self.product.pk},
+            {'op': 'favorite_add', 'product_id': self.hidden.pk},
+        ])
+        self.assertEqual(response.status_code, 200)
+        expected = {
+            'cart': {
+                'product_ids': [self.product.pk],
+                'count': 1,
+                'quantity': 2,
+                'price': 300,
+            },
+            'favorites': {'product_ids': [self.product.pk], 'count': 1},
+        }
+        self.assertEqual(response.json(), expected)
+        self.assertEqual(
+            self.client.get(reverse('main:shopping_api')).json(), expected
+        )
+
+    def test_shopping_rejects_bad_payload(self):
+        for body in ('{', '[]', '{"operations": [{"op": "drop"}]}'):
+            with self.subTest(body=body):
+                response = self.client.post(
+                    reverse('main:shopping_api'),
+                    body,
+                    content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+    def test_comments_cursor(self):
+        first = self.client.get(self.comments_url, {'format': 'json'}).json()
+        self.assertEqual(sorted(first), ['comments', 'count', 'next_cursor'])
+        self.assertEqual(first['count'], 25)
+        self.assertEqual(len(first['comments']), 20)
+        self.assertEqual(
+            sorted(first['comments'][0]),
+            ['author', 'created_at', 'id', 'text']
+        )
+        second = self.client.get(
+            self.comments_url,
+            {'format': 'json', 'comments_cursor': first['next_cursor']}
+        ).json()
+        self.assertEqual(len(second['comments']), 5)
+        self.assertIsNone(second['next_cursor'])
+        self.assertEqual(
+            [comment['id'] for comment in first['comments'] + second['comments']],
+            list(Comment.objects.order_by('created_at', 'id').values_list(
+                'pk', flat=True
+            ))
+        )
+
+    def test_autocomplete_only_published(self):
+        response = self.client.get(reverse('main:autocomplete'), {'q': 'мол'})
+        data = response.json()
+        self.assertEqual(sorted(data), sorted(autocomplete.KINDS))
+        self.assertEqual(
+            [(item['id'], item['title']) for item in data['products']],
+            [(self.product.pk, 'Молоток')]
+        )
+        self.assertEqual(sorted(data['products'][0]), ['id', 'rank', 'title', 'url'])
+
+
+class RatingCountersTest(TestCase):
+    """Счётчики рейтинга продукта, которые ведут сигналы оценок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(username=f'rater{number}', password='x')
+            for number in range(2)
+        ]
+        category = Category.objects.create(title='Инструмент', slug='tools')
+        product_type = ProductType.objects.create(
+            title='Молотки',
+            slug='hammers',
+            category=category
+        )
+        cls.first, cls.second = [
+            Product.objects.create(
+                title=f'Молоток {number}',
+                description='Описание',
+                parameters='Параметры',
+                pub_date=timezone.now(),
+                price=100,
+                category=category,
+                product_type=product_type
+            )
+            for number in range(2)
+        ]
+
+    def assert_counters(self, product, count, total):
+        product.refresh_from_db()
+        self.assertEqual(
+            (product.rating_count, product.rating_sum, product.average_rating),
+            (count, total, total / count if count else 0)
+        )
+
+    def test_signals_keep_counters(self):
+        rating = Rating.objects.create(
+            user=self.users[0], product=self.first, rating=4
+        )
+        Rating.objects.create(user=self.users[1], product=self.first, rating=1)
+        self.assert_counters(self.first, 2, 5)
+
+        rating.rating = 2
+        rating.save()
+        self.assert_counters(self.first, 2, 3)
+
+        rating.product = self.second
+        rating.save()
+        self.assert_counters(self.first, 1, 1)
+        self.assert_counters(self.second, 1, 2)
+
+        rating.delete()
+        self.assert_counters(self.second, 0, 0)
+        self.assert_counters(self.first, 1, 1)
+
+    def test_rebuild_matches_signals(self):
+        Rating.objects.create(user=self.users[0], product=self.first, rating=5)
+        Rating.objects.create(user=self.users[1], product=self.first, rating=2)
+        Product.objects.update(rating_count=9, rating_sum=9, average_rating=1)
+        call_command('rebuild_ratings', stdout=io.StringIO())
+        self.assert_counters(self.first, 2, 7)
+        self.assert_counters(self.second, 0, 0)
+
+
+class QueryInstrumentationTest(TestCase):
+    """Учёт запросов к БД и бюджеты маршрутов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='buyer', password='x')
+        category = Category.objects.create(title='Инструмент', slug='tools')
+        product_type = ProductType.objects.create(
+            title='Молотки',
+            slug='hammers',
+            category=category
+        )
+        yesterday = timezone.now() - timezone.timedelta(days=1)
+        Product.objects.bulk_create([
+            Product(
+                title=f'Молоток {number}',
+                description='Описание',
+                parameters='Параметры',
+                pub_date=yesterday,
+                price=100 * number,
+                category=category,
+                product_type=product_type
+            )
+            for number in range(12)
+        ])
+        cls.product = Product.objects.first()
+        for number in range(25):
+            Comment.objects.create(
+                text=f'Отзыв {number}',
+                author=cls.user,
+                product_id=cls.product
+            )
+        services.add_to_cart(cls.user, cls.product.pk)
+        cls.urls = [
+            reverse('main:index'),
+            reverse('main:category_detail', args=('tools',)),
+            reverse('main:product_type_detail', args=('tools', 'hammers')),
+            reverse(
+                'main:product_detail',
+                args=('tools', 'hammers', cls.product.pk)
+            ),
+            reverse(
+                'main:comment_list',
+                args=('tools', 'hammers', cls.product.pk)
+            ),
+            reverse('main:search') + '?q=молоток',
+            reverse('main:cart_view', args=('buyer',)),
+            reverse('main:favorite_view', args=('buyer',)),
+            reverse('main:history_view'),
+        ]
+
+    def setUp(self):
+        # Снимки и страницы в кэше не должны пережить откат базы.
+        cache.clear()
+
+    def test_fingerprint_ignores_values(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s) AND a = 'x' LIMIT 21"),
+            fingerprint("SELECT * FROM t WHERE id IN (%s) AND a = 'y'  LIMIT 3"),
+        )
+
+    def test_recorder_groups_repeated_queries(self):
+        recorder = QueryRecorder()
+        with recorder.record():
+            for product in Product.objects.all()[:4]:
+                Product.objects.filter(pk=product.pk).first()
+        self.assertEqual(recorder.count, 5)
+        [(_, count)] = recorder.duplicates()
+        self.assertEqual(count, 4)
+
+    @override_settings(SQL_BUDGET_RAISE=True, SQL_LOG_REQUESTS=True)
+    def test_pages_fit_budgets(self):
+        self.client.force_login(self.user)
+        for url in self.urls:
+            with self.subTest(url=url):
+                with self.assertLogs('main.instrumentation', 'INFO') as logs:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('db;dur=', response['Server-Timing'])
+                self.assertIn('"view": "main:', logs.output[-1])
+
+    @override_settings(
+        SQL_BUDGET_RAISE=True,
+        SQL_BUDGETS={'main:index': {'queries': 1}}
+    )
+    def test_budget_exceeded_raises(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('main:index'))
+
+    @override_settings(
+        SQL_BUDGET_RAISE=False,
+        SQL_BUDGETS={'main:index': {'queries': 1}}
+    )
+    def test_budget_exceeded_logs_warning(self):
+        with self.assertLogs('main.instrumentation', 'INFO') as logs:
+            self.client.get(reverse('main:index'))
+        # Без SQL_LOG_REQUESTS в логе только предупреждение.
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(logs.records[0].levelname, 'WARNING')
+        self.assertIn('main:index', logs.output[0])
+
+
+class CatalogImportExportTest(TestCase):
+    """Выгрузка каталога и загрузка её обратно с изменениями."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Инструмент', slug='tools')
+        ProductType.objects.create(
+            title='Молотки',
+            slug='hammers',
+            category=category
+        )
+        cls.product_type = ProductType.objects.create(
+            title='Пилы',
+            slug='saws',
+            category=category
+        )
+        Manufacturer.objects.create(name='Зубр')
+        cls.product = Product.objects.create(
+            title='Молоток',
+            description='Описание',
+            parameters='Параметры',
+            pub_date=timezone.now(),
+            price=100,
+            category=category,
+            product_type=ProductType.objects.get(slug='hammers')
+        )
+
+    def export(self, fmt):
+        stream = io.StringIO()
+        catalog_io.write_rows(
+            stream, fmt, catalog_io.export_rows(Product.objects.all())
+        )
+        return stream.getvalue()
+
+    def load(self, text, fmt):
+        rejected = []
+        importer = catalog_io.ProductImporter(batch_size=2).run(
+            catalog_io.read_rows(io.StringIO(text), fmt),
+            on_reject=lambda number, row, errors: rejected.append(
+                (number, sorted(errors))
+            )
+        )
+        return importer, rejected
+
+    def test_unchanged_export_is_not_written(self):
+        for fmt in catalog_io.FORMATS:
+            with self.subTest(fmt=fmt):
+                importer, rejected = self.load(self.export(fmt), fmt)
+                self.assertEqual(
+                    (importer.created, importer.updated, importer.unchanged),
+                    (0, 0, 1)
+                )
+                self.assertEqual(rejected, [])
+
+    def test_upsert_and_rejects(self):
+        exported = self.export('csv')
+        header, row = exported.splitlines()[:2]
+        lines = [
+            header,
+            row.replace('Молоток', 'Кувалда').replace(',hammers,', ',saws,'),
+            ',Пила,Описание,Параметры,,saws,Зубр,250,,',
+            ',Пила,Описание,Параметры,,unknown,,250,,',
+            ',Пила,Описание,Параметры,,saws,,-1,,',
+            '999,Пила,Описание,Параметры,,saws,,10,,',
+        ]
+        importer, rejected = self.load('\n'.join(lines) + '\n', 'csv')
+        self.assertEqual((importer.created, importer.updated), (1, 1))
+        self.assertEqual(
+            sorted(rejected),
+            [(4, ['product_type']), (5, ['price']), (6, ['id'])]
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.title, 'Кувалда')
+        self.assertEqual(self.product.product_type, self.product_type)
+        created = Product.objects.get(title='Пила')
+        self.assertEqual(created.category_id, self.product_type.category_id)
+        self.assertEqual(created.manufacturer.name, 'Зубр')
+        if search.is_available():
+            found = search.search_products(Product.objects.all(), 'кувалда')
+            self.assertEqual(list(found), [self.product])
+
+
+@unittest.skipUnless(search.is_available(), 'индекс FTS5 есть только в SQLite')
+class SearchTest(TestCase):
+    """Полнотекстовый поиск: релевантность, публикация и запасной путь."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Инструмент', slug='tools')
+        product_type = ProductType.objects.create(
+            title='Молотки',
+            slug='hammers',
+            category=category
+        )
+        yesterday = timezone.now() - timezone.timedelta(days=1)
+
+        def create(title, description, **fields):
+            return Product.objects.create(
+                title=title,
+                description=description,
+                parameters='Параметры',
+                pub_date=yesterday,
+                price=100,
+                category=category,
+                product_type=product_type,
+                **fields
+            )
+
+        cls.in_body = create('Набор', 'В наборе есть молоток')
+        cls.in_title = create('Молоток слесарный', 'Описание')
+        cls.hidden = create('Молоток скрытый', 'Описание', is_published=False)
+        create('Отвёртка', 'Описание')
+
+    def test_title_ranks_above_body(self):
+        found = search.search_products(
+            Product.objects.exclude(pk=self.hidden.pk), 'молотки'
+        )
+        self.assertEqual(list(found), [self.in_title, self.in_body])
+        self.assertLess(found[0].search_rank, found[1].search_rank)
+
+    def test_only_published(self):
+        found = search.search_products(Product.objects.for_listing(), 'молоток')
+        self.assertEqual(list(found), [self.in_title, self.in_body])
+        self.assertEqual(found.count(), 2)
+
+    def test_empty_query(self):
+        self.assertFalse(search.search_products(Product.objects.all(), '!!'))
+
+    def test_fallback_without_index(self):
+        with mock.patch.object(search, 'is_available', return_value=False):
+            found = search.search_products(
+                Product.objects.for_listing(), 'олоток'
+            )
+            # LIKE в SQLite не сворачивает регистр кириллицы.
+            self.assertEqual(set(found), {self.in_title, self.in_body})
+
+
+class AutocompleteTest(TestCase):
+    """Подсказки поиска: разделы, ранги по рейтингу, отложенная публикация."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='rater', password='x')
+        cls.category = Category.objects.create(title='Инструмент', slug='tools')
+        cls.empty_category = Category.objects.create(
+            title='Инвентарь',
+            slug='inventory'
+        )
+        cls.product_type = ProductType.objects.create(
+            title='Молотки',
+            slug='hammers',
+            category=cls.category
+        )
+        ProductType.objects.create(
+            title='Инструменты без продуктов',
+            slug='empty',
+            category=cls.category
+        )
+        yesterday = timezone.now() - timezone.timedelta(days=1)
+        cls.first, cls.second = [
+            Product.objects.create(
+                title=title,
+                description='Описание',
+                parameters='Параметры',
+                pub_date=yesterday,
+                price=100,
+                category=cls.category,
+                product_type=cls.product_type
+            )
+            for title in ('Молоток слесарный', 'Молоток столярный')
+        ]
+
+    def setUp(self):
+        cache.clear()
+        autocomplete._state.update(index=None, version=None)
+
+    def titles(self, prefix, kind=autocomplete.PRODUCT):
+        return [item['title'] for item in autocomplete.suggest(prefix)[kind]]
+
+    def test_sections_need_published_products(self):
+        self.assertEqual(self.titles('ин', autocomplete.CATEGORY), ['Инструмент'])
+        self.assertEqual(
+            self.titles('мол', autocomplete.PRODUCT_TYPE), ['Молотки']
+        )
+        self.assertEqual(self.titles('ин', autocomplete.PRODUCT_TYPE), [])
+
+    def test_rating_changes_rank(self):
+        first, second = 'Молоток слесарный', 'Молоток столярный'
+        self.assertEqual(self.titles('молоток'), [first, second])
+        rating = Rating.objects.create(
+            user=self.user, product=self.second, rating=5
+        )
+        self.assertEqual(self.titles('молоток'), [second, first])
+        rating.product = self.first
+        rating.save()
+        self.assertEqual(self.titles('мо'), [first, second])
+        other = Rating.objects.create(
+            user=User.objects.create_user(username='other', password='x'),
+            product=self.second,
+            rating=4
+        )
+        rating.rating = 1
+        rating.save()
+        self.assertEqual(self.titles('молоток'), [second, first])
+        other.delete()
+        self.assertEqual(self.titles('мо'), [first, second])
+
+    def test_scheduled_product_appears_without_changes(self):
+        now = timezone.now()
+        Product.objects.create(
+            title='Молоток отбойный',
+            description='Описание',
+            parameters='Параметры',
+            pub_date=now + timezone.timedelta(minutes=5),
+            price=100,
+            category=self.category,
+            product_type=self.product_type
+        )
+        self.assertNotIn('Молоток отбойный', self.titles('молоток'))
+        later = now + timezone.timedelta(minutes=7)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertIn('Молоток отбойный', self.titles('молоток'))
+
+
+class ImageVariantsTest(unittest.TestCase):
+    """Копии картинок: существующие не пересоздаются без force."""
+
+    def test_force_reencodes_existing_variants(self):
+        storage = InMemoryStorage()
+        buffer = io.BytesIO()
+        Image.new('RGB', (400, 300), 'red').save(buffer, 'JPEG')
+        name = storage.save('product/hammer.jpg', ContentFile(buffer.getvalue()))
+        manifest = images.generate_variants(name, storage)
+        path = manifest['webp']['320']
+        storage.delete(path)
+        storage.save(path, ContentFile(b'stale'))
+
+        self.assertEqual(images.generate_variants(name, storage), manifest)
+        with storage.open(path) as file:
+            self.assertEqual(file.read(), b'stale')
+
+        self.assertEqual(
+            images.generate_variants(name, storage, force=True), manifest
+        )
+        with storage.open(path) as file:
+            self.assertEqual(Image.open(file).format, 'WEBP')
+
+
+class AdminScalabilityTest(TestCase):
+    """Списки админки не делают запросов на строку, действия — один UPDATE."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='admin',
+            password='x'
+        )
+        cls.category = Category.objects.create(title='Инструмент', slug='tools')
+        cls.product_type = ProductType.objects.create(
+            title='Молотки',
+            slug='hammers',
+            category=cls.category
+        )
+        cls.manufacturer = Manufacturer.objects.create(name='Зубр')
+        cls.add_rows(3)
+
+    @classmethod
+    def add_rows(cls, count):
+        start = Product.objects.count()
+        products = Product.objects.bulk_create([
+            Product(
+                title=f'Молоток {number}',
+                description='Описание',
+                parameters='Параметры',
+                pub_date=timezone.now() - timezone.timedelta(days=1),
+                price=100,
+                category=cls.category,
+                product_type=cls.product_type,
+                manufacturer=cls.manufacturer
+            )
+            for number in range(start, start + count)
+        ])
+        users = User.objects.bulk_create([
+            User(username=f'buyer{number}')
+            for number in range(start, start + count)
+        ])
+        for user, product in zip(users, products):
+            Comment.objects.create(text='Отзыв', author=user, product_id=product)
+            Rating.objects.create(user=user, product=product, rating=4)
+            services.add_to_cart(user, product.pk)
+            services.checkout(user)
+            Favorite.objects.create(user=user).product.add(product)
+        return products
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def changelist_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelists_do_not_query_per_row(self):
+        urls = [
+            reverse(f'admin:main_{model}_changelist')
+            for model in (
+                'product', 'comment', 'rating', 'cart', 'favorite',
+                'orderhistory', 'producttype',
+            )
+        ]
+        before = {url: self.changelist_queries(url) for url in urls}
+        self.add_rows(5)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.changelist_queries(url), before[url])
+
+    def test_order_change_form(self):
+        order = OrderHistory.objects.first()
+        response = self.client.get(
+            reverse('admin:main_orderhistory_change', args=(order.pk,))
+        )
+        self.assertContains(response, order.items.first().title)
+
+    def run_action(self, action, **data):
+        products = Product.objects.order_by('pk')[:2]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('admin:main_product_changelist'),
+                {
+                    'action': action,
+                    '_selected_action': [product.pk for product in products],
+                    **data,
+                }
+            )
+        self.assertEqual(response.status_code, 302)
+        updates = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('UPDATE "main_product"')
+        ]
+        self.assertEqual(len(updates), 1)
+
+    def test_publish_actions(self):
+        self.run_action('unpublish')
+        self.assertEqual(Product.objects.filter(is_published=False).count(), 2)
+        self.run_action('publish')
+        self.assertFalse(Product.objects.filter(is_published=False).exists())
+
+    def test_change_price_action(self):
+        self.run_action('change_price', percent='-12.5')
+        self.assertEqual(
+            sorted(Product.objects.values_list('price', flat=True)),
+            [87.5, 87.5, 100]
+        )
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'sqlite_stat1')
+    def test_unfiltered_count_is_estimated(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        with mock.patch('main.paginators.ESTIMATED_COUNT_THRESHOLD', 1):
+            with CaptureQueriesContext(connection) as queries:
+                count = EstimatedCountPaginator(Product.objects.all(), 10).count
+            filtered = EstimatedCountPaginator(
+                Product.objects.filter(price__gt=1000), 10
+            ).count
+        self.assertEqual(count, 3)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+        self.assertEqual(filtered, 0)
@@ -72,6 +72,11 @@ urlpatterns = [
         views.ProductTypeCreateView.as_view(),
         name='product_type_add'
     ),
+    path(
+        'products/<slug:category>/<slug:product_type>/product/<int:product_id>/comments/',
+        views.CommentListView.as_view(),
+        name='comment_list'
+    ),
     path(
         'products/<slug:category>/<slug:product_type>/product/<int:product_id>/add_comment/',
         views.CommentCreateView.as_view(),
@@ -107,6 +112,21 @@ urlpatterns = [
         views.CartCreateView.as_view(),
         name='cart_add_product'
     ),
+    path(
+        'api/shopping/',
+        views.ShoppingApiView.as_view(),
+        name='shopping_api'
+    ),
+    path(
+        'cart_view/',
+        views.AnonymousCartView.as_view(),
+        name='anonymous_cart_view'
+    ),
+    path(
+        'favorite_view/',
+        views.AnonymousFavoriteView.as_view(),
+        name='anonymous_favorite_view'
+    ),
     path(
         'cart_view/<username>/',
         views.CartDetailView.as_view(),
@@ -127,11 +147,21 @@ urlpatterns = [
         views.SearchResultsListView.as_view(),
         name='search'
     ),
+    path(
+        'search/autocomplete/',
+        views.AutocompleteView.as_view(),
+        name='autocomplete'
+    ),
     path(
         'cart/item/<int:product_id>/delete/',
         views.CartDeleteItemView.as_view(),
         name='cart_delete_product'
     ),
+    path(
+        'cart/item/<int:product_id>/quantity/',
+        views.CartUpdateQuantityView.as_view(),
+        name='cart_update_quantity'
+    ),
     path(
         'favorite/item/<int:product_id>/delete',
         views.FavoriteDeleteItemView.as_view(),
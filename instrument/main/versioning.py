@@ -0,0 +1,33 @@
+"""
+Счётчики версий данных, общие для всех процессов.
+
+Счётчик хранится в кэше (в продакшене — в общем для воркеров
+бэкенде) и увеличивается при каждом изменении данных. Кэшированные
+структуры сравнивают свою версию с текущей и перестраиваются, когда
+она меняется; явная очистка кэша не нужна.
+"""
+from django.core.cache import cache
+
+CATALOG = 'catalog'
+
+
+def _key(namespace):
+    return f'version:{namespace}'
+
+
+def get_version(namespace=CATALOG):
+    """Текущая версия данных."""
+    version = cache.get(_key(namespace))
+    if version is None:
+        cache.add(_key(namespace), 1, None)
+        version = cache.get(_key(namespace), 1)
+    return version
+
+
+def bump_version(namespace=CATALOG):
+    """Увеличивает версию данных и возвращает новое значение."""
+    try:
+        return cache.incr(_key(namespace))
+    except ValueError:
+        cache.add(_key(namespace), 1, None)
+        return cache.incr(_key(namespace))
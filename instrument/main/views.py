@@ -1,32 +1,39 @@
-import datetime
+import json
+import uuid
 
 from django.contrib.auth.mixins import (LoginRequiredMixin,
                                         PermissionRequiredMixin)
-from django.db.models import Q
-from django.http import HttpResponseRedirect
-from django.shortcuts import get_object_or_404, redirect, reverse
+from django.http import (Http404, HttpResponseBadRequest, HttpResponseRedirect,
+                         JsonResponse)
+from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import ensure_csrf_cookie
 from django.views.generic import (CreateView, DeleteView, DetailView, ListView,
-                                  UpdateView, View)
+                                  TemplateView, UpdateView, View)
 from django.urls import reverse_lazy
 
+from . import facets, services, snapshots
+from .autocomplete import suggest
 from .forms import CommentForm, CustomUserChangeForm, ProductFilterForm, ProductRatingForm
 from .mixins import (
+    CatalogPaginationMixin,
     CategoryCreateUpdateDeleteMixin,
     CommentMixinCreateUpdateDeleteMixin,
+    CommentPaginationMixin,
     DispatchMixin,
     ProductCreateUpdateDeleteMixin,
     ProductTypeCreateUpdateDeleteMixin,
     CartAndFavViewMixin
 )
+from .paginators import CachedCountPaginator
+from .search import search_products
+from .shopping import ShoppingChanges, get_anonymous_shopping
 from .models import (
-    Cart,
     Category,
-    Comment,
     Product,
     ProductType,
     User,
     Favorite,
-    OrderHistory,
     Rating
 )
 
@@ -36,64 +43,71 @@ PAGINATE_CATEGORY = 15
 PAGINATE_CREATE = 6
 
 
-class MainPageListView(ListView):
+class MainPageListView(CatalogPaginationMixin, ListView):
     """Отображение главной страницы."""
 
     model = Product
     paginate_by = PAGINATE
     template_name = 'main/index.html'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.filter(is_published=True)
-        if self.request.user.is_authenticated:
-            context['favorites'] = Favorite.objects.get(user=self.request.user)
-        return context
-
     def get_queryset(self):
-        queryset = super().get_queryset().filter(
-            is_published=True,
-            pub_date__lte=datetime.datetime.now()
-        ).order_by('-average_rating')
-        return queryset
+        return Product.objects.for_listing().order_by(*self.keyset_ordering)
 
 
-class ProductDetailView(DetailView):
-    """Детальное отображение продукта"""
+class ProductDetailView(CommentPaginationMixin, TemplateView):
+    """
+    Детальное отображение продукта.
+
+    Общие для всех посетителей данные берутся из закэшированного
+    снимка продукта, к ним добавляются только данные пользователя.
+    """
 
-    model = Product
     template_name = 'main/product/detail_product.html'
-    pk_url_kwarg = 'product_id'
-    context_object_name = 'product'
+
+    def get_product(self):
+        product = snapshots.get_snapshot(self.kwargs['product_id'])
+        if product is None:
+            raise Http404('Продукт не найден.')
+        return product
+
+    def get_user_context(self, product):
+        """Данные текущего пользователя: его последняя оценка продукта."""
+        if not self.request.user.is_authenticated:
+            return {'user_rating': None}
+        return {
+            'user_rating': Rating.objects.filter(
+                user=self.request.user,
+                product_id=product['id']
+            ).order_by('-created_at', '-id').values_list(
+                'rating', flat=True
+            ).first()
+        }
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['comments'] = Comment.objects.filter(
-            product_id=self.kwargs['product_id']
-        )
-        if self.request.user.is_authenticated:
-            context['favorites'] = Favorite.objects.get(user=self.request.user)
+        product = self.get_product()
+        context['product'] = product
+        context['comments'] = self.get_comments_page(product['id'])
         context['form'] = CommentForm()
-        context['rating_form'] = ProductRatingForm()
-        ratings = Rating.objects.filter(product=self.get_object())
-        total_rating = sum([rating.rating for rating in ratings])
-        num_ratings = len(ratings)
-        if num_ratings > 0:
-            average_rating = total_rating / num_ratings
-        else:
-            average_rating = 0  # Если нет оценок, устанавливаем средний рейтинг как 0.
-        context['average_rating'] = average_rating
+        context.setdefault('rating_form', ProductRatingForm())
+        context['average_rating'] = product['average_rating']
+        context.update(self.get_user_context(product))
         return context
 
     def post(self, request, *args, **kwargs):
-        product = self.get_object()
+        product = self.get_product()
         form = ProductRatingForm(request.POST)
         if form.is_valid():
-            rating = form.cleaned_data['rating']
-            Rating.objects.create(product=product, user=request.user, rating=rating)
+            Rating.objects.create(
+                product_id=product['id'],
+                user=request.user,
+                rating=form.cleaned_data['rating']
+            )
             return HttpResponseRedirect(request.path)
         else:
-            return self.render_to_response(self.get_context_data(form=form))
+            return self.render_to_response(
+                self.get_context_data(rating_form=form)
+            )
 
 
 class ProductCreateView(
@@ -148,31 +162,34 @@ class CategoryListView(ListView):
     model = Category
     template_name = 'main/category/category_list.html'
     paginate_by = PAGINATE_CATEGORY
+    paginator_class = CachedCountPaginator
 
     def get_queryset(self):
         queryset = super().get_queryset().filter(
             is_published=True
-        )
+        ).order_by('title', 'id')
         return queryset
 
 
-class CategoryDetailView(DetailView):
+class CategoryDetailView(CatalogPaginationMixin, DetailView):
     """Детальное отображение категории."""
 
     model = Category
     template_name = 'main/category/category_detail.html'
+    paginate_by = PAGINATE
     slug_url_kwarg = 'category'
     context_object_name = 'select_category'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['product_types'] = ProductType.objects.filter(
-            category=self.get_object()
+            category=self.object,
+            is_published=True
         )
-        if self.request.user.is_authenticated:
-            context['favorites'] = Favorite.objects.get(user=self.request.user)
-        context['categories'] = Category.objects.all()
-        context['products'] = Product.objects.filter(category=self.object)
+        context.update(self.get_paginated_context(
+            Product.objects.for_listing().filter(category=self.object),
+            'products'
+        ))
         return context
 
 
@@ -219,7 +236,7 @@ class CategoryDeleteView(
         return HttpResponseRedirect(success_url)
 
 
-class ProductTypeDetailView(DetailView):
+class ProductTypeDetailView(CatalogPaginationMixin, DetailView):
     """Детальное отображение."""
 
     model = ProductType
@@ -230,26 +247,35 @@ class ProductTypeDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.filter(is_published=True)
-        if self.request.user.is_authenticated:
-            context['favorites'] = Favorite.objects.get(user=self.request.user)
 
-        form = ProductFilterForm(self.request.GET)
-        products = Product.objects.filter(
-            product_type=self.object
+        all_cells = facets.facet_cells(self.object)
+        form = ProductFilterForm(
+            self.request.GET or None,
+            manufacturers=[
+                (pk, name)
+                for pk, name, _ in facets.build_facets(
+                    all_cells, {}
+                )['manufacturers']
+            ]
+        )
+        filters = form.cleaned_data if form.is_bound and form.is_valid() else {}
+        if filters.get('min_price') is None and filters.get('max_price') is None:
+            cells = all_cells
+        else:
+            cells = facets.facet_cells(
+                self.object,
+                filters.get('min_price'),
+                filters.get('max_price')
+            )
+        context['facets'] = facets.build_facets(cells, filters)
+        form.apply_facets(context['facets'])
+        products = facets.filter_products(
+            Product.objects.for_listing().filter(product_type=self.object),
+            filters
         )
-
-        if form.is_valid():
-            max_price = form.cleaned_data['max_price']
-            manufacturer = form.cleaned_data['manufacturer']
-
-            if max_price:
-                products = products.filter(price__lte=max_price)
-            if manufacturer:
-                products = products.filter(manufacturer=manufacturer)
 
         context['form'] = form
-        context['products'] = products
+        context.update(self.get_paginated_context(products, 'products'))
 
         return context
 
@@ -296,6 +322,38 @@ class ProductTypeCreateView(
     template_name = 'main/product_type/product_type_create.html'
 
 
+class CommentListView(CommentPaginationMixin, View):
+    """
+    Следующая страница комментариев продукта для кнопки «Показать ещё»:
+    HTML-фрагмент или, с параметром format=json, JSON.
+    """
+
+    def get(self, request, *args, **kwargs):
+        product = snapshots.get_snapshot(self.kwargs['product_id'])
+        if product is None:
+            raise Http404('Продукт не найден.')
+        comments = self.get_comments_page(product['id'])
+        if request.GET.get('format') == 'json':
+            return JsonResponse({
+                'comments': [
+                    {
+                        'id': comment.pk,
+                        'author': comment.author.username,
+                        'text': comment.text,
+                        'created_at': comment.created_at,
+                    }
+                    for comment in comments
+                ],
+                'next_cursor': comments.next_cursor,
+                'count': product['comment_count'],
+            })
+        return render(
+            request,
+            'includes/comment_list.html',
+            {'product': product, 'comments': comments}
+        )
+
+
 class CommentUpdateView(
     LoginRequiredMixin,
     CommentMixinCreateUpdateDeleteMixin,
@@ -379,10 +437,11 @@ class ProfileUpdateView(LoginRequiredMixin, UpdateView):
 class CreatesListView(ListView):
     """Страница для наполнителя."""
 
-    model = Product
+    queryset = Product.objects.with_related()
     context_object_name = 'products'
     template_name = 'creates.html'
     paginate_by = PAGINATE_CREATE
+    paginator_class = CachedCountPaginator
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -391,13 +450,33 @@ class CreatesListView(ListView):
         return context
 
 
-class CartCreateView(LoginRequiredMixin, View):
+def cart_redirect(request):
+    """Переход в корзину пользователя или анонимного посетителя."""
+    if request.user.is_authenticated:
+        return redirect('main:cart_view', request.user.username)
+    return redirect('main:anonymous_cart_view')
+
+
+def get_published_product_id(product_id):
+    """Проверяет продукт перед записью в куку анонима."""
+    if not Product.objects.published().filter(pk=product_id).exists():
+        raise Http404('Продукт не найден.')
+    return product_id
+
+
+class CartCreateView(View):
     """Добавление продукта в корзину."""
 
     def post(self, request, product_id):
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        product = get_object_or_404(Product, pk=product_id)
-        cart.product.add(product)
+        if request.user.is_authenticated:
+            try:
+                services.add_to_cart(request.user, product_id)
+            except Product.DoesNotExist:
+                raise Http404('Продукт не найден.')
+        else:
+            get_anonymous_shopping(request).add_to_cart(
+                get_published_product_id(product_id)
+            )
         return redirect('main:index')
 
 
@@ -412,40 +491,77 @@ class CartDetailView(
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        cart, created = Cart.objects.get_or_create(user=self.request.user)
-        context['cart'] = cart
-        context['cart_price'] = sum([product.price for product in cart.product.all()])
-        if self.request.user.is_authenticated:
-            context['favorites'] = Favorite.objects.get(user=self.request.user)
+        context['items'] = services.cart_items(self.request.user)
+        totals = services.cart_totals(self.request.user)
+        context['cart_price'] = totals['price']
+        context['cart_quantity'] = totals['quantity']
+        # Ключ одной попытки оформления: повторная отправка формы
+        # не создаст второй заказ.
+        context['idempotency_key'] = uuid.uuid4().hex
         return context
 
 
-class CartDeleteItemView(LoginRequiredMixin, DeleteView):
-    """Удаление продукта из корзины."""
+class AnonymousCartView(TemplateView):
+    """Корзина посетителя, который ещё не вошёл на сайт."""
 
-    def post(self, request, product_id):
-        user = request.user
-        product = Product.objects.get(id=product_id)
-        cart = Cart.objects.get(user=user)
-        cart.product.remove(product)
-        return HttpResponseRedirect(self.get_success_url())
+    template_name = 'main/cart.html'
 
-    def get_success_url(self):
-        return reverse_lazy(
-            'main:cart_view',
-            kwargs={
-                'username': self.request.user.username
-            }
+    def dispatch(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return cart_redirect(request)
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        items = services.anonymous_cart_items(
+            get_anonymous_shopping(self.request)
         )
+        context['items'] = items
+        context['cart_price'] = sum(item.price * item.quantity for item in items)
+        context['cart_quantity'] = sum(item.quantity for item in items)
+        return context
+
+
+class CartUpdateQuantityView(View):
+    """Изменение количества продукта в корзине."""
 
+    def post(self, request, product_id):
+        try:
+            quantity = int(request.POST.get('quantity', 1))
+        except ValueError:
+            return HttpResponseBadRequest('Некорректное количество.')
+        if request.user.is_authenticated:
+            services.set_cart_quantity(request.user, product_id, quantity)
+        else:
+            get_anonymous_shopping(request).set_cart_quantity(
+                product_id, quantity
+            )
+        return cart_redirect(request)
 
-class FavoriteCreateView(LoginRequiredMixin, View):
+
+class CartDeleteItemView(View):
+    """Удаление продукта из корзины."""
+
+    def post(self, request, product_id):
+        if request.user.is_authenticated:
+            services.remove_from_cart(request.user, product_id)
+        else:
+            get_anonymous_shopping(request).remove_from_cart(product_id)
+        return cart_redirect(request)
+
+
+class FavoriteCreateView(View):
     """Добавление продукта в избранное."""
 
     def post(self, request, product_id):
-        favorite, created = Favorite.objects.get_or_create(user=request.user)
-        product = get_object_or_404(Product, pk=product_id)
-        favorite.product.add(product)
+        if request.user.is_authenticated:
+            favorite, created = Favorite.objects.get_or_create(user=request.user)
+            product = get_object_or_404(Product, pk=product_id)
+            favorite.product.add(product)
+        else:
+            get_anonymous_shopping(request).add_favorite(
+                get_published_product_id(product_id)
+            )
         return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
 
 
@@ -461,85 +577,148 @@ class FavoriteDetailView(
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         favorite, create = Favorite.objects.get_or_create(user=self.request.user)
-        context['favorites'] = Favorite.objects.get(user=self.request.user)
         context['favorite'] = favorite
+        context['products'] = favorite.product.with_related()
         return context
 
 
-class FavoriteDeleteItemView(LoginRequiredMixin, DeleteView):
+class AnonymousFavoriteView(TemplateView):
+    """Избранное посетителя, который ещё не вошёл на сайт."""
+
+    template_name = 'main/favorite.html'
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return redirect('main:favorite_view', request.user.username)
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['products'] = Product.objects.for_listing().filter(
+            pk__in=get_anonymous_shopping(self.request).favorites
+        )
+        return context
+
+
+class FavoriteDeleteItemView(View):
     """Удаление продукта из избранного."""
 
     def post(self, request, product_id):
-        user = request.user
-        product = Product.objects.get(id=product_id)
-        favorite = Favorite.objects.get(user=user)
-        favorite.product.remove(product)
+        if request.user.is_authenticated:
+            Favorite.product.through.objects.filter(
+                favorite__user=request.user,
+                product_id=product_id
+            ).delete()
+        else:
+            get_anonymous_shopping(request).remove_favorite(product_id)
         return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
 
-    def get_success_url(self):
-        return reverse_lazy(
-            'main:favorite_view',
-            kwargs={
-                'username': self.request.user.username
-            }
-        )
-
 
-class SearchResultsListView(ListView):
+class SearchResultsListView(CatalogPaginationMixin, ListView):
     """Система поиска продуктов на сайте."""
 
     model = Product
     context_object_name = 'products'
     template_name = 'main/search.html'
+    paginate_by = PAGINATE
+    keyset_pagination = False
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.filter(is_published=True)
-        if self.request.user.is_authenticated:
-            context['favorites'] = Favorite.objects.get(user=self.request.user)
+        context['query'] = self.query
         return context
 
     def get_queryset(self):
-        query = self.request.GET.get('q')
-        query = query.title()
-        object_list = Product.objects.filter(
-            Q(title__icontains=query)
+        self.query = self.request.GET.get('q', '').strip()
+        return search_products(Product.objects.for_listing(), self.query)
+
+
+class AutocompleteView(View):
+    """Подсказки поиска по началу названия."""
+
+    max_limit = 20
+
+    def get(self, request):
+        try:
+            limit = min(int(request.GET.get('limit', 8)), self.max_limit)
+        except ValueError:
+            limit = 8
+        return JsonResponse(
+            suggest(request.GET.get('q', ''), max(limit, 1)),
+            json_dumps_params={'ensure_ascii': False}
         )
-        return object_list
 
 
-class AddToOrderHistory(LoginRequiredMixin, CreateView):
-    """Добавление заказа в историю."""
+class ShoppingApiView(View):
+    """
+    Пакетные изменения корзины и избранного в JSON.
 
-    slug_url_kwarg = 'username'
-    slug_field = 'username'
+    POST принимает {"operations": [{"op": ..., "product_id": ...,
+    "quantity": ...}, ...]}, GET и POST возвращают состав, количество
+    и сумму корзины и избранного. GET выдаёт куку CSRF: формы
+    закэшированных страниц каталога токена не содержат.
+    """
 
-    def post(self, request, username):
-        user = User.objects.get(username=username)
-        cart = get_object_or_404(Cart, user=user)
-        products = cart.product.all()
-        order = OrderHistory.objects.create(user=user, cart=cart)
-        order.product.set(products)
-        cart.product.clear()
-        return redirect('main:cart_view', username)
+    def summary(self, request):
+        if request.user.is_authenticated:
+            return services.shopping_summary(request.user)
+        return services.anonymous_shopping_summary(
+            get_anonymous_shopping(request)
+        )
 
-    def dispatch(self, request, *args, **kwargs):
-        user = User.objects.get(username=kwargs['username'])
-        instance = Cart.objects.get(user=user)
-
-        if instance.user != request.user:
-            return reverse(
-                'main:cart_view',
-                kwargs={
-                    'username': user
-                }
+    @method_decorator(ensure_csrf_cookie)
+    def get(self, request):
+        return JsonResponse(self.summary(request))
+
+    def error(self, message):
+        return JsonResponse(
+            {'error': message},
+            status=400,
+            json_dumps_params={'ensure_ascii': False}
+        )
+
+    def post(self, request):
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return self.error('Некорректный JSON.')
+        if not isinstance(data, dict):
+            return self.error('Ожидается объект с ключом operations.')
+        try:
+            changes = ShoppingChanges.parse(data.get('operations'))
+        except ValueError as error:
+            return self.error(str(error))
+        if request.user.is_authenticated:
+            services.apply_shopping_changes(request.user, changes)
+        else:
+            get_anonymous_shopping(request).apply_changes(
+                changes,
+                set(services.published_prices(changes.added_ids))
             )
-        return super().dispatch(request, *args, **kwargs)
+        return JsonResponse(self.summary(request))
+
 
+class AddToOrderHistory(LoginRequiredMixin, View):
+    """Оформление заказа из корзины."""
+
+    def post(self, request, username):
+        if username != request.user.username:
+            return redirect('main:cart_view', request.user.username)
+        services.checkout(
+            request.user,
+            request.POST.get('idempotency_key', '')[:64]
+        )
+        return redirect('main:cart_view', request.user.username)
+
+
+class OrderHistoryListView(LoginRequiredMixin, CatalogPaginationMixin, ListView):
+    """История заказов пользователя, новые заказы первыми."""
 
-class OrderHistoryListView(ListView):
-    model = OrderHistory
     template_name = 'main/order.html'
+    context_object_name = 'orders'
+    paginate_by = PAGINATE
+    keyset_pagination = True
+    keyset_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
-        return OrderHistory.objects.filter(user=self.request.user)
+        return services.order_history(self.request.user)
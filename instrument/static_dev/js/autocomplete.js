@@ -0,0 +1,40 @@
+// Подсказки поиска по мере ввода для поля поиска в шапке сайта.
+document.addEventListener('DOMContentLoaded', function () {
+  const input = document.querySelector('input[data-autocomplete-url]');
+  if (!input) {
+    return;
+  }
+  const list = document.getElementById(input.getAttribute('list'));
+  let timer = null;
+  let controller = null;
+
+  input.addEventListener('input', function () {
+    clearTimeout(timer);
+    timer = setTimeout(function () {
+      const query = input.value.trim();
+      if (!query) {
+        list.replaceChildren();
+        return;
+      }
+      if (controller) {
+        controller.abort();
+      }
+      controller = new AbortController();
+      const url = input.dataset.autocompleteUrl + '?q=' + encodeURIComponent(query);
+      fetch(url, {signal: controller.signal})
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+          const options = [];
+          ['products', 'categories', 'product_types'].forEach(function (kind) {
+            data[kind].forEach(function (item) {
+              const option = document.createElement('option');
+              option.value = item.title;
+              options.push(option);
+            });
+          });
+          list.replaceChildren(...options);
+        })
+        .catch(function () {});
+    }, 150);
+  });
+});
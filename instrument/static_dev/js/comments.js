@@ -0,0 +1,24 @@
+// Кнопка «Показать ещё» под комментариями: следующая страница
+// подгружается HTML-фрагментом и встаёт на место кнопки.
+document.addEventListener('click', function (event) {
+  const link = event.target.closest('[data-comments-more]');
+  if (!link) {
+    return;
+  }
+  event.preventDefault();
+  link.classList.add('disabled');
+  fetch(link.dataset.commentsMore)
+    .then(function (response) {
+      if (!response.ok) {
+        throw new Error(response.statusText);
+      }
+      return response.text();
+    })
+    .then(function (html) {
+      link.insertAdjacentHTML('beforebegin', html);
+      link.remove();
+    })
+    .catch(function () {
+      window.location.href = link.href;
+    });
+});
@@ -0,0 +1,99 @@
+// Корзина и избранное без перезагрузки страницы.
+// Формы с атрибутом data-shopping-op отправляются в пакетный JSON API;
+// без JavaScript они работают как обычные формы.
+document.addEventListener('DOMContentLoaded', function () {
+  const api = document.body.dataset.shoppingApi;
+  const csrfCookie = 'csrftoken';
+  if (!api) {
+    return;
+  }
+
+  function readCsrfCookie() {
+    const prefix = csrfCookie + '=';
+    const cookie = document.cookie.split('; ').find(function (item) {
+      return item.startsWith(prefix);
+    });
+    return cookie ? decodeURIComponent(cookie.slice(prefix.length)) : '';
+  }
+
+  // Анонимам страницы каталога отдаются из кэша без токена в формах:
+  // токен берётся из куки, а если её ещё нет, её выдаёт GET к API.
+  function csrfToken(form) {
+    const input = form.querySelector('input[name="csrfmiddlewaretoken"]');
+    if (input) {
+      return Promise.resolve(input.value);
+    }
+    if (readCsrfCookie()) {
+      return Promise.resolve(readCsrfCookie());
+    }
+    return fetch(api, {credentials: 'same-origin'}).then(readCsrfCookie);
+  }
+
+  function submitForm(form) {
+    if (!form.querySelector('input[name="csrfmiddlewaretoken"]')) {
+      const input = document.createElement('input');
+      input.type = 'hidden';
+      input.name = 'csrfmiddlewaretoken';
+      input.value = readCsrfCookie();
+      form.appendChild(input);
+    }
+    form.submit();
+  }
+
+  function updateCounters(data) {
+    document.querySelectorAll('[data-cart-count]').forEach(function (badge) {
+      badge.textContent = data.cart.quantity || '';
+    });
+  }
+
+  function toggleFavorite(form, data) {
+    const productId = Number(form.dataset.productId);
+    const isFavorite = data.favorites.product_ids.includes(productId);
+    const state = isFavorite ? 'remove' : 'add';
+    form.dataset.shoppingOp = 'favorite_' + state;
+    form.action = form.dataset[state + 'Url'];
+    const button = form.querySelector('input[type="image"]');
+    if (button) {
+      button.src = form.dataset[state + 'Icon'];
+    }
+  }
+
+  document.addEventListener('submit', function (event) {
+    const form = event.target;
+    if (!form.dataset || !form.dataset.shoppingOp) {
+      return;
+    }
+    event.preventDefault();
+    csrfToken(form)
+      .then(function (token) {
+        return fetch(api, {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': token
+          },
+          body: JSON.stringify({
+            operations: [{
+              op: form.dataset.shoppingOp,
+              product_id: Number(form.dataset.productId)
+            }]
+          })
+        });
+      })
+      .then(function (response) {
+        if (!response.ok) {
+          throw new Error(response.statusText);
+        }
+        return response.json();
+      })
+      .then(function (data) {
+        updateCounters(data);
+        if (form.dataset.shoppingOp.startsWith('favorite_')) {
+          toggleFavorite(form, data);
+        }
+      })
+      .catch(function () {
+        submitForm(form);
+      });
+  });
+});